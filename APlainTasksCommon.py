@@ -1,23 +1,28 @@
 # coding: utf-8
 import sublime, sublime_plugin
-import itertools
+import locale
 
 ST3 = int(sublime.version()) >= 3000
-if not ST3:
-    import locale
+if ST3:
+    from .PlainTasksArchive import FILEMASK
+    from .PlainTasksDocument import get_document
+else:
+    from PlainTasksArchive import FILEMASK
+    from PlainTasksDocument import get_document
 
 
-def get_all_projects_and_separators(view):
-    # because tmLanguage need \n to make background full width of window
-    # multiline headers are possible, thus we have to split em to be sure that
-    # one header == one line
-    projects = itertools.chain(*[view.lines(r) for r in view.find_by_selector('keyword.control.header.todo')])
-    return sorted(list(projects) +
-                  view.find_by_selector('meta.punctuation.separator.todo'))
+_native_locale = []
+
+
+def use_native_locale():
+    '''Set locale of user once, on first use of dates rather than on plugin load'''
+    if ST3 and not _native_locale:
+        _native_locale.append(locale.setlocale(locale.LC_ALL, ''))
 
 
 class PlainTasksBase(sublime_plugin.TextCommand):
     def run(self, edit, **kwargs):
+        use_native_locale()
         settings = self.view.settings()
 
         self.taskpaper_compatible = settings.get('taskpaper_compatible', False)
@@ -46,7 +51,7 @@ class PlainTasksBase(sublime_plugin.TextCommand):
         self.project_postfix = settings.get('project_tag', True)
         self.archive_name = settings.get('archive_name', 'Archive:')
         # org-mode style archive stuff
-        self.archive_org_default_filemask = u'{dir}{sep}{base}_archive{ext}'
+        self.archive_org_default_filemask = FILEMASK
         self.archive_org_filemask = settings.get('archive_org_filemask', self.archive_org_default_filemask)
 
         if not ST3:
@@ -61,6 +66,12 @@ class PlainTasksBase(sublime_plugin.TextCommand):
         done_line_end = ' %s%s%s' % (tag, self.before_date_space, date if self.done_date else '')
         return done_line_end.replace('  ', ' ').rstrip(), date
 
+    def selected_rows(self, doc):
+        rows = set()
+        for region in self.view.sel():
+            rows.update(range(doc.row(region.begin()), doc.row(region.end()) + 1))
+        return rows
+
 
 class PlainTasksEnabled(sublime_plugin.TextCommand):
     def is_enabled(self):
@@ -70,42 +81,34 @@ class PlainTasksEnabled(sublime_plugin.TextCommand):
 
 
 class PlainTasksFold(PlainTasksEnabled):
-    def exec_folding(self, visible_region):
-        self.view.unfold(sublime.Region(0, self.view.size()))
-        for i, d in enumerate(visible_region):
-            if not i:  # beginning of document
-                self.folding(0, d.a - 1)
-            else:  # all regions within
-                self.folding(visible_region[i-1].b + 1, d.a - 1)
-        if d:  # ending of document
-            self.folding(d.b + 1, self.view.size())
-
-    def folding(self, start, end):
-        if start < end:
-            self.view.fold(sublime.Region(start, end))
-
-    def add_projects_and_notes(self, task_regions):
+    def exec_folding(self, visible_rows):
+        '''Fold everything except given rows (ascending), folds are applied in one batch'''
+        doc = get_document(self.view)
+        size = self.view.size()
+        hidden, start = [], 0
+        for row in visible_rows:
+            line = doc.line_region(row)
+            if start < line.a - 1:
+                hidden.append(sublime.Region(start, line.a - 1))
+            start = line.b + 1
+        if start < size:
+            hidden.append(sublime.Region(start, size))
+        self.view.unfold(sublime.Region(0, size))
+        if hidden:
+            self.view.fold(hidden)
+
+    def add_projects_and_notes(self, task_rows):
         '''Context is important, if task has note and belongs to projects, make em visible'''
-        def add_note(region):
-            # refactor: method in ArchiveCommand
-            next_line_begins = region.end() + 1
-            while self.view.scope_name(next_line_begins) == 'text.todo notes.todo ':
-                note = self.view.line(next_line_begins)
-                if note not in task_regions:
-                    task_regions.append(note)
-                next_line_begins = self.view.line(next_line_begins).end() + 1
-
-        projects = [r for r in get_all_projects_and_separators(self.view) if r.a < task_regions[~0].a]
-        for d in reversed(task_regions):
-            add_note(d)
-            for p in reversed(projects):
-                # refactor: different implementation in ArchiveCommand
-                project_block = self.view.indented_region(p.end() + 1)
-                due_block     = self.view.indented_region(d.begin())
-                if all((p not in task_regions, project_block.contains(due_block))):
-                    task_regions.append(p)
-                    add_note(p)
-                if self.view.indented_region(p.begin()).empty():
-                    break
-        task_regions.sort()
-        return task_regions
+        doc = get_document(self.view)
+        rows = set()
+        for row in task_rows:
+            if row in rows:
+                continue
+            rows.add(row)
+            rows.update(doc.notes(row))
+            for p in doc.projects(row):
+                if p in rows:
+                    break  # the rest of projects are added along with it
+                rows.add(p)
+                rows.update(doc.notes(p))
+        return sorted(rows)
@@ -4,7 +4,7 @@
 import sublime, sublime_plugin
 import os
 import re
-import webbrowser
+import hashlib
 import itertools
 import threading
 from datetime import datetime, tzinfo, timedelta
@@ -14,18 +14,29 @@ platform = sublime.platform()
 ST3 = int(sublime.version()) >= 3000
 
 if ST3:
-    from .APlainTasksCommon import PlainTasksBase, PlainTasksFold, get_all_projects_and_separators
+    from .APlainTasksCommon import PlainTasksBase, PlainTasksFold, use_native_locale
+    from .PlainTasksDocument import (get_document, update_async, set_timeout_async, EMPTY, NOTE, PENDING, COMPLETED,
+                                      CANCELLED, HEADER, SEPARATOR, TASKS)
+    from .PlainTasksParser import classify_line, measure_indent
+    from .PlainTasksPatterns import (OPEN_TASK_RE, DONE_TASK_RE, CANCELLED_TASK_RE, ARCHIVE_TASK_RE, ARCHIVED_DATE_RE,
+                                     NOT_EMPTY_LINE_RE, EMPTY_LINE_RE, INDENT_RE, STARTED_RE, TOGGLE_RE, TOTAL_RE,
+                                     DUE_RE, get_registry)
+    from .PlainTasksArchive import FILEMASK, ArchiveStore, archive_path, Pattern, read_block, search as search_archive
+    from .PlainTasksQuery import EXTENSIONS, Query, TaskCache, TaskIndex
+    from .PlainTasksDates import resolve_date, timestamp, task_duration, duration_tag, total_tag, TimeRollup
 else:
-    from APlainTasksCommon import PlainTasksBase, PlainTasksFold, get_all_projects_and_separators
+    from APlainTasksCommon import PlainTasksBase, PlainTasksFold, use_native_locale
+    from PlainTasksDocument import (get_document, update_async, set_timeout_async, EMPTY, NOTE, PENDING, COMPLETED,
+                                     CANCELLED, HEADER, SEPARATOR, TASKS)
+    from PlainTasksParser import classify_line, measure_indent
+    from PlainTasksPatterns import (OPEN_TASK_RE, DONE_TASK_RE, CANCELLED_TASK_RE, ARCHIVE_TASK_RE, ARCHIVED_DATE_RE,
+                                    NOT_EMPTY_LINE_RE, EMPTY_LINE_RE, INDENT_RE, STARTED_RE, TOGGLE_RE, TOTAL_RE,
+                                    DUE_RE, get_registry)
+    from PlainTasksArchive import FILEMASK, ArchiveStore, archive_path, Pattern, read_block, search as search_archive
+    from PlainTasksQuery import EXTENSIONS, Query, TaskCache, TaskIndex
+    from PlainTasksDates import resolve_date, timestamp, task_duration, duration_tag, total_tag, TimeRollup
     sublime_plugin.ViewEventListener = object
 
-# io is not operable in ST2 on Linux, but in all other cases io is better
-# https://github.com/SublimeTextIssues/Core/issues/254
-if not ST3 and platform == 'linux':
-    import codecs as io
-else:
-    import io
-
 NT = platform == 'windows'
 if NT:
     import subprocess
@@ -84,22 +95,23 @@ class PlainTasksNewCommand(PlainTasksBase):
         # then cursor won’t be on next line as it should
         sels = self.view.sel()
         eol  = None
+        doc  = get_document(self.view)  # lines are changed from bottom, so rows above stay valid
         for i, line in enumerate(regions):
             line_contents  = self.view.substr(line).rstrip()
-            not_empty_line = re.match('^(\s*)(\S.*)$', self.view.substr(line))
-            empty_line     = re.match('^(\s+)$', self.view.substr(line))
-            current_scope  = self.view.scope_name(line.a)
+            not_empty_line = NOT_EMPTY_LINE_RE.match(self.view.substr(line))
+            empty_line     = EMPTY_LINE_RE.match(self.view.substr(line))
+            kind           = doc.kind(line.a)
             eol = line.b  # need for ST3 when new content has line break
-            if 'item' in current_scope:
+            if kind in TASKS:
                 grps = not_empty_line.groups()
                 line_contents = self.view.substr(line) + '\n' + grps[0] + self.open_tasks_bullet + self.tasks_bullet_space
-            elif 'header' in current_scope and line_contents and not header_to_task:
+            elif kind == HEADER and line_contents and not header_to_task:
                 grps = not_empty_line.groups()
                 line_contents = self.view.substr(line) + '\n' + grps[0] + self.before_tasks_bullet_spaces + self.open_tasks_bullet + self.tasks_bullet_space
-            elif 'separator' in current_scope:
+            elif kind == SEPARATOR:
                 grps = not_empty_line.groups()
                 line_contents = self.view.substr(line) + '\n' + grps[0] + self.before_tasks_bullet_spaces + self.open_tasks_bullet + self.tasks_bullet_space
-            elif not ('header' and 'separator') in current_scope or header_to_task:
+            elif kind != SEPARATOR or header_to_task:
                 eol = None
                 if not_empty_line:
                     grps = not_empty_line.groups()
@@ -149,109 +161,96 @@ class PlainTasksNewWithDateCommand(PlainTasksBase):
             self.view.sel().add(sublime.Region(points[~i] + i*offset, points[~i] + i*offset))
 
 
-class PlainTasksCompleteCommand(PlainTasksBase):
-    def runCommand(self, edit):
-        original = [r for r in self.view.sel()]
-        done_line_end, now = self.format_line_end(self.done_tag, tznow())
-        offset = len(done_line_end)
-        rom = r'^(\s*)(\[\s\]|.)(\s*.*)$'
-        rdm = r'''
-            (?x)^(\s*)(\[x\]|.)                           # 0,1 indent & bullet
-            (\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*) #   2 very task
-            (?=
-              ((?:\s@done|@project|@[wl]asted|$).*)   # 3 ending either w/ done or w/o it & no date
-              |                                       #   or
-              (?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$ # 4 date & possible project tag after
-            )
-            '''  # rcm is the same, except bullet & ending
-        rcm = r'^(\s*)(\[\-\]|.)(\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*)(?=((?:\s@cancelled|@project|@[wl]asted|$).*)|(?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$)'
-        started = r'^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$'
-        toggle = r'@toggle(\([\d\w,\.:\-\/ @]*\))'
-
-        regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
-        for line in regions:
-            line_contents = self.view.substr(line)
-            open_matches = re.match(rom, line_contents, re.U)
-            done_matches = re.match(rdm, line_contents, re.U)
-            canc_matches = re.match(rcm, line_contents, re.U)
-            started_matches = re.findall(started, line_contents, re.U)
-            toggle_matches = re.findall(toggle, line_contents, re.U)
-
-            done_line_end = done_line_end.rstrip()
-            if line_contents.endswith('  '):
-                done_line_end += '  '  # keep double whitespace at eol
-                dblspc = '  '
-            else:
-                dblspc = ''
-
-            current_scope = self.view.scope_name(line.a)
-            if 'pending' in current_scope:
-                grps = open_matches.groups()
-                len_dle = self.view.insert(edit, line.end(), done_line_end)
-                replacement = u'%s%s%s' % (grps[0], self.done_tasks_bullet, grps[2].rstrip())
-                self.view.replace(edit, line, replacement)
-                self.view.run_command(
-                    'plain_tasks_calculate_time_for_task', {
-                        'started_matches': started_matches,
-                        'toggle_matches': toggle_matches,
-                        'now': now,
-                        'eol': line.a + len(replacement) + len_dle}
-                )
-            elif 'header' in current_scope:
-                eol = self.view.insert(edit, line.end(), done_line_end)
-                self.view.run_command(
-                    'plain_tasks_calculate_time_for_task', {
-                        'started_matches': started_matches,
-                        'toggle_matches': toggle_matches,
-                        'now': now,
-                        'eol': line.end() + eol}
-                )
-                indent = re.match('^(\s*)\S', line_contents, re.U)
-                self.view.insert(edit, line.begin() + len(indent.group(1)), '%s ' % self.done_tasks_bullet)
-                self.view.run_command('plain_tasks_calculate_total_time_for_project', {'start': line.a})
-            elif 'completed' in current_scope:
-                grps = done_matches.groups()
-                parentheses = check_parentheses(self.date_format, grps[4] or '')
-                replacement = u'%s%s%s%s' % (grps[0], self.open_tasks_bullet, grps[2], parentheses)
-                self.view.replace(edit, line, replacement.rstrip() + dblspc)
-                offset = -offset
-            elif 'cancelled' in current_scope:
-                grps = canc_matches.groups()
-                len_dle = self.view.insert(edit, line.end(), done_line_end)
+class PlainTasksCloseBase(PlainTasksBase):
+    '''Complete or cancel items of all selections as one batch
+
+    New content of every selected line, including @lasted/@wasted of tasks and
+    @total of projects (see TimeRollup), is computed in memory, then changed lines are replaced
+    from bottom to top, so there are no nested commands and no searches in view.
+    '''
+    CLOSE, REOPEN = 'close', 'reopen'
+
+    def close_lines(self, tag, bullet, time_tag, actions):
+        '''Apply actions to selected lines, return list of (row, new content)
+
+        actions
+            dict kind of line: CLOSE, REOPEN or message to show
+        '''
+        doc = get_document(self.view)
+        line_end, now = self.format_line_end(tag, tznow())
+        line_end = line_end.rstrip()
+        lines = list(doc.lines)
+        changed = []
+        rollup = None
+        # projects go last, their total time includes updated tasks
+        for row in sorted(self.selected_rows(doc), key=lambda r: (doc.kinds[r] == HEADER, -r)):
+            kind = doc.kinds[row]
+            action = actions.get(kind)
+            if action is None:
+                continue
+            if action not in (self.CLOSE, self.REOPEN):
+                sublime.status_message(action)
+                continue
+            text = lines[row]
+            dblspc = '  ' if text.endswith('  ') else ''  # keep double whitespace at eol
+            if action == self.REOPEN:
+                grps = (DONE_TASK_RE if kind == COMPLETED else CANCELLED_TASK_RE).match(text).groups()
                 parentheses = check_parentheses(self.date_format, grps[4] or '')
-                replacement = u'%s%s%s%s' % (grps[0], self.done_tasks_bullet, grps[2], parentheses)
-                self.view.replace(edit, line, replacement.rstrip())
-                offset = -offset
-                self.view.run_command(
-                    'plain_tasks_calculate_time_for_task', {
-                        'started_matches': started_matches,
-                        'toggle_matches': toggle_matches,
-                        'now': now,
-                        'eol': line.a + len(replacement) + len_dle}
-                )
-        self.view.sel().clear()
-        for ind, pt in enumerate(original):
-            ofs = ind * offset
-            new_pt = sublime.Region(pt.a + ofs, pt.b + ofs)
-            self.view.sel().add(new_pt)
-
+                lines[row] = (u'%s%s%s%s' % (grps[0], self.open_tasks_bullet, grps[2], parentheses)).rstrip() + dblspc
+            else:
+                if kind == HEADER and rollup is None:
+                    rollup = TimeRollup(doc, lines)
+                lines[row] = self.closed_line(doc, lines, row, bullet, line_end, now, time_tag, rollup) + dblspc
+            changed.append(row)
+        return [(row, lines[row]) for row in changed]
+
+    def closed_line(self, doc, lines, row, bullet, line_end, now, time_tag, rollup=None):
+        text, kind = lines[row], doc.kinds[row]
+        if kind == PENDING:
+            grps = OPEN_TASK_RE.match(text).groups()
+            new = u'%s%s%s' % (grps[0], bullet, grps[2].rstrip())
+        elif kind == CANCELLED:
+            grps = CANCELLED_TASK_RE.match(text).groups()
+            new = (u'%s%s%s%s' % (grps[0], bullet, grps[2], check_parentheses(self.date_format, grps[4] or ''))).rstrip()
+        else:  # HEADER
+            indent = INDENT_RE.match(text).group(1)
+            new = u'%s%s %s' % (indent, bullet, TOTAL_RE.sub('', text[len(indent):]).rstrip())
+        new += line_end
+
+        delta = task_duration(STARTED_RE.findall(text), TOGGLE_RE.findall(text), now, self.date_format)
+        if delta is not None:
+            new += duration_tag(self.view, time_tag, delta, self.date_format)
+        if kind == HEADER:
+            new += total_tag(self.view, rollup.total(row))
+        return new
+
+    def apply_lines(self, edit, changed):
+        if not changed:
+            return
+        get_document(self.view).replace_rows(edit, changed)
         PlainTasksStatsStatus.set_stats(self.view)
         self.view.run_command('plain_tasks_toggle_highlight_past_due')
 
 
+class PlainTasksCompleteCommand(PlainTasksCloseBase):
+    def runCommand(self, edit):
+        actions = {PENDING: self.CLOSE, HEADER: self.CLOSE, COMPLETED: self.REOPEN, CANCELLED: self.CLOSE}
+        self.apply_lines(edit, self.close_lines(self.done_tag, self.done_tasks_bullet, 'lasted', actions))
+
+
 class PlainTasksInjectDueDateCommand(PlainTasksBase):
     def is_visible(self):
         return self.view.score_selector(0, "text.todo") > 0
 
     def runCommand(self, edit):
-        due_re = r'^\s*[^\b]*?\s*@due\([\d\w,\.:\-\/ @]*\).*$'
         regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
         point = -1
+        doc = get_document(self.view)
         for line in regions:
             line_contents = self.view.substr(line)
-            current_scope = self.view.scope_name(line.begin())
-            due_matches = re.match(due_re, line_contents, re.U)
-            if ('item' in current_scope or 'header' in current_scope) and not due_matches:
+            kind = doc.kind(line.begin())
+            due_matches = DUE_RE.match(line_contents)
+            if (kind in TASKS or kind == HEADER) and not due_matches:
                 self.view.insert(edit, line.end(), ' @due()')
                 point = line.end() + 6
         if point != -1:
@@ -260,272 +259,169 @@ class PlainTasksInjectDueDateCommand(PlainTasksBase):
 
 
 class PlainTasksSortByDueDateAndPriorityCommand(PlainTasksBase):
-    class Task:
-        pass
+    '''Sort items of projects under cursors, item is moved along with its notes and subitems
+
+    by
+        list of keys compared in order: "due", "priority", "created" and "project"
+        (name of subproject or argument of @project tag); items without date go last
+        in both directions, equal items keep their order
+    '''
+    KEYS = ('due', 'priority', 'created', 'project')
+    PRIORITIES = {'critical': 1, 'high': 2, 'low': 4}  # the rest are normal, 3
+    NO_DATE = float('inf')
 
     def is_visible(self):
         return self.view.score_selector(0, "text.todo") > 0
 
-    def runCommand(self, edit, descending=False):
-        due_re = r'^\s*[^\b]*?\s*@due\(([\d\w,\.:\-\/ @]*)\).*$'
-        critical_re = r'^\s*[^\b]*?\s*@critical\b.*$'
-        high_re = r'^\s*[^\b]*?\s*high\b.*$'
-        low_re = r'^\s*[^\b]*?\s*@low\b.*$'
-        regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
-
-        for project in regions:
-            project_scope = self.view.scope_name(project.begin())
-            if not 'header' in project_scope:
-                continue
-            project_block = self.view.indented_region(project.end() + 1)
-            if project_block.empty():
-                continue
-            tasks = []
-            task = None
-            pos = project_block.begin()
-            first_task_pos = None
-            first_task_indentation = None
-
-            while pos < project_block.end():
-                line = self.view.line(pos)
-                line_contents = self.view.substr(line)
-                scope = self.view.scope_name(pos)
-                indentation = self.view.indentation_level(pos)
-
-                if scope == 'text.todo notes.todo ' and task is None:
-                    pass
-                elif ('item' in scope or 'header' in scope) and (task is None or first_task_indentation == indentation):
-                    task = self.Task()
-                    task.region = line
-                    if first_task_pos is None:
-                        first_task_pos = pos
-                        first_task_indentation = indentation
-
-                    task.due = '99-01-01 00:00'
-                    due_match = re.match(due_re, line_contents, re.U)
-                    if due_match is not None:
-                        task.due = due_match.groups()[0]
-
-                    task.priority = '3normal'
-                    critical_match = re.match(critical_re, line_contents, re.U)
-                    high_match = re.match(high_re, line_contents, re.U)
-                    low_match = re.match(low_re, line_contents, re.U)
-                    if critical_match is not None:
-                        task.priority = '1critical'
-                    elif high_match is not None:
-                        task.priority = '2high'
-                    elif low_match is not None:
-                        task.priority = '4low'
-
-                    tasks.append(task)
-                elif task is not None:
-                    task.region = sublime.Region(task.region.begin(), line.end())
-                pos = line.end() + 1
-            tasks.sort(key=lambda t: (t.due, t.priority), reverse=descending)
-            project_block = sublime.Region(first_task_pos, project_block.end())
-            new_content = '\n'.join([self.view.substr(t.region).rstrip() for t in tasks]) + '\n'
-            self.view.replace(edit, project_block, new_content)
+    def runCommand(self, edit, descending=False, by=('due', 'priority')):
+        unknown = [key for key in by if key not in self.KEYS]
+        if unknown:
+            sublime.status_message(u'Unknown sort key: %s, expected one of %s' % (', '.join(unknown), ', '.join(self.KEYS)))
+            return
+        doc = get_document(self.view)
+        now = datetime.now()
+        self.default = now - timedelta(seconds=now.second, microseconds=now.microsecond)
+        lines = list(doc.lines)
+        # sorting only permutes rows of block, so nested projects are sorted in place bottom up
+        for row in sorted(self.selected_rows(doc), reverse=True):
+            if doc.kinds[row] == HEADER:
+                self.sort_block(doc, lines, row, by, descending)
+        doc.replace_lines(edit, lines)
 
         PlainTasksStatsStatus.set_stats(self.view)
         self.view.run_command('plain_tasks_toggle_highlight_past_due')
 
-
-class PlainTasksCancelCommand(PlainTasksBase):
-    def runCommand(self, edit):
-        original = [r for r in self.view.sel()]
-        canc_line_end, now = self.format_line_end(self.canc_tag, tznow())
-        offset = len(canc_line_end)
-        rom = r'^(\s*)(\[\s\]|.)(\s*.*)$'
-        rdm = r'^(\s*)(\[x\]|.)(\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*)(?=((?:\s@done|@project|@[wl]asted|$).*)|(?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$)'
-        rcm = r'^(\s*)(\[\-\]|.)(\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*)(?=((?:\s@cancelled|@project|@[wl]asted|$).*)|(?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$)'
-        started = r'^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$'
-        toggle = r'@toggle(\([\d\w,\.:\-\/ @]*\))'
-        regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
-        for line in regions:
-            line_contents = self.view.substr(line)
-            open_matches = re.match(rom, line_contents, re.U)
-            done_matches = re.match(rdm, line_contents, re.U)
-            canc_matches = re.match(rcm, line_contents, re.U)
-            started_matches = re.findall(started, line_contents, re.U)
-            toggle_matches = re.findall(toggle, line_contents, re.U)
-
-            canc_line_end = canc_line_end.rstrip()
-            if line_contents.endswith('  '):
-                canc_line_end += '  '  # keep double whitespace at eol
-                dblspc = '  '
+    def sort_block(self, doc, lines, header, by, descending):
+        '''Reorder items of project at row header within lines'''
+        kinds, indents = doc.kinds, doc.indents
+        indent = indents[header]
+        starts, end = [], header + 1  # rows where items begin, row after the last line of block
+        for row in range(header + 1, len(kinds)):
+            kind = kinds[row]
+            if kind == EMPTY:
+                continue
+            if indents[row] <= indent:
+                break
+            end = row + 1
+            if (kind in TASKS or kind == HEADER) and (not starts or indents[row] <= indents[starts[0]]):
+                starts.append(row)
+        if len(starts) < 2:
+            return
+        bounds = starts + [end]
+        items = sorted(range(len(starts)), key=lambda i: self.sort_key(doc, starts[i], by, descending) + (i, ))
+        lines[starts[0]:end] = [line for i in items for line in lines[bounds[i]:bounds[i + 1]]]
+
+    def sort_key(self, doc, row, by, descending=False):
+        '''Tuple compared in ascending order, values are inverted for descending one'''
+        tags = dict((t.name, t.arg) for t in reversed(doc.tags[row]))  # first one wins
+        sign = -1 if descending else 1
+        key = []
+        for name in by:
+            if name == 'due':
+                created = tags.get('created')
+                key.append(self.date_key(tags.get('due'), created and '(%s)' % created, sign))
+            elif name == 'created':
+                key.append(self.date_key(tags.get('created'), sign=sign))
+            elif name == 'priority':
+                key.append(sign * min([self.PRIORITIES.get(t, 3) for t in tags] or [3]))
             else:
-                dblspc = ''
-
-            current_scope = self.view.scope_name(line.a)
-            if 'pending' in current_scope:
-                grps = open_matches.groups()
-                len_cle = self.view.insert(edit, line.end(), canc_line_end)
-                replacement = u'%s%s%s' % (grps[0], self.canc_tasks_bullet, grps[2].rstrip())
-                self.view.replace(edit, line, replacement)
-                self.view.run_command(
-                    'plain_tasks_calculate_time_for_task', {
-                        'started_matches': started_matches,
-                        'toggle_matches': toggle_matches,
-                        'now': now,
-                        'eol': line.a + len(replacement) + len_cle,
-                        'tag': 'wasted'}
-                )
-            elif 'header' in current_scope:
-                eol = self.view.insert(edit, line.end(), canc_line_end)
-                self.view.run_command(
-                    'plain_tasks_calculate_time_for_task', {
-                        'started_matches': started_matches,
-                        'toggle_matches': toggle_matches,
-                        'now': now,
-                        'eol': line.end() + eol,
-                        'tag': 'wasted'}
-                )
-                indent = re.match('^(\s*)\S', line_contents, re.U)
-                self.view.insert(edit, line.begin() + len(indent.group(1)), '%s ' % self.canc_tasks_bullet)
-                self.view.run_command('plain_tasks_calculate_total_time_for_project', {'start': line.a})
-            elif 'completed' in current_scope:
-                sublime.status_message('You cannot cancel what have been done, can you?')
-                # grps = done_matches.groups()
-                # parentheses = check_parentheses(self.date_format, grps[4] or '')
-                # replacement = u'%s%s%s%s' % (grps[0], self.canc_tasks_bullet, grps[2], parentheses)
-                # self.view.replace(edit, line, replacement.rstrip())
-                # offset = -offset
-            elif 'cancelled' in current_scope:
-                grps = canc_matches.groups()
-                parentheses = check_parentheses(self.date_format, grps[4] or '')
-                replacement = u'%s%s%s%s' % (grps[0], self.open_tasks_bullet, grps[2], parentheses)
-                self.view.replace(edit, line, replacement.rstrip() + dblspc)
-                offset = -offset
-        self.view.sel().clear()
-        for ind, pt in enumerate(original):
-            ofs = ind * offset
-            new_pt = sublime.Region(pt.a + ofs, pt.b + ofs)
-            self.view.sel().add(new_pt)
-
-        PlainTasksStatsStatus.set_stats(self.view)
-        self.view.run_command('plain_tasks_toggle_highlight_past_due')
+                project = (tags.get('project') or (doc.project_name(row) if doc.kinds[row] == HEADER else '')).lower()
+                # terminator sorts shorter name after longer one with the same beginning
+                key.append(tuple(-ord(c) for c in project) + (1, ) if descending else project)
+        return tuple(key)
+
+    def date_key(self, arg, created=None, sign=1):
+        '''Seconds of date given by argument of tag (multiplied by sign), resolved the same way as
+        highlighted @due; NO_DATE for missing or invalid date regardless of sign'''
+        if not arg:
+            return self.NO_DATE
+        date, error = resolve_date('(%s)' % arg, self.date_format, self.default, created)
+        if error or date is None:
+            return self.NO_DATE
+        return sign * timestamp(date)
+
+
+class PlainTasksCancelCommand(PlainTasksCloseBase):
+    def runCommand(self, edit):
+        actions = {PENDING: self.CLOSE, HEADER: self.CLOSE, CANCELLED: self.REOPEN,
+                   COMPLETED: 'You cannot cancel what have been done, can you?'}
+        self.apply_lines(edit, self.close_lines(self.canc_tag, self.canc_tasks_bullet, 'wasted', actions))
 
 
 class PlainTasksArchiveCommand(PlainTasksBase):
     def runCommand(self, edit, partial=False):
-        rds = 'meta.item.todo.completed'
-        rcs = 'meta.item.todo.cancelled'
+        doc = get_document(self.view)
 
         # finding archive section
         archive_pos = self.view.find(self.archive_name, 0, sublime.LITERAL)
 
         if partial:
-            all_tasks = self.get_archivable_tasks_within_selections()
+            all_tasks = self.get_archivable_tasks_within_selections(doc)
         else:
-            all_tasks = self.get_all_archivable_tasks(archive_pos, rds, rcs)
+            all_tasks = self.get_all_archivable_tasks(doc, archive_pos)
 
         if not all_tasks:
             sublime.status_message('Nothing to archive')
-        else:
-            if archive_pos and archive_pos.a > 0:
-                line = self.view.full_line(archive_pos).end()
-            else:
-                create_archive = u'\n\n＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿\n%s\n' % self.archive_name
-                self.view.insert(edit, self.view.size(), create_archive)
-                line = self.view.size()
-
-            projects = get_all_projects_and_separators(self.view)
-
-            # adding tasks to archive section
-            for task in all_tasks:
-                line_content = self.view.substr(task)
-                match_task = re.match(r'^\s*(\[[x-]\]|.)(\s+.*$)', line_content, re.U)
-                current_scope = self.view.scope_name(task.a)
-                if rds in current_scope or rcs in current_scope:
-                    pr = self.get_task_project(task, projects)
-                    if self.project_postfix:
-                        eol = u'{0}{1}{2}{3}\n'.format(
-                            self.before_tasks_bullet_spaces,
-                            line_content.strip(),
-                            (u' @project(%s)' % pr) if pr else '',
-                            '  ' if line_content.endswith('  ') else '')
-                    else:
-                        eol = u'{0}{1}{2}{3}\n'.format(
-                            self.before_tasks_bullet_spaces,
-                            match_task.group(1),  # bullet
-                            (u'%s%s:' % (self.tasks_bullet_space, pr)) if pr else '',
-                            match_task.group(2))  # very task
-                else:
-                    eol = u'{0}{1}\n'.format(self.before_tasks_bullet_spaces * 2, line_content.lstrip())
-                line += self.view.insert(edit, line, eol)
-
-            # remove moved tasks (starting from the last one otherwise it screw up regions after the first delete)
-            for task in reversed(all_tasks):
-                self.view.erase(edit, self.view.full_line(task))
-            self.view.run_command('plain_tasks_sort_by_date')
-
-    def get_task_project(self, task, projects):
-        index = -1
-        for ind, pr in enumerate(projects):
-            if task < pr:
-                if ind > 0:
-                    index = ind-1
-                break
-        #if there is no projects for task - return empty string
-        if index == -1:
-            return ''
-
-        prog = re.compile(r'^\n*(\s*)(.+):(?=\s|$)\s*(\@[^\s]+(\(.*?\))?\s*)*')
-        hierarhProject = ''
-
-        if index >= 0:
-            depth = re.match(r"\s*", self.view.substr(self.view.line(task))).group()
-            while index >= 0:
-                strProject = self.view.substr(projects[index])
-                if prog.match(strProject):
-                    spaces = prog.match(strProject).group(1)
-                    if len(spaces) < len(depth):
-                        hierarhProject = prog.match(strProject).group(2) + ((" / " + hierarhProject) if hierarhProject else '')
-                        depth = spaces
-                        if len(depth) == 0:
-                            break
+            return
+
+        paths = doc.project_paths(r for r in all_tasks if doc.kinds[r] in (COMPLETED, CANCELLED))
+        archived = []
+        for row in all_tasks:
+            line_content = doc.lines[row]
+            if row in paths:
+                match_task = ARCHIVE_TASK_RE.match(line_content)
+                pr = paths[row]
+                if self.project_postfix:
+                    eol = u'{0}{1}{2}{3}'.format(
+                        self.before_tasks_bullet_spaces,
+                        line_content.strip(),
+                        (u' @project(%s)' % pr) if pr else '',
+                        '  ' if line_content.endswith('  ') else '')
                 else:
-                    sep = re.compile(r'(^\s*)---.{3,5}---+$')
-                    spaces = sep.match(strProject).group(1)
-                    if len(spaces) < len(depth):
-                        depth = spaces
-                        if len(depth) == 0:
-                            break
-                index -= 1
-        if not hierarhProject:
-            return ''
+                    eol = u'{0}{1}{2}{3}'.format(
+                        self.before_tasks_bullet_spaces,
+                        match_task.group(1),  # bullet
+                        (u'%s%s:' % (self.tasks_bullet_space, pr)) if pr else '',
+                        match_task.group(2))  # very task
+            else:
+                eol = u'{0}{1}'.format(self.before_tasks_bullet_spaces * 2, line_content.lstrip())
+            archived.append(eol)
+
+        # compose whole new content and apply it as a single edit, so it is one undo step
+        moved = set(all_tasks)
+        lines = [l for r, l in enumerate(doc.lines) if r not in moved]
+        if archive_pos and archive_pos.a > 0:
+            header = doc.row(archive_pos.a)
+            header -= sum(1 for r in all_tasks if r < header)
+            lines[header + 1:header + 1] = archived
         else:
-            return hierarhProject
-
-    def get_task_note(self, task, tasks):
-        note_line = task.end() + 1
-        while self.view.scope_name(note_line) == 'text.todo notes.todo ':
-            note = self.view.line(note_line)
-            if note not in tasks:
-                tasks.append(note)
-            note_line = self.view.line(note_line).end() + 1
-
-    def get_all_archivable_tasks(self, archive_pos, rds, rcs):
-        done_tasks = [i for i in self.view.find_by_selector(rds) if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else self.view.size())]
-        for i in done_tasks:
-            self.get_task_note(i, done_tasks)
-
-        canc_tasks = [i for i in self.view.find_by_selector(rcs) if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else self.view.size())]
-        for i in canc_tasks:
-            self.get_task_note(i, canc_tasks)
-
-        all_tasks = done_tasks + canc_tasks
-        all_tasks.sort()
-        return all_tasks
-
-    def get_archivable_tasks_within_selections(self):
+            lines += [u'', u'＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿', self.archive_name]
+            header = len(lines) - 1
+            lines += archived + [u'']
+        lines = sort_archive(lines, header, self.date_format, self.view.settings().get('new_on_top', True))
+        doc.replace_lines(edit, lines)
+
+    def get_task_note(self, doc, row, rows):
+        for note in doc.notes(row):
+            if note not in rows:
+                rows.append(note)
+
+    def get_all_archivable_tasks(self, doc, archive_pos):
+        stop = doc.row(archive_pos.a) if archive_pos and archive_pos.a > 0 else None
+        tasks = set()
+        for row in doc.rows((COMPLETED, CANCELLED), stop=stop):
+            tasks.add(row)
+            tasks.update(doc.notes(row))
+        return sorted(tasks)
+
+    def get_archivable_tasks_within_selections(self, doc):
         all_tasks = []
         for region in self.view.sel():
             for l in self.view.lines(region):
-                line = self.view.line(l)
-                if ('completed' in self.view.scope_name(line.a)) or ('cancelled' in self.view.scope_name(line.a)):
-                    all_tasks.append(line)
-                    self.get_task_note(line, all_tasks)
+                row = doc.row(l.a)
+                if doc.kinds[row] in (COMPLETED, CANCELLED) and row not in all_tasks:
+                    all_tasks.append(row)
+                    self.get_task_note(doc, row, all_tasks)
         return all_tasks
 
 
@@ -567,6 +463,7 @@ class PlainTasksOpenUrlCommand(sublime_plugin.TextCommand):
                 # thus call start command for url with scheme (eg skype:nick) and full path (eg c:\b)
                 subprocess.Popen(['start', url], shell=True)
             else:
+                import webbrowser  # it is slow to import and seldom needed
                 webbrowser.open_new_tab(url)
         else:
             self.search_bare_weblink_and_open(start, end)
@@ -597,11 +494,114 @@ class PlainTasksOpenUrlCommand(sublime_plugin.TextCommand):
             strUrl = exp.group(0)
             if strUrl.find("://") == -1:
                 strUrl = "http://" + strUrl
+            import webbrowser
             webbrowser.open_new_tab(strUrl)
         else:
             sublime.status_message("Looks like there is nothing to open")
 
 
+class FileIndex(object):
+    '''Names of files and folders under window folders
+
+    Index is built once by worker thread of PlainTasksOpenLinkCommand, then
+    only folders with changed mtime are listed again, so resolving of link
+    is a dictionary lookup rather than walking through all folders.
+    '''
+    indexes = {}  # window id: FileIndex
+
+    @classmethod
+    def for_window(cls, window):
+        index = cls.indexes.get(window.id())
+        if index is None:
+            index = cls.indexes[window.id()] = cls()
+        return index
+
+    def __init__(self):
+        self.roots = set()
+        self.dirs = {}    # path: (mtime, names of subfolders, names of files)
+        self.names = {}   # basename: set of paths
+        self.pending = []  # folders to list
+        self.lock = threading.Lock()
+
+    def update(self, folders, stop, on_listed=None):
+        '''Index new folders and re-list changed ones, return False if stopped'''
+        with self.lock:
+            new_roots = set(os.path.normpath(os.path.abspath(f)) for f in folders) - self.roots
+            if not new_roots and not self.pending:
+                for path, (mtime, _, _) in list(self.dirs.items()):
+                    try:
+                        if os.stat(path).st_mtime != mtime:
+                            self.pending.append(path)
+                    except OSError:
+                        self.forget(path)
+            for root in sorted(new_roots):
+                self.roots.add(root)
+                if root not in self.dirs:
+                    self.pending.append(root)
+            while self.pending:
+                if stop():
+                    return False
+                path = self.pending.pop()
+                self.list_dir(path)
+                if on_listed:
+                    on_listed(path)
+            return True
+
+    def list_dir(self, path):
+        subdirs, files = [], []
+        try:
+            mtime = os.stat(path).st_mtime
+            if hasattr(os, 'scandir'):  # avoid stat per entry if possible
+                for entry in os.scandir(path):
+                    (subdirs if entry.is_dir() else files).append(entry.name)
+            else:
+                for name in os.listdir(path):
+                    (subdirs if os.path.isdir(os.path.join(path, name)) else files).append(name)
+        except OSError:
+            return self.forget(path)
+        old = self.dirs.get(path)
+        if old:
+            for name in set(old[1]) - set(subdirs):
+                self.forget(os.path.join(path, name))
+            for name in set(old[2]) - set(files):
+                self.names.get(name, set()).discard(os.path.join(path, name))
+        self.dirs[path] = (mtime, subdirs, files)
+        for name in subdirs + files:
+            self.names.setdefault(name, set()).add(os.path.join(path, name))
+        for name in subdirs:
+            full = os.path.join(path, name)
+            if full not in self.dirs and not os.path.islink(full):
+                self.pending.append(full)
+
+    def forget(self, path):
+        self.names.get(os.path.basename(path), set()).discard(path)
+        entry = self.dirs.pop(path, None)
+        if not entry:
+            return
+        for name in entry[1]:
+            self.forget(os.path.join(path, name))
+        for name in entry[2]:
+            self.names.get(name, set()).discard(os.path.join(path, name))
+
+    def find(self, extensions):
+        '''Return sorted list of files whose names end with one of extensions'''
+        with self.lock:
+            return sorted(p for name, paths in self.names.items() if name.endswith(extensions)
+                          for p in paths if p not in self.dirs)
+
+    def lookup(self, fn):
+        '''Return sorted list of tuples (path, is_dir) for relative path fn'''
+        fn = os.path.normpath(fn).rstrip(os.sep)
+        with self.lock:
+            if os.pardir in fn.split(os.sep):
+                candidates = set(os.path.normpath(os.path.join(d, fn)) for d in self.dirs)
+                candidates = [c for c in candidates if os.path.exists(c)]
+            else:
+                suffix = os.sep + fn
+                candidates = [p for p in self.names.get(os.path.basename(fn), ()) if p.endswith(suffix)]
+            return sorted((p, p in self.dirs or os.path.isdir(p)) for p in candidates)
+
+
 class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
     LINK_PATTERN = re.compile(  # simple ./path/
         r'''(?ixu)(?:^|[ \t])\.[\\/]
@@ -677,31 +677,27 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
             self._current_res.append((fn, line, col, "f"))
         elif os.path.isdir(fn):
             self._current_res.append((fn, 0, 0, "d"))
-
-        seen_folders = []
-        for folder in sorted(set(all_folders)):
-            for root, subdirs, _ in os.walk(folder):
-                if self.stop_thread:
-                    return
-
-                if root in seen_folders:
-                    continue
-                else:
-                    seen_folders.append(root)
-                subdirs = [f for f in subdirs if os.path.join(root, f) not in seen_folders]
-
-                tname = '%s at %s' % (fn, root)
-                self.thread.name = tname if ST3 else tname.encode('utf8')
-
-                name = os.path.normpath(os.path.abspath(os.path.join(root, fn)))
-                if os.path.isfile(name):
-                    item = (name, line, col, "f")
-                    if item not in self._current_res:
-                        self._current_res.append(item)
-                if os.path.isdir(name):
-                    item = (name, 0, 0, "d")
-                    if item not in self._current_res:
-                        self._current_res.append(item)
+        seen = set(self._current_res)
+
+        def add(name, is_dir):
+            item = (name, 0, 0, "d") if is_dir else (name, line, col, "f")
+            if item not in seen:
+                seen.add(item)
+                self._current_res.append(item)
+
+        def on_listed(root):
+            # index is cold, show matches while it is being built
+            tname = '%s at %s' % (fn, root)
+            self.thread.name = tname if ST3 else tname.encode('utf8')
+            name = os.path.normpath(os.path.join(root, fn))
+            if os.path.exists(name):
+                add(name, os.path.isdir(name))
+
+        index = FileIndex.for_window(self.window)
+        if not index.update(all_folders, lambda: self.stop_thread, on_listed):
+            return
+        for name, is_dir in index.lookup(fn):
+            add(name, is_dir)
 
         self._current_res = self._current_res[1:]  # remove 'Stop search' item
         if not self._current_res:
@@ -799,44 +795,49 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
         return fn, sym, line or 0, col or 0, text
 
 
+def sort_archive(lines, header, date_format, new_on_top=True, tab_size=4):
+    '''Return lines where dated tasks (along with their notes) follow archive header row
+
+    Archive section ends before the first empty line or the first line which is
+    not a task and is not indented deeper than header; lines after it stay in place.
+    Dates of @done/@cancelled are parsed according to date_format, so any format is
+    ordered chronologically; tasks without valid date (and other lines of section)
+    keep their order after dated ones, each along with its notes.
+    '''
+    now = datetime.now()
+    default = now - timedelta(seconds=now.second, microseconds=now.microsecond)
+    indent = measure_indent(lines[header], tab_size)
+
+    def in_section(row, kind):
+        return kind != EMPTY and (kind in TASKS or measure_indent(lines[row], tab_size) > indent)
+
+    dated, rest = [], []
+    row = header + 1
+    while row < len(lines) and in_section(row, classify_line(lines[row])):
+        task = [lines[row]]
+        row += 1
+        while row < len(lines) and classify_line(lines[row]) == NOTE and in_section(row, NOTE):
+            task.append(lines[row])
+            row += 1
+        match = ARCHIVED_DATE_RE.match(task[0])
+        date, error = resolve_date(match.group(1), date_format, default) if match else (None, True)
+        if error or date is None:
+            rest.extend(task)
+        else:
+            dated.append((timestamp(date), task))
+    dated.sort(key=lambda d: d[0], reverse=new_on_top)  # stable, equal dates keep their order
+    return lines[:header + 1] + [l for _, task in dated for l in task] + rest + lines[row:]
+
+
 class PlainTasksSortByDate(PlainTasksBase):
     def runCommand(self, edit):
-        if not re.search(r'(?su)%[Yy][-./ ]*%m[-./ ]*%d\s*%H.*%M', self.date_format):
-            # TODO: sort with dateutil so we wont depend on specific date_format
-            return
-        archive_pos = self.view.find(self.archive_name, 0, sublime.LITERAL)
-        if archive_pos:
-            have_date = r'(^\s*[^\n]*?\s\@(?:done|cancelled)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)'
-            all_tasks_prefixed_date = []
-            all_tasks = self.view.find_all(have_date, 0, u"\\2\\1", all_tasks_prefixed_date)
-
-            tasks_prefixed_date = []
-            tasks = []
-            for ind, task in enumerate(all_tasks):
-                if task.a > archive_pos.b:
-                    tasks.append(task)
-                    tasks_prefixed_date.append(all_tasks_prefixed_date[ind])
-
-            notes = []
-            for ind, task in enumerate(tasks):
-                note_line = task.end() + 1
-                while self.view.scope_name(note_line) == 'text.todo notes.todo ':
-                    note = self.view.line(note_line)
-                    notes.append(note)
-                    tasks_prefixed_date[ind] += u'\n' + self.view.substr(note)
-                    note_line = note.end() + 1
-
-            to_remove = tasks+notes
-            to_remove.sort()
-            for i in reversed(to_remove):
-                self.view.erase(edit, self.view.full_line(i))
-
-            tasks_prefixed_date.sort(reverse=self.view.settings().get('new_on_top', True))
-            eol = archive_pos.end()
-            for a in tasks_prefixed_date:
-                eol += self.view.insert(edit, eol, u'\n' + re.sub(r'^\([\d\w,\.:\-\/ ]*\)([^\b]*$)', u'\\1', a))
-        else:
+        doc = get_document(self.view)
+        header = doc.archive_row(self.archive_name)
+        if header is None:
             sublime.status_message("Nothing to sort")
+            return
+        doc.replace_lines(edit, sort_archive(doc.lines, header, self.date_format,
+                                             self.view.settings().get('new_on_top', True), doc.tab_size))
 
 
 class PlainTasksRemoveBold(sublime_plugin.TextCommand):
@@ -848,63 +849,58 @@ class PlainTasksRemoveBold(sublime_plugin.TextCommand):
 
 
 class PlainTasksStatsStatus(sublime_plugin.EventListener):
-    def on_activated(self, view):
+    def on_activated_async(self, view):
         if not view.score_selector(0, "text.todo") > 0:
             return
-        self.set_stats(view)
+        update_async(view, 'stats', self.get_stats, self.show_stats)
+
+    def on_post_save_async(self, view):
+        self.on_activated_async(view)
 
-    def on_post_save(self, view):
-        self.on_activated(view)
+    if not ST3:  # there are no async events, update_async still debounces
+        on_activated, on_post_save = on_activated_async, on_post_save_async
 
     @staticmethod
     def set_stats(view):
-        view.set_status('PlainTasks', PlainTasksStatsStatus.get_stats(view))
+        PlainTasksStatsStatus.show_stats(view, PlainTasksStatsStatus.get_stats(view))
+
+    @staticmethod
+    def show_stats(view, msg):
+        view.set_status('PlainTasks', msg)
 
     @staticmethod
     def get_stats(view):
-        msgf = view.settings().get('stats_format', '$n/$a done ($percent%) $progress Last task @done $last')
-
-        special_interest = re.findall(r'{{.*?}}', msgf)
-        for i in special_interest:
-            matches = view.find_all(i.strip('{}'))
-            pend, done, canc = [], [], []
-            for t in matches:
-                # one task may contain same tag/word several times—we count amount of tasks, not tags
-                t = view.line(t).a
-                scope = view.scope_name(t)
-                if 'pending' in scope and t not in pend:
-                    pend.append(t)
-                elif 'completed' in scope and t not in done:
-                    done.append(t)
-                elif 'cancelled' in scope and t not in canc:
-                    canc.append(t)
-            msgf = msgf.replace(i, '%d/%d/%d'%(len(pend), len(done), len(canc)))
-
-        ignore_archive = view.settings().get('stats_ignore_archive', False)
+        settings = view.settings()
+        msgf = settings.get('stats_format', '$n/$a done ($percent%) $progress Last task @done $last')
+        ignore_archive = settings.get('stats_ignore_archive', False)
+        archive_name = settings.get('archive_name', 'Archive:')
+        date_format = settings.get('date_format', '(%y-%m-%d %H:%M)')
+        barfull  = settings.get('bar_full', u'■')
+        barempty = settings.get('bar_empty', u'□')
+
+        doc = get_document(view)
+        key = (msgf, ignore_archive, archive_name, date_format, barfull, barempty)
+        cached = doc.cache.get('stats')
+        if cached and cached[0] == key:
+            return cached[1]
+
+        use_native_locale()  # for names of months in @done dates
+        expressions = get_registry(settings).stats_expressions
         if ignore_archive:
-            archive_pos = view.find(view.settings().get('archive_name', 'Archive:'), 0, sublime.LITERAL)
-            pend = len([i for i in view.find_by_selector('meta.item.todo.pending') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
-            done = len([i for i in view.find_by_selector('meta.item.todo.completed') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
-            canc = len([i for i in view.find_by_selector('meta.item.todo.cancelled') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
+            archive_row = doc.archive_row(archive_name)
+            stop = archive_row if archive_row else None
         else:
-            pend = len(view.find_by_selector('meta.item.todo.pending'))
-            done = len(view.find_by_selector('meta.item.todo.completed'))
-            canc = len(view.find_by_selector('meta.item.todo.cancelled'))
+            stop = None
+        pend, done, canc, special, last = count_stats(doc, [rx for _, rx in expressions], stop, date_format)
+
+        for (i, _), (p, d, c) in zip(expressions, special):
+            msgf = msgf.replace(i, '%d/%d/%d' % (p, d, c))
+
         allt = pend + done + canc
         percent  = ((done+canc)/float(allt))*100 if allt else 0
         factor   = int(round(percent/10)) if percent<90 else int(percent/10)
-
-        barfull  = view.settings().get('bar_full', u'■')
-        barempty = view.settings().get('bar_empty', u'□')
         progress = '%s%s' % (barfull*factor, barempty*(10-factor)) if factor else ''
 
-        tasks_dates = []
-        view.find_all('(^\s*[^\n]*?\s\@(?:done)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)', 0, "\\2", tasks_dates)
-        date_format = view.settings().get('date_format', '(%y-%m-%d %H:%M)')
-        tasks_dates = [check_parentheses(date_format, t, is_date=True) for t in tasks_dates]
-        tasks_dates.sort(reverse=True)
-        last = tasks_dates[0] if tasks_dates else '(UNKNOWN)'
-
         msg = (msgf.replace('$o', str(pend))
                    .replace('$d', str(done))
                    .replace('$c', str(canc))
@@ -912,11 +908,49 @@ class PlainTasksStatsStatus(sublime_plugin.EventListener):
                    .replace('$a', str(allt))
                    .replace('$percent', str(int(percent)))
                    .replace('$progress', progress)
-                   .replace('$last', last)
+                   .replace('$last', last or '(UNKNOWN)')
                 )
+        doc.cache['stats'] = (key, msg)
         return msg
 
 
+def count_stats(doc, rxs, stop, date_format):
+    '''Single pass over document, return tuple
+    pending, completed, cancelled
+        int, amount of tasks before stop row (None means whole document)
+    special
+        list of [pending, completed, cancelled] amount of tasks matching each compiled expression (whole document)
+    last
+        Unicode, the most recent @done date in date_format or None
+    '''
+    special = [[0, 0, 0] for _ in rxs]
+    counters = [0, 0, 0]
+    column = {PENDING: 0, COMPLETED: 1, CANCELLED: 2}
+    last = last_date = None
+    lines, kinds, _, tags = doc.snapshot()
+    stop = len(lines) if stop is None else stop
+    for row, kind in enumerate(kinds):
+        for tag in tags[row]:
+            if tag.name == 'done' and tag.arg is not None:
+                date_string = '(%s)' % tag.arg
+                try:
+                    date = datetime.strptime(date_string.strip(), date_format)
+                except ValueError:
+                    continue
+                if last_date is None or date > last_date:
+                    last, last_date = date_string, date
+        if kind not in column:
+            continue
+        i = column[kind]
+        if row < stop:
+            counters[i] += 1
+        for j, rx in enumerate(rxs):
+            # one task may contain same tag/word several times—we count amount of tasks, not tags
+            if rx.search(lines[row]):
+                special[j][i] += 1
+    return counters[0], counters[1], counters[2], special, last
+
+
 class PlainTasksCopyStats(sublime_plugin.TextCommand):
     def is_enabled(self):
         return self.view.score_selector(0, "text.todo") > 0
@@ -958,46 +992,44 @@ class PlainTasksArchiveOrgCommand(PlainTasksBase):
         return
 
     def __writeArchive(self, filename, region):
-        # Write out the given region
+        # Write out the given region, see PlainTasksArchive for rotation of segments
 
         sublime.status_message(u'Archiving tree to {0}'.format(filename))
+        settings = self.view.settings()
+        store = ArchiveStore(filename,
+                             int(settings.get('archive_org_max_size', 0) * 1024 * 1024),
+                             settings.get('archive_org_rotate'),
+                             settings.get('archive_org_compress', False))
         try:
-            # Have to use io.open because windows doesn't like writing
-            # utf8 to regular filehandles
-            with io.open(filename, 'a', encoding='utf8') as fh:
-                data = self.view.substr(region)
-                # Is there a way to read this in?
-                fh.write(u"--- ✄ -----------------------\n")
-                fh.write(u"Archived {0}:\n".format(tznow().strftime(
-                    self.date_format)))
-                # And, finally, write our data
-                fh.write(u"{0}\n".format(data))
-            return True
-
+            now = tznow()
+            closed = store.rotate(now)
+            store.append(self.view.substr(region), now, self.__projectPath(region), now.strftime(self.date_format))
         except Exception as e:
             sublime.error_message(u"Error:\n\nUnable to append to {0}\n{1}".format(
                 filename, str(e)))
             return False
+        if closed and store.compress:
+            set_timeout_async(lambda: store.compress_segment(closed), 0)
+        return True
+
+    def __projectPath(self, region):
+        # Names of projects containing the subtree, along with its own header
+        doc = get_document(self.view)
+        row = doc.row(region.begin())
+        names = [doc.project_path(row)]
+        if doc.kinds[row] == HEADER:
+            names.append(doc.project_name(row))
+        return u' / '.join(n for n in names if n)
 
     def __createArchiveFilename(self):
         # Create our archive filename, from the mask in our settings.
-
-        # Split filename int dir, base, and extension, then apply our mask
-        path_base, extension = os.path.splitext(self.view.file_name())
-        dir  = os.path.dirname(path_base)
-        base = os.path.basename(path_base)
-        sep  = os.sep
-
-        # Now build our new filename
         try:
             # This could fail, if someone messed up the mask in the
             # settings.  So, if it did fail, use our default.
-            archive_filename = self.archive_org_filemask.format(
-                dir=dir, base=base, ext=extension, sep=sep)
+            archive_filename = archive_path(self.view.file_name(), self.archive_org_filemask)
         except:
             # Use our default mask
-            archive_filename = self.archive_org_default_filemask.format(
-                    dir=dir, base=base, ext=extension, sep=sep)
+            archive_filename = archive_path(self.view.file_name(), self.archive_org_default_filemask)
 
             # Display error, letting the user know
             sublime.error_message(u"Error:\n\nInvalid filemask:{0}\nUsing default: {1}".format(
@@ -1023,8 +1055,92 @@ class PlainTasksArchiveOrgCommand(PlainTasksBase):
         return region
 
 
+class PlainTasksSearchArchiveCommand(sublime_plugin.WindowCommand):
+    '''Find lines of Org-Mode style archive by regular expression, see PlainTasksArchive.search
+
+    files
+        list of archive files, all their segments are searched; archive of active view by default
+    '''
+    last_pattern = u''
+    LIMIT = 5000  # matches shown in quick panel
+
+    def run(self, pattern=None, files=None):
+        self.files = files
+        if pattern is None:
+            self.window.show_input_panel('Search archive:', self.last_pattern, self.on_pattern, None, None)
+        else:
+            self.on_pattern(pattern)
+
+    def archive_files(self):
+        files = self.files
+        if not files:
+            view = self.window.active_view()
+            if not view or not view.file_name():
+                return []
+            try:
+                files = [archive_path(view.file_name(), view.settings().get('archive_org_filemask', FILEMASK))]
+            except (KeyError, IndexError, ValueError):
+                files = [archive_path(view.file_name())]
+        paths = []
+        for name in files:
+            paths += ArchiveStore(os.path.expanduser(name)).segments()
+        return paths
+
+    def on_pattern(self, text):
+        PlainTasksSearchArchiveCommand.last_pattern = text
+        paths = self.archive_files()
+        if not paths:
+            return sublime.status_message('There are no archive files to search')
+        sublime.status_message(u'Searching archive…')
+        threading.Thread(target=self.search, args=(text, paths)).start()
+
+    def search(self, text, paths):
+        pattern, found = Pattern(text), []
+        for path in paths:
+            found += search_archive(path, pattern, self.LIMIT - len(found))
+            if len(found) >= self.LIMIT:
+                break
+        found.reverse()  # segments and blocks are appended in order of archiving, so newest first
+        sublime.set_timeout(lambda: self.show(text, found), 0)
+
+    def show(self, text, found):
+        if not found:
+            return sublime.status_message(u'Nothing in archive matches "%s"' % text)
+        self.found = found
+        self.initial_view = self.window.active_view()
+        items = [[f.text.strip(), u'Archived {0}  {1}:{2}'.format(f.archived, os.path.basename(f.path), f.row + 1)]
+                 for f in found]
+        if ST3:
+            self.window.show_quick_panel(items, self.on_done, 0, 0, self.on_highlighted)
+        else:
+            self.window.show_quick_panel(items, self.on_done)
+
+    def on_done(self, index):
+        if index < 0:
+            if self.initial_view:
+                self.window.focus_view(self.initial_view)
+            return
+        found = self.found[index]
+        if not found.path.endswith('.gz'):
+            self.window.open_file('%s:%d:1' % (found.path, found.row + 1), sublime.ENCODED_POSITION)
+            return
+        # compressed segment can not be opened, show its block instead
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name(u'%s %s' % (os.path.basename(found.path), found.archived))
+        view.set_syntax_file('Packages/PlainTasks/PlainTasks.sublime-syntax' if ST3 else
+                             'Packages/PlainTasks/PlainTasks.tmLanguage')
+        view.run_command('append', {'characters': read_block(found.path, found.block)})
+
+    def on_highlighted(self, index):
+        found = self.found[index]
+        if not found.path.endswith('.gz'):
+            self.window.open_file('%s:%d:1' % (found.path, found.row + 1), sublime.ENCODED_POSITION | sublime.TRANSIENT)
+
+
 class PlainTasksFoldToTags(PlainTasksFold):
     TAG = r'(?u)@\w+'
+    TAG_WORD = re.compile(r'(?u)\w+')
 
     def run(self, edit):
         tag_sels = [s for s in list(self.view.sel()) if 'tag.todo' in self.view.scope_name(s.a)]
@@ -1032,14 +1148,22 @@ class PlainTasksFoldToTags(PlainTasksFold):
             sublime.status_message('Cursor(s) must be placed on tag(s)')
             return
 
-        tags = self.extract_tags(tag_sels)
-        tasks = [self.view.line(f) for f in self.view.find_all(r'[ \t](%s)' % '|'.join(tags)) if 'pending' in self.view.scope_name(f.a)]
+        tags = set(t.lstrip('@') for t in self.extract_tags(tag_sels))
+        doc = get_document(self.view)
+        tasks = [row for row in doc.rows((PENDING,)) if self.has_tags(doc.tags[row], tags)]
         if not tasks:
             sublime.status_message('Pending tasks with given tags are not found')
             print(tags, tag_sels)
             return
         self.exec_folding(self.add_projects_and_notes(tasks))
 
+    def has_tags(self, line_tags, names):
+        for tag in line_tags:
+            word = self.TAG_WORD.match(tag.name)
+            if word and word.group() in names:
+                return True
+        return False
+
     def extract_tags(self, tag_sels):
         tags = []
         for s in tag_sels:
@@ -1061,41 +1185,40 @@ class PlainTasksFoldToTags(PlainTasksFold):
 
 
 class PlainTasksAddGutterIconsForTags(sublime_plugin.EventListener):
-    def on_activated(self, view):
+    TAGS = ('critical', 'high', 'low', 'today')
+
+    def on_activated_async(self, view):
         if not view.score_selector(0, "text.todo") > 0:
             return
-        view.erase_regions('critical')
-        view.erase_regions('high')
-        view.erase_regions('low')
-        view.erase_regions('today')
-        icon_critical = view.settings().get('icon_critical', '')
-        icon_high = view.settings().get('icon_high', '')
-        icon_low = view.settings().get('icon_low', '')
-        icon_today = view.settings().get('icon_today', '')
-        if not any((icon_critical, icon_high, icon_low, icon_today)):
-            return
+        update_async(view, 'icons', self.find_icons, self.add_icons)
 
-        critical = 'string.other.tag.todo.critical'
-        high = 'string.other.tag.todo.high'
-        low = 'string.other.tag.todo.low'
-        today = 'string.other.tag.todo.today'
-        r_critical = view.find_by_selector(critical)
-        r_high = view.find_by_selector(high)
-        r_low = view.find_by_selector(low)
-        r_today = view.find_by_selector(today)
+    def on_post_save_async(self, view):
+        self.on_activated_async(view)
 
-        if not any((r_critical, r_high, r_low, r_today)):
-            return
-        view.add_regions('critical', r_critical, critical, icon_critical, sublime.HIDDEN)
-        view.add_regions('high', r_high, high, icon_high, sublime.HIDDEN)
-        view.add_regions('low', r_low, low, icon_low, sublime.HIDDEN)
-        view.add_regions('today', r_today, today, icon_today, sublime.HIDDEN)
+    def on_load_async(self, view):
+        self.on_activated_async(view)
 
-    def on_post_save(self, view):
-        self.on_activated(view)
+    if not ST3:  # there are no async events, update_async still debounces
+        on_activated, on_post_save, on_load = on_activated_async, on_post_save_async, on_load_async
 
-    def on_load(self, view):
-        self.on_activated(view)
+    @classmethod
+    def find_icons(cls, view):
+        '''Return list of (tag, regions, scope, icon) for tags which have icon set'''
+        icons = []
+        for tag in cls.TAGS:
+            icon = view.settings().get('icon_%s' % tag, '')
+            if icon:
+                scope = 'string.other.tag.todo.%s' % tag
+                icons.append((tag, view.find_by_selector(scope), scope, icon))
+        return icons
+
+    @classmethod
+    def add_icons(cls, view, icons):
+        for tag in cls.TAGS:
+            view.erase_regions(tag)
+        for tag, regions, scope, icon in icons:
+            if regions:
+                view.add_regions(tag, regions, scope, icon, sublime.HIDDEN)
 
 
 class PlainTasksHover(sublime_plugin.ViewEventListener):
@@ -1125,9 +1248,9 @@ class PlainTasksHover(sublime_plugin.ViewEventListener):
     archivetofile = '<a href="tofile\v{point}"><span class="icon" id="icon-outside">📤</span> <span id="outside">Archive to file</span></a>'
 
     actions = {
-        'text.todo meta.item.todo.pending': '<p>{complete}</p><p>{cancel}</p>'.format(complete=complete, cancel=cancel),
-        'text.todo meta.item.todo.completed': '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete),
-        'text.todo meta.item.todo.cancelled': '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p><p>{cancel}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete, cancel=cancel)
+        PENDING: '<p>{complete}</p><p>{cancel}</p>'.format(complete=complete, cancel=cancel),
+        COMPLETED: '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete),
+        CANCELLED: '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p><p>{cancel}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete, cancel=cancel)
     }
 
     @classmethod
@@ -1139,9 +1262,8 @@ class PlainTasksHover(sublime_plugin.ViewEventListener):
         if hover_zone != sublime.HOVER_TEXT:
             return
 
-        line = self.view.line(point)
-        line_scope_name = self.view.scope_name(line.a).strip()
-        if 'meta.item.todo' not in line_scope_name:
+        kind = get_document(self.view).kind(point)
+        if kind not in self.actions:
             return
 
         bullet = any(('bullet' in self.view.scope_name(p) for p in (point, point - 1)))
@@ -1149,7 +1271,7 @@ class PlainTasksHover(sublime_plugin.ViewEventListener):
             return
 
         width, height = self.view.viewport_extent()
-        self.view.show_popup(self.msg.format(actions=self.actions.get(line_scope_name)).format(point=point), 0, point or self.view.sel()[0].begin() or 1, width, height / 2, self.exec_action)
+        self.view.show_popup(self.msg.format(actions=self.actions[kind]).format(point=point), 0, point or self.view.sel()[0].begin() or 1, width, height / 2, self.exec_action)
 
     def exec_action(self, msg):
         action, at = msg.split('\v')
@@ -1171,15 +1293,10 @@ class PlainTasksGotoTag(sublime_plugin.TextCommand):
         self.initial_viewport = self.view.viewport_position()
         self.initial_sels = list(self.view.sel())
 
-        self.tags = sorted(
-            [r for r in self.view.find_by_selector('meta.tag.todo')
-             if not any(s in self.view.scope_name(r.a) for s in ('completed', 'cancelled'))
-             ] +
-            self.view.find_by_selector('string.other.tag.todo.critical') +
-            self.view.find_by_selector('string.other.tag.todo.high') +
-            self.view.find_by_selector('string.other.tag.todo.low') +
-            self.view.find_by_selector('string.other.tag.todo.today')
-            )
+        doc = get_document(self.view)
+        self.tags = [doc.tag_region(row, tag)
+                     for row in doc.rows((PENDING, ))
+                     for tag in doc.tags[row]]
         window = self.view.window() or sublime.active_window()
         items = [[self.view.substr(t), u'{0}: {1}'.format(self.view.rowcol(t.a)[0], self.view.substr(self.view.line(t)).strip())] for t in self.tags]
 
@@ -1208,3 +1325,100 @@ class PlainTasksGotoTag(sublime_plugin.TextCommand):
         self.view.sel().clear()
         self.view.sel().add(self.tags[index])
         self.view.show(self.tags[index], True)
+
+
+class PlainTasksQueryCommand(sublime_plugin.WindowCommand):
+    '''Find tasks in todo files of window folders, see PlainTasksQuery for syntax of query'''
+    last_query = u'is:pending '
+    caches = {}  # per folders of window, files are parsed again only if changed
+    lock = threading.Lock()
+
+    def run(self, query=None):
+        if query is None:
+            self.window.show_input_panel('Query tasks:', self.last_query, self.on_query, None, None)
+        else:
+            self.on_query(query)
+
+    def on_query(self, text):
+        PlainTasksQueryCommand.last_query = text
+        view = self.window.active_view()
+        settings = view.settings() if view else sublime.load_settings('PlainTasks.sublime-settings')
+        date_format = settings.get('date_format', '(%y-%m-%d %H:%M)')
+        now = datetime.now().replace(second=0, microsecond=0)
+
+        def resolve(task, arg):
+            created = [a for name, a in task.tags if name == 'created' and a]
+            date, error = resolve_date('(%s)' % arg, date_format, now, '(%s)' % created[0] if created else None)
+            return None if error else date
+
+        try:
+            query = Query(text, now, resolve)
+        except ValueError as e:
+            return sublime.error_message(str(e))
+        folders = self.window.folders()
+        if not folders:
+            return sublime.status_message('There are no folders in window to query')
+        sublime.status_message('Querying tasks…')
+        threading.Thread(target=self.search, args=(query, folders, date_format)).start()
+
+    @classmethod
+    def task_cache(cls, folders, date_format):
+        '''Index saved in cache folder survives restarts, ST2 has no such folder
+
+        Cache drops files which are not in folders, so each set of folders has its own one.
+        '''
+        key = tuple(sorted(folders))
+        cache = cls.caches.get(key)
+        if cache is None or getattr(cache, 'date_format', date_format) != date_format:
+            if ST3:
+                name = 'tasks-%s.sqlite' % hashlib.md5(u'\n'.join(key).encode('utf8')).hexdigest()
+                cache = TaskIndex(os.path.join(sublime.cache_path(), 'PlainTasks', name), date_format)
+            else:
+                cache = TaskCache()
+            cls.caches[key] = cache
+        return cache
+
+    def search(self, query, folders, date_format):
+        index = FileIndex.for_window(self.window)
+        index.update(folders, lambda: False)
+        files = index.find(EXTENSIONS)
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:  # ST2
+            ThreadPoolExecutor = None
+        with self.lock:
+            cache = self.task_cache(folders, date_format)
+            # processes are not an option within plugin host, threads at least overlap reading of files
+            if ThreadPoolExecutor and len(files) > 1:
+                with ThreadPoolExecutor(4) as pool:
+                    cache.update(files, pool.map)
+            else:
+                cache.update(files)
+            tasks = query.filter(cache.tasks(files))
+        sublime.set_timeout(lambda: self.show(query, tasks), 0)
+
+    def show(self, query, tasks):
+        if not tasks:
+            return sublime.status_message(u'No tasks match "%s"' % query.text)
+        self.tasks = tasks
+        self.initial_view = self.window.active_view()
+        items = [[t.text, u'{0}:{1}  {2}'.format(os.path.basename(t.file), t.row + 1, ' / '.join(t.projects))]
+                 for t in tasks]
+        if ST3:
+            self.window.show_quick_panel(items, self.on_done, 0, 0, self.on_highlighted)
+        else:
+            self.window.show_quick_panel(items, self.on_done)
+
+    def open(self, index, flags=0):
+        task = self.tasks[index]
+        return self.window.open_file('%s:%d:1' % (task.file, task.row + 1), sublime.ENCODED_POSITION | flags)
+
+    def on_done(self, index):
+        if index < 0:
+            if self.initial_view:
+                self.window.focus_view(self.initial_view)
+            return
+        self.open(index)
+
+    def on_highlighted(self, index):
+        self.open(index, sublime.TRANSIENT)
@@ -0,0 +1,354 @@
+# coding: utf-8
+'''Append-only store of Org-Mode style archive, it does not depend on Sublime Text API
+
+Archive is split into numbered segments which lay next to archive file:
+
+    work_archive.todo        active segment, subtrees are appended to it
+    work_archive.1.todo.gz   closed segments, compressed optionally
+    work_archive.2.todo
+    work_archive.todo.idx    index, one line per archived subtree:
+                             segment <tab> byte offset <tab> archived at <tab> project path
+
+Active segment is closed when its size reaches max_size bytes, or when it was
+started in another period ("month" or "year") than the date being archived.
+Offset is position of the block in uncompressed segment, so reading of one
+subtree takes a seek within one segment instead of reading whole archive.
+
+Segments are searched without decoding them or loading them into a view:
+
+    pattern = Pattern(u'deploy|release')
+    for path in ArchiveStore('work_archive.todo').segments():
+        for found in search(path, pattern):
+            print(found.archived, found.row, found.text)
+'''
+import gzip
+import io
+import mmap
+import os
+import re
+import shutil
+from collections import namedtuple
+from datetime import datetime
+
+FILEMASK = u'{dir}{sep}{base}_archive{ext}'
+SEPARATOR = u'--- ✄ -----------------------'
+SEPARATOR_BYTES = SEPARATOR.encode('utf8')
+# it is not anchored to start of line, as anchor disables fast search of literal prefix
+HEADER_RE = re.compile(b'(?m)' + re.escape(SEPARATOR_BYTES) + b'\r?\nArchived (.*?):\r?$')
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S'
+PERIODS = {'month': 7, 'year': 4}  # length of ISO date which identifies period
+
+# segment is int, offset is int, archived is ISO string, project is path of names joined by " / "
+Entry = namedtuple('Entry', 'segment offset archived project')
+# row is 0-based line of file, archived is date from header of block which starts at offset block
+Found = namedtuple('Found', 'path row text archived block')
+
+
+def archive_path(file_name, mask=FILEMASK):
+    '''Return name of archive of todo file, invalid mask raises KeyError, IndexError or ValueError'''
+    path_base, extension = os.path.splitext(file_name)
+    return mask.format(dir=os.path.dirname(path_base), base=os.path.basename(path_base), ext=extension, sep=os.sep)
+
+
+class ArchiveStore(object):
+    '''Segments and index of archive file at given path
+
+    max_size
+        int, bytes, 0 means no limit
+    period
+        "month", "year" or None
+    '''
+
+    def __init__(self, path, max_size=0, period=None, compress=False):
+        self.path = path
+        self.root, self.ext = os.path.splitext(path)
+        self.index_path = path + '.idx'
+        self.max_size = max_size
+        self.period = PERIODS.get(period)
+        self.compress = compress
+
+    def segment_path(self, number, compressed=False):
+        return u'%s.%d%s%s' % (self.root, number, self.ext, '.gz' if compressed else '')
+
+    def closed_segments(self):
+        '''Return ascending numbers of closed segments found on disk'''
+        folder = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.root) + '.'
+        numbers = set()
+        if not os.path.isdir(folder):
+            return []
+        for name in os.listdir(folder):
+            if name.endswith('.gz'):
+                name = name[:-3]
+            if not name.startswith(prefix) or not name.endswith(self.ext):
+                continue
+            number = name[len(prefix):len(name) - len(self.ext)]
+            if number.isdigit():
+                numbers.add(int(number))
+        return sorted(numbers)
+
+    def active_segment(self):
+        closed = self.closed_segments()
+        return closed[-1] + 1 if closed else 1
+
+    def segments(self):
+        '''Return paths of existing segments, oldest first'''
+        paths = []
+        for number in self.closed_segments():
+            path = self.segment_path(number)
+            paths.append(path if os.path.exists(path) else self.segment_path(number, True))
+        if os.path.exists(self.path):
+            paths.append(self.path)
+        return paths
+
+    def entries(self):
+        '''Return list of Entry in order of archiving, malformed lines of index are skipped'''
+        if not os.path.exists(self.index_path):
+            return []
+        entries = []
+        f = io.open(self.index_path, encoding='utf8')
+        try:
+            for line in f:
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) == 4 and fields[0].isdigit() and fields[1].isdigit():
+                    entries.append(Entry(int(fields[0]), int(fields[1]), fields[2], fields[3]))
+        finally:
+            f.close()
+        return entries
+
+    def find(self, project):
+        '''Return entries of given project and its subprojects'''
+        return [e for e in self.entries() if e.project == project or e.project.startswith(project + u' / ')]
+
+    def rotate(self, archived):
+        '''Close active segment if it is full or belongs to past period of archived (datetime),
+        return number of closed segment or None'''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        if not st.st_size:
+            return None
+        active = self.active_segment()
+        full = self.max_size and st.st_size >= self.max_size
+        if not full and self.period:
+            started = [e.archived for e in self.entries() if e.segment == active]
+            started = started[0] if started else datetime.fromtimestamp(st.st_mtime).strftime(ISO_FORMAT)
+            full = started[:self.period] != archived.strftime(ISO_FORMAT)[:self.period]
+        if not full:
+            return None
+        os.rename(self.path, self.segment_path(active))
+        return active
+
+    def append(self, data, archived, project=u'', stamp=None):
+        '''Write block with data (Unicode) to active segment and record it in index, return Entry
+
+        stamp
+            Unicode, date shown in header of block, archived in ISO format by default
+
+        Lines end with os.linesep, as archive was written in text mode before segments.
+        '''
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        block = u'%s\nArchived %s:\n%s\n' % (SEPARATOR, stamp or archived.strftime(ISO_FORMAT), data)
+        f = open(self.path, 'ab')
+        try:
+            f.seek(0, 2)  # position in append mode is not defined until the first write
+            offset = f.tell()
+            f.write(block.replace(u'\n', os.linesep).encode('utf8'))  # newlines as text mode writes them
+        finally:
+            f.close()
+        entry = Entry(self.active_segment(), offset, archived.strftime(ISO_FORMAT),
+                      project.replace(u'\t', u' ').replace(u'\n', u' '))
+        f = open(self.index_path, 'ab')
+        try:
+            f.write((u'%d\t%d\t%s\t%s\n' % entry).encode('utf8'))
+        finally:
+            f.close()
+        return entry
+
+    def compress_segment(self, number):
+        '''Replace closed segment with its gzip copy'''
+        source, target = self.segment_path(number), self.segment_path(number, True)
+        if not os.path.exists(source):
+            return
+        temp = target + '.tmp'
+        with open(source, 'rb') as f:
+            g = gzip.open(temp, 'wb')
+            try:
+                shutil.copyfileobj(f, g)
+            finally:
+                g.close()
+        os.rename(temp, target)
+        os.remove(source)
+
+    def open_segment(self, number):
+        '''Return binary file of segment, decompressed transparently'''
+        for path in (self.segment_path(number), self.segment_path(number, True)):
+            if os.path.exists(path):
+                return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        if number == self.active_segment():
+            return open(self.path, 'rb')
+        raise IOError('Segment %d of %s is not found' % (number, self.path))
+
+    def read(self, entry):
+        '''Return Unicode block of entry, including its separator and header'''
+        following = [e.offset for e in self.entries() if e.segment == entry.segment and e.offset > entry.offset]
+        f = self.open_segment(entry.segment)
+        try:
+            f.seek(entry.offset)
+            data = f.read(min(following) - entry.offset) if following else f.read()
+        finally:
+            f.close()
+        return data.decode('utf8').replace(u'\r\n', u'\n')
+
+
+class Pattern(object):
+    '''Case insensitive regex of text, invalid regex is matched literally
+
+    Data is searched in bytes. Literal ASCII text is searched in lowered
+    chunks, it is several times faster than IGNORECASE, which disables
+    literal prefix search of re; other literal text is turned into regex of
+    lower, upper and title case variants of each character. Case of
+    non-ASCII letters in regex can not be folded in bytes, so such regex is
+    matched as Unicode one against decoded chunks.
+    '''
+    META_RE = re.compile(r'[\\.^$*+?{}\[\]|()]')
+    ERRORS = 'surrogateescape' if str is not bytes else 'replace'  # decoded data is encoded back to same offsets
+
+    def __init__(self, text):
+        literal = not self.META_RE.search(text)
+        if not literal:
+            try:
+                re.compile(text)
+            except re.error:
+                literal = True
+        self.fold = self.decode = False
+        if not any(ord(c) > 127 for c in text):
+            self.fold = literal
+            self.regex = re.compile(re.escape(text.lower()).encode('utf8') if literal else text.encode('utf8'),
+                                    0 if literal else re.I | re.M)
+        elif literal:
+            self.regex = re.compile(b''.join(case_variants(c) for c in text))
+        else:
+            self.decode = True
+            self.regex = re.compile(text, re.I | re.U | re.M)
+
+    def spans(self, chunk):
+        '''Yield ascending (start, end) of matches within bytes'''
+        if not self.decode:
+            for match in self.regex.finditer(chunk.lower() if self.fold else chunk):
+                yield match.span()
+            return
+        text = chunk.decode('utf8', self.ERRORS)
+        pos = offset = 0
+        for match in self.regex.finditer(text):
+            offset += len(text[pos:match.start()].encode('utf8', self.ERRORS))
+            pos = match.start()
+            yield offset, offset + len(match.group().encode('utf8', self.ERRORS))
+
+
+def case_variants(char):
+    '''Return byte regex which matches char in any case'''
+    variants = sorted(set(v.encode('utf8') for v in (char, char.lower(), char.upper(), char.title()) if len(v) == 1))
+    if len(variants) == 1:
+        return re.escape(variants[0])
+    if all(len(v) == 1 for v in variants):
+        return b'[' + b''.join(variants) + b']'
+    return b'(?:' + b'|'.join(re.escape(v) for v in variants) + b')'
+
+
+CHUNK_SIZE = 16 * 1024 * 1024  # bytes copied from mapped file at once, chunks end at line breaks
+
+
+def search(path, pattern, limit=None):
+    '''Return list of Found for lines of archive file which match Pattern
+
+    File is memory mapped and read by chunks, so neither the whole file is
+    held in memory nor anything but matching lines is decoded; gzipped
+    segment is decompressed in memory though.
+    '''
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        return search_buffer(path, data, pattern, limit)
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file can not be mapped
+            return []
+        try:
+            return search_buffer(path, data, pattern, limit)
+        finally:
+            data.close()
+
+
+def last_header(data, start, end):
+    '''Return (start, end, date) of the last block header which begins within data[start:end], or None'''
+    while True:
+        pos = data.rfind(SEPARATOR_BYTES, start, end)
+        if pos < 0:
+            return None
+        match = HEADER_RE.match(data, pos)
+        if match and is_line_start(data, pos):
+            return match.start(), match.end(), match.group(1).decode('utf8', 'replace')
+        end = pos + len(SEPARATOR_BYTES) - 1
+
+
+def is_line_start(data, pos):
+    return not pos or data[pos - 1:pos] == b'\n'
+
+
+def search_buffer(path, data, pattern, limit=None):
+    '''Search bytes or mmap, lines of block headers are skipped
+
+    Header of block is looked for backwards from each matching line, but not
+    beyond the previous matching line, so data is scanned about once.
+    '''
+    found = []
+    header, searched = None, 0  # the last header which begins before offset searched
+    size, pos, row = len(data), 0, 0  # row of pos
+    while pos < size and (limit is None or len(found) < limit):
+        stop = data.find(b'\n', min(pos + CHUNK_SIZE, size))
+        stop = size if stop < 0 else stop + 1
+        chunk = data[pos:stop]
+        last, counted = -1, 0  # start of the last matched line, offset up to which rows are counted
+        for a, b in pattern.spans(chunk):
+            start = chunk.rfind(b'\n', 0, a) + 1
+            if start == last:
+                continue
+            last = start
+            end = chunk.find(b'\n', max(b - 1, start))
+            if end < 0:
+                end = len(chunk)
+            # header which begins on the matching line is found too
+            header = last_header(data, searched, pos + start + len(SEPARATOR_BYTES)) or header
+            searched = pos + start + 1
+            if header and pos + start < header[1]:
+                continue
+            row += chunk.count(b'\n', counted, start)
+            counted = start
+            archived, block = (header[2], header[0]) if header else (u'', 0)
+            text = chunk[start:end].decode('utf8', 'replace').rstrip(u'\r')
+            found.append(Found(path, row, text, archived, block))
+            if limit is not None and len(found) >= limit:
+                break
+        row += chunk.count(b'\n', counted)
+        pos = stop
+    return found
+
+
+def read_block(path, offset):
+    '''Return Unicode block of archive file (gzipped too) which starts at offset'''
+    f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    try:
+        f.seek(offset)
+        data = f.read()
+    finally:
+        f.close()
+    ends = [m.start() for m in HEADER_RE.finditer(data, 1) if is_line_start(data, m.start())][:1]
+    return data[:ends[0] if ends else len(data)].decode('utf8', 'replace').replace(u'\r\n', u'\n')
@@ -1,34 +1,46 @@
 # coding: utf-8
 import sublime, sublime_plugin
-import json
-import re
 import locale
 import calendar
 import itertools
+import threading
+import heapq
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 
 NT = sublime.platform() == 'windows'
 ST3 = int(sublime.version()) >= 3000
 if ST3:
-    from .APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold
+    from .APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold, use_native_locale
+    from .PlainTasksDocument import get_document, update_async, COMPLETED, CANCELLED, HEADER, TASKS
+    from .PlainTasksPatterns import (SHORT_DATE_RE, RELATIVE_DATE_RE, CREATED_RE, CLOSED_DATE_RE, STARTED_RE, TOGGLE_RE,
+                                     CALCULATED_RE, SHORT_DUE_RE, TAG_UNDER_CURSOR_RE, DURATION_RE, TOTAL_RE)
     MARK_SOON = sublime.DRAW_NO_FILL
     MARK_INVALID = sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE
 else:
-    from APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold
+    from APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold, use_native_locale
+    from PlainTasksDocument import get_document, update_async, COMPLETED, CANCELLED, HEADER, TASKS
+    from PlainTasksPatterns import (SHORT_DATE_RE, RELATIVE_DATE_RE, CREATED_RE, CLOSED_DATE_RE, STARTED_RE, TOGGLE_RE,
+                                    CALCULATED_RE, SHORT_DUE_RE, TAG_UNDER_CURSOR_RE, DURATION_RE, TOTAL_RE)
     MARK_SOON = MARK_INVALID = 0
     sublime_plugin.ViewEventListener = object
 
 
-try:  # unavailable dependencies shall not break basic functionality
-    from dateutil import parser as dateutil_parser
-    from dateutil.relativedelta import relativedelta
-except:
-    dateutil_parser = None
+_dateutil = []
 
 
-if ST3:
-    locale.setlocale(locale.LC_ALL, '')
+def dateutil():
+    '''Return (parser, relativedelta) of dateutil imported on first use, (None, None) if unavailable'''
+    if not _dateutil:
+        try:  # unavailable dependencies shall not break basic functionality
+            from dateutil import parser as dateutil_parser
+            from dateutil.relativedelta import relativedelta
+        except:
+            dateutil_parser = relativedelta = None
+        _dateutil[:] = [dateutil_parser, relativedelta]
+    return _dateutil
 
 
 def is_yearfirst(date_format):
@@ -40,21 +52,7 @@ def is_dayfirst(date_format):
 
 
 def _convert_date(matchstr, now):
-    match_obj = re.search(r'''(?mxu)
-        (?:\s*
-         (?P<yearORmonthORday>\d*(?!:))
-         (?P<sep>[-\.])?
-         (?P<monthORday>\d*)
-         (?P=sep)?
-         (?P<day>\d*)
-         (?! \d*:)(?# e.g. '23:' == hour, but '1 23:' == day=1, hour=23)
-        )?
-        \s*
-        (?:
-         (?P<hour>\d*)
-         :
-         (?P<minute>\d*)
-        )?''', matchstr)
+    match_obj = SHORT_DATE_RE.search(matchstr)
     year  = now.year
     month = now.month
     day   = int(match_obj.group('day') or 0)
@@ -107,7 +105,7 @@ def increase_date(view, region, text, now, date_format):
     if '++' in text:
         line = view.line(region)
         line_content = view.substr(line)
-        created = re.search(r'(?mxu)@created\(([\d\w,\.:\-\/ @]*)\)', line_content)
+        created = CREATED_RE.search(line_content)
         if created:
             created_date, error = parse_date(created.group(1),
                                              date_format=date_format,
@@ -121,20 +119,12 @@ def increase_date(view, region, text, now, date_format):
             else:
                 now = created_date
 
-    match_obj = re.search(r'''(?mxu)
-        \s*\+\+?\s*
-        (?:
-         (?P<number>\d*(?![:.]))\s*
-         (?P<days>[Dd]?)
-         (?P<weeks>[Ww]?)
-         (?! \d*[:.])
-        )?
-        \s*
-        (?:
-         (?P<hour>\d*)
-         [:.]
-         (?P<minute>\d*)
-        )?''', text)
+    return shift_date(text, now)
+
+
+def shift_date(text, now):
+    '''Apply relative period, e.g. +2d or ++1w 2:30, to now'''
+    match_obj = RELATIVE_DATE_RE.search(text)
     number = int(match_obj.group('number') or 0)
     days   = match_obj.group('days')
     weeks  = match_obj.group('weeks')
@@ -187,6 +177,7 @@ def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayf
     default
         datetime object (now)
     '''
+    use_native_locale()
     try:
         return datetime.strptime(date_string, date_format), None
     except ValueError as e:
@@ -203,7 +194,7 @@ def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayf
             # e.g. @due(2-1) is always Fabruary 1st of next year,
             # but dateutil consider it this year
             raise Exception("Special case of short date: less than 3 numbers")
-        date = dateutil_parser.parse(bare_date_string,
+        date = dateutil()[0].parse(bare_date_string,
                                      yearfirst=yearfirst,
                                      dayfirst=dayfirst,
                                      default=default)
@@ -217,6 +208,93 @@ def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayf
     return date, error
 
 
+class LRUCache(object):
+    '''Bounded mapping, the least recently used item is dropped when it is full'''
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+resolved_dates = LRUCache(4096)
+
+
+def resolve_date(text, date_format, default, created=None):
+    '''
+    Memoized parse_date and increase_date, return tuple (date, error)
+    text
+        Unicode, argument of date tag, e.g. @due(text)
+    default
+        datetime object (now rounded to minute), it is part of cache key
+        for short and relative dates only, full dates are cached forever
+    created
+        Unicode, argument of @created tag of the same task in parentheses, used by ++ dates,
+        if it is invalid date is relative to default, see created_error
+    '''
+    use_native_locale()
+    if '+' in text:
+        key = (text, date_format, default, created if '++' in text else None)
+    else:
+        key = (text, date_format)
+        result = resolved_dates.get(key)
+        if result:
+            return result
+        try:
+            result = datetime.strptime(text, date_format), None
+        except ValueError:
+            key = (text, date_format, default)
+        else:
+            resolved_dates.set(key, result)
+            return result
+
+    result = resolved_dates.get(key)
+    if result:
+        return result
+
+    if '+' in text:
+        now = default
+        if '++' in text and created:
+            created_date, error = resolve_date(created, date_format, default)
+            if not error:
+                now = created_date
+        result = shift_date(text, now)
+    else:
+        result = parse_date(text,
+                            date_format=date_format,
+                            yearfirst=is_yearfirst(date_format),
+                            dayfirst=is_dayfirst(date_format),
+                            default=default)
+    resolved_dates.set(key, result)
+    return result
+
+
+def created_error(text, date_format, default, created=None):
+    '''Return error of @created date which ++ date in text is relative to, None if it is valid or not used'''
+    if '++' not in text or not created:
+        return None
+    return resolve_date(created, date_format, default)[1]
+
+
 def format_delta(view, delta):
     delta -= timedelta(microseconds=delta.microseconds)
     if view.settings().get('decimal_minutes', False):
@@ -231,93 +309,218 @@ def format_delta(view, delta):
     return delta.strip(' ,')
 
 
-class PlainTasksToggleHighlightPastDue(PlainTasksEnabled):
-    def run(self, edit):
-        highlight_on = self.view.settings().get('highlight_past_due', True)
-        self.view.erase_regions('past_due')
-        self.view.erase_regions('due_soon')
-        self.view.erase_regions('misformatted')
-        if not highlight_on:
-            return
+def seconds(td):
+    # timedelta.total_seconds() is not available in 2.6.x
+    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
+
+
+def timestamp(date):
+    '''Return date as integer amount of seconds, naive and aware dates are not mixed up'''
+    return (date.toordinal() * 24 + date.hour) * 3600 + date.minute * 60 + date.second
+
+
+SOON, PAST = 1, 2
+MAX_TIMER_DELAY = 60 * 60 * 1000  # wake up at least once per hour, clock may be changed
+set_timeout_async = getattr(sublime, 'set_timeout_async', sublime.set_timeout)
 
-        pattern = r'@due(\([^@\n]*\))'
-        dates_strings = []
-        dates_regions = self.view.find_all(pattern, 0, '\\1', dates_strings)
-        if not dates_regions:
-            if ST3:
-                self.view.settings().set('plain_tasks_remain_time_phantoms', [])
-            return
 
-        past_due, due_soon, misformatted, phantoms = self.group_due_tags(dates_strings, dates_regions)
+class DueSchedule(object):
+    '''Valid @due tags of view and heap of moments when they become due soon or past due
+
+    Timer wakes up at the nearest moment and flips state of crossing tags only;
+    if buffer was modified since, the whole highlighting is refreshed instead.
+    Remaining time shown in phantoms is counted in minutes, so while it is
+    shown timer wakes up at every minute boundary as well to redraw them.
+    '''
+    generations = itertools.count()
+
+    def __init__(self, view, regions, dates, threshold):
+        self.view = view
+        self.change_count = view.change_count()
+        self.generation = next(self.generations)
+        self.regions = regions
+        self.dates = dates
+        self.states = [None] * len(dates)
+        self.heap = [(date, i) for i, date in enumerate(dates)]
+        if threshold:
+            threshold = timedelta(seconds=threshold)
+            self.heap += [(date - threshold, i) for i, date in enumerate(dates)]
+        heapq.heapify(self.heap)
+
+    def advance(self, now):
+        '''Update states of tags whose moments have come, return True if any changed'''
+        changed = False
+        heap, states = self.heap, self.states
+        while heap and heap[0][0] <= now:
+            i = heapq.heappop(heap)[1]
+            state = PAST if now >= self.dates[i] else SOON
+            if states[i] != state:
+                states[i] = state
+                changed = True
+        return changed
+
+    def grouped(self, state):
+        return [r for r, s in zip(self.regions, self.states) if s == state]
+
+    def phantoms(self, now):
+        default = now - timedelta(seconds=now.second, microseconds=now.microsecond)
+        phantoms = []
+        for region, date in zip(self.regions, self.dates):
+            if now >= date:
+                phantoms.append((region.a, '-' + format_delta(self.view, default - date)))
+            else:
+                phantoms.append((region.a, format_delta(self.view, date - default)))
+        return phantoms
 
-        scope_past_due = self.view.settings().get('scope_past_due', 'string.other.tag.todo.critical')
-        scope_due_soon = self.view.settings().get('scope_due_soon', 'string.other.tag.todo.high')
-        scope_misformatted = self.view.settings().get('scope_misformatted', 'string.other.tag.todo.low')
-        icon_past_due = self.view.settings().get('icon_past_due', 'circle')
-        icon_due_soon = self.view.settings().get('icon_due_soon', 'dot')
-        icon_misformatted = self.view.settings().get('icon_misformatted', '')
-        self.view.add_regions('past_due', past_due, scope_past_due, icon_past_due)
-        self.view.add_regions('due_soon', due_soon, scope_due_soon, icon_due_soon, MARK_SOON)
-        self.view.add_regions('misformatted', misformatted, scope_misformatted, icon_misformatted, MARK_INVALID)
+    def shows_remain(self):
+        return ST3 and bool(self.dates) and self.view.settings().get('show_remain_due', False)
 
-        if not ST3:
+    def draw(self, now):
+        add_due_regions(self.view, self.grouped(PAST), self.grouped(SOON))
+        self.draw_remain(now)
+
+    def draw_remain(self, now):
+        if self.shows_remain():
+            self.view.settings().set('plain_tasks_remain_time_phantoms', self.phantoms(now))
+
+    def arm(self):
+        now = datetime.now()
+        delay = MAX_TIMER_DELAY
+        if self.heap:
+            delay = int(seconds(self.heap[0][0] - now) * 1000) + 100
+        elif not self.shows_remain():
             return
-        if self.view.settings().get('show_remain_due', False):
-            self.view.settings().set('plain_tasks_remain_time_phantoms', phantoms)
+        if self.shows_remain():
+            delay = min(delay, 60 * 1000 - now.second * 1000 - now.microsecond // 1000 + 100)
+        delay = min(max(delay, 100), MAX_TIMER_DELAY)
+        view_id, generation = self.view.id(), self.generation
+        set_timeout_async(lambda: on_due_timer(view_id, generation), delay)
+
+
+_schedules = {}
+
+
+def on_due_timer(view_id, generation):
+    schedule = _schedules.get(view_id)
+    if not schedule or schedule.generation != generation:
+        return  # highlighting was refreshed since, its own timer is armed
+    view = schedule.view
+    if ST3 and not view.is_valid():
+        del _schedules[view_id]
+        return
+    if view.change_count() != schedule.change_count:
+        view.run_command('plain_tasks_toggle_highlight_past_due')
+        return
+    now = datetime.now()
+    if schedule.advance(now):
+        schedule.draw(now)
+    else:
+        schedule.draw_remain(now)
+    schedule.arm()
+
+
+def add_due_regions(view, past_due, due_soon, misformatted=None):
+    settings = view.settings()
+    scope_past_due = settings.get('scope_past_due', 'string.other.tag.todo.critical')
+    scope_due_soon = settings.get('scope_due_soon', 'string.other.tag.todo.high')
+    icon_past_due = settings.get('icon_past_due', 'circle')
+    icon_due_soon = settings.get('icon_due_soon', 'dot')
+    view.add_regions('past_due', past_due, scope_past_due, icon_past_due)
+    view.add_regions('due_soon', due_soon, scope_due_soon, icon_due_soon, MARK_SOON)
+    if misformatted is not None:
+        scope_misformatted = settings.get('scope_misformatted', 'string.other.tag.todo.low')
+        icon_misformatted = settings.get('icon_misformatted', '')
+        view.add_regions('misformatted', misformatted, scope_misformatted, icon_misformatted, MARK_INVALID)
+
+
+def due_highlighting(view):
+    '''Return (DueSchedule, misformatted regions) of @due tags, None if highlighting is off
+
+    It only reads the view, so it is safe to call off the UI thread.
+    '''
+    if not view.settings().get('highlight_past_due', True):
+        return None
+    doc = get_document(view)
+    dates_strings, dates_regions, anchors = [], [], []
+    for row, tag in doc.due_tags():
+        dates_strings.append('(%s)' % tag.arg)
+        dates_regions.append(doc.tag_region(row, tag))
+        created = [t.arg for t in doc.tags[row] if t.name == 'created' and t.arg]
+        anchors.append('(%s)' % created[0] if created else None)
+    return group_due_tags(view, dates_strings, dates_regions, anchors)
+
+
+def group_due_tags(view, dates_strings, dates_regions, anchors=None):
+    '''Return DueSchedule of valid dates and list of misformatted regions'''
+    regions, dates, misformatted = [], [], []
+    date_format = view.settings().get('date_format', '(%y-%m-%d %H:%M)')
+    anchors = anchors or [None] * len(dates_regions)
+    now = datetime.now()
+    default = now - timedelta(seconds=now.second, microseconds=now.microsecond)  # for short dates w/o time
+    due_soon_threshold = view.settings().get('highlight_due_soon', 24) * 60 * 60
+
+    for i, region in enumerate(dates_regions):
+        date, error = resolve_date(dates_strings[i], date_format, default, anchors[i])
+        anchor_error = created_error(dates_strings[i], date_format, default, anchors[i])
+        if anchor_error:
+            ln = view.rowcol(region.a)[0] + 1
+            print(u'\nPlainTasks:\nError at line %d\n\t%s\ncaused by text:\n\t"@created%s"\n' % (ln, anchor_error, anchors[i]))
+            sublime.status_message(u'@created date is invalid at line %d, see console for details' % ln)
+        if error:
+            misformatted.append(region)
         else:
-            self.view.settings().set('plain_tasks_remain_time_phantoms', [])
+            regions.append(region)
+            dates.append(date)
+    return DueSchedule(view, regions, dates, due_soon_threshold), misformatted
+
+
+def show_due_highlighting(view, highlighting):
+    '''Draw result of due_highlighting and arm timer of its schedule'''
+    view.erase_regions('past_due')
+    view.erase_regions('due_soon')
+    view.erase_regions('misformatted')
+    _schedules.pop(view.id(), None)
+    if highlighting is None:
+        return
+    schedule, misformatted = highlighting
+    if not schedule.regions and not misformatted:
+        if ST3:
+            view.settings().set('plain_tasks_remain_time_phantoms', [])
+        return
+
+    now = datetime.now()
+    schedule.advance(now)
+    add_due_regions(view, schedule.grouped(PAST), schedule.grouped(SOON), misformatted)
+    _schedules[view.id()] = schedule
+    schedule.arm()
+
+    if not ST3:
+        return
+    if view.settings().get('show_remain_due', False):
+        view.settings().set('plain_tasks_remain_time_phantoms', schedule.phantoms(now))
+    else:
+        view.settings().set('plain_tasks_remain_time_phantoms', [])
 
-    def group_due_tags(self, dates_strings, dates_regions):
-        past_due, due_soon, misformatted, phantoms = [], [], [], []
-        date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
-        yearfirst = is_yearfirst(date_format)
-        now = datetime.now()
-        default = now - timedelta(seconds=now.second, microseconds=now.microsecond)  # for short dates w/o time
-        due_soon_threshold = self.view.settings().get('highlight_due_soon', 24) * 60 * 60
 
-        for i, region in enumerate(dates_regions):
-            if any(s in self.view.scope_name(region.a) for s in ('completed', 'cancelled')):
-                continue
-            text = dates_strings[i]
-            if '+' in text:
-                date, error = increase_date(self.view, region, text, default, date_format)
-                # print(date, date_format)
-            else:
-                date, error = parse_date(text,
-                                         date_format=date_format,
-                                         yearfirst=yearfirst,
-                                         dayfirst=is_dayfirst(date_format),
-                                         default=default)
-                # print(date, date_format, yearfirst)
-            if error:
-                # print(error)
-                misformatted.append(region)
-            else:
-                if now >= date:
-                    past_due.append(region)
-                    phantoms.append((region.a, '-' + format_delta(self.view, default - date)))
-                else:
-                    phantoms.append((region.a, format_delta(self.view, date - default)))
-                    if due_soon_threshold:
-                        td = (date - now)
-                        # timedelta.total_seconds() is not available in 2.6.x
-                        time_left = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
-                        if time_left < due_soon_threshold:
-                            due_soon.append(region)
-        return past_due, due_soon, misformatted, phantoms
+class PlainTasksToggleHighlightPastDue(PlainTasksEnabled):
+    def run(self, edit):
+        show_due_highlighting(self.view, due_highlighting(self.view))
 
 
 class PlainTasksHLDue(sublime_plugin.EventListener):
-    def on_activated(self, view):
+    def on_activated_async(self, view):
         if not view.score_selector(0, "text.todo") > 0:
             return
-        view.run_command('plain_tasks_toggle_highlight_past_due')
+        update_async(view, 'due', due_highlighting, show_due_highlighting)
+
+    def on_post_save_async(self, view):
+        self.on_activated_async(view)
 
-    def on_post_save(self, view):
-        self.on_activated(view)
+    def on_load_async(self, view):
+        self.on_activated_async(view)
 
-    def on_load(self, view):
-        self.on_activated(view)
+    if not ST3:  # there are no async events, update_async still debounces
+        on_activated, on_post_save, on_load = on_activated_async, on_post_save_async, on_load_async
 
 
 class PlainTasksFoldToDueTags(PlainTasksFold):
@@ -325,39 +528,126 @@ class PlainTasksFoldToDueTags(PlainTasksFold):
         if not self.view.settings().get('highlight_past_due', True):
             return sublime.message_dialog('highlight_past_due setting must be true')
         self.view.run_command('plain_tasks_toggle_highlight_past_due')
-        dues = sorted(self.view.line(r) for r in (self.view.get_regions('past_due') + self.view.get_regions('due_soon')))
+        doc = get_document(self.view)
+        dues = set(doc.row(r.a) for r in (self.view.get_regions('past_due') + self.view.get_regions('due_soon')))
         if not dues:
             return sublime.message_dialog('No overdue tasks.\nCongrats!')
-        self.exec_folding(self.add_projects_and_notes(dues))
+        self.exec_folding(self.add_projects_and_notes(sorted(dues)))
+
+
+def task_duration(started_matches, toggle_matches, now, date_format):
+    '''Return timedelta between @started and now without paused intervals, None if task was not started
+
+    started_matches, toggle_matches
+        lists of Unicode, dates in parentheses
+    now
+        Unicode, moment of completion or cancellation in date_format
+    '''
+    if not started_matches:
+        return None
+    start = datetime.strptime(started_matches[0], date_format)
+    end = datetime.strptime(now, date_format)
+
+    toggle_times = [datetime.strptime(toggle, date_format) for toggle in toggle_matches]
+    all_times = [start] + toggle_times + [end]
+    pairs = zip(all_times[::2], all_times[1::2])
+    deltas = [pair[1] - pair[0] for pair in pairs]
+    return sum(deltas, timedelta())
+
+
+def duration_tag(view, tag, delta, date_format):
+    '''Return e.g. " @lasted(1:30)" for timedelta'''
+    delta = format_delta(view, delta)
+    return ' @%s(%s)' % (tag, delta.rstrip(', ') if delta else ('a bit' if '%H' in date_format else 'less than day'))
+
+
+def parse_duration(match):
+    '''Return timedelta of DURATION_RE match'''
+    days, hours, minutes, seconds, dhours, dfraction = match.group(2, 4, 5, 6, 7, 8)
+    if dhours is not None:  # decimal_minutes setting, e.g. 1.50 is hour and a half
+        time = timedelta(hours=float('%s.%s' % (dhours, dfraction)))
+    else:
+        time = timedelta(hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return timedelta(days=int(days or 0)) + time
+
+
+def spent_time(text):
+    '''Return sum of @lasted and @wasted in text'''
+    return sum((parse_duration(m) for m in DURATION_RE.finditer(text) if m.group(1) != 'total'), timedelta())
+
+
+class TimeRollup(object):
+    '''Time spent on every project: @lasted and @wasted of its tasks and of tasks
+    of nested projects; @total tags and time of projects themselves are not counted
+
+    It is built in one pass over tasks plus one backward pass over projects of
+    ProjectIndex, each task adds to its nearest project, each project to its parent.
+
+    lines
+        list of Unicode, new content of rows, it defaults to content of doc
+    stop
+        row, tasks from it onwards are not counted, e.g. archive
+    '''
+
+    def __init__(self, doc, lines=None, stop=None):
+        index = doc.hierarchy
+        lines = doc.lines if lines is None else lines
+        own = [timedelta() for _ in index.rows]
+        for row, kind in enumerate(doc.kinds[:stop]):
+            if kind in TASKS and 'asted' in lines[row]:
+                i = index.enclosing(row)
+                if i >= 0:
+                    own[i] += spent_time(lines[row])
+        for i in range(len(own) - 1, -1, -1):  # nested projects come after their parents
+            if index.parents[i] >= 0:
+                own[index.parents[i]] += own[i]
+        self.rows, self.totals = index.rows, own
+
+    def total(self, row):
+        '''Time spent on project at given row'''
+        i = bisect_left(self.rows, row)
+        return self.totals[i] if i < len(self.rows) and self.rows[i] == row else timedelta()
+
+
+def time_rollup(doc):
+    '''TimeRollup of current content of doc'''
+    rollup = doc.cache.get('rollup')
+    if rollup is None:
+        rollup = doc.cache['rollup'] = TimeRollup(doc)
+    return rollup
+
+
+def total_tag(view, total):
+    return ' @total(%s)' % format_delta(view, total).rstrip(', ') if total else ''
 
 
 class PlainTasksCalculateTotalTimeForProject(PlainTasksEnabled):
     def run(self, edit, start):
-        line = self.view.line(int(start))
-        total, eol = self.calc_total_time_for_project(line)
-        if total:
-            self.view.insert(edit, eol, ' @total(%s)' % format_delta(self.view, total).rstrip(', '))
-
-    def calc_total_time_for_project(self, line):
-        pattern = r'(?<=\s)@(lasted|wasted|total)\([ \t]*(?:(\d+)[ \t]*days?,?)?[ \t]*((?:(\d+)\:(\d+)\:?(\d+)?)|(?:(\d+)\.(\d+)))?[ \t]*\)'
-        format = '{"days": "\\2", "hours": "\\4", "minutes": "\\5", "seconds": "\\6", "dhours": "\\7", "dminutes": "\\8"}'
-        lasted_strings = []
-        lasted_regions = self.view.find_all(pattern, 0, format, lasted_strings)
-        if not lasted_regions:
-            return 0, 0
-
-        eol = line.end()
-        project_block = self.view.indented_region(eol + 1)
-        total = timedelta()
-        for i, region in enumerate(lasted_regions):
-            if not all((region > line, region.b <= project_block.b)):
-                continue
-            t = json.loads(lasted_strings[i].replace('""', '"0"'))
-            total += timedelta(days=int(t['days']),
-                               hours=int(t['hours']) or int(t['dhours']),
-                               minutes=int(t['minutes']) or int(t['dminutes']) * 60,
-                               seconds=int(t['seconds']))
-        return total, eol
+        doc = get_document(self.view)
+        row = doc.row(int(start))
+        tag = total_tag(self.view, time_rollup(doc).total(row))
+        if tag:
+            self.view.insert(edit, doc.line_region(row).b, tag)
+
+
+class PlainTasksRefreshTotalTime(PlainTasksBase):
+    '''Put up-to-date @total to every project before archive, all changed lines are replaced at once'''
+    def is_enabled(self):
+        return self.view.score_selector(0, "text.todo") > 0
+
+    def runCommand(self, edit):
+        doc = get_document(self.view)
+        stop = doc.archive_row(self.archive_name)
+        rollup = TimeRollup(doc, stop=stop)
+        changed = []
+        for row in doc.rows([HEADER], stop=stop):
+            text = doc.lines[row]
+            dblspc = '  ' if text.endswith('  ') else ''  # keep double whitespace at eol
+            new = TOTAL_RE.sub('', text).rstrip() + total_tag(self.view, rollup.total(row)) + dblspc
+            if new != text:
+                changed.append((row, new))
+        doc.replace_rows(edit, changed)
+        sublime.status_message('Total time is updated in %d projects' % len(changed))
 
 
 class PlainTasksCalculateTimeForTask(PlainTasksEnabled):
@@ -374,51 +664,37 @@ class PlainTasksCalculateTimeForTask(PlainTasksEnabled):
         tag
             Unicode object (lasted for complete, wasted for cancelled)
         '''
-        if not started_matches:
-            return
-
         date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
-        start = datetime.strptime(started_matches[0], date_format)
-        end = datetime.strptime(now, date_format)
-
-        toggle_times = [datetime.strptime(toggle, date_format) for toggle in toggle_matches]
-        all_times = [start] + toggle_times + [end]
-        pairs = zip(all_times[::2], all_times[1::2])
-        deltas = [pair[1] - pair[0] for pair in pairs]
-
-        delta = format_delta(self.view, sum(deltas, timedelta()))
+        delta = task_duration(started_matches, toggle_matches, now, date_format)
+        if delta is None:
+            return
 
-        tag = ' @%s(%s)' % (tag, delta.rstrip(', ') if delta else ('a bit' if '%H' in date_format else 'less than day'))
         eol = int(eol)
         if self.view.substr(sublime.Region(eol - 2, eol)) == '  ':
             eol -= 2  # keep double whitespace at eol
-        self.view.insert(edit, eol, tag)
+        self.view.insert(edit, eol, duration_tag(self.view, tag, delta, date_format))
 
 
 class PlainTasksReCalculateTimeForTasks(PlainTasksEnabled):
     def run(self, edit):
-        started = r'^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$'
-        toggle = r'@toggle(\([\d\w,\.:\-\/ @]*\))'
-        calculated = r'([ \t]@[lw]asted\([\d\w,\.:\-\/ @]*\))'
-        done = r'^\s*[^\b]*?\s*@(done|cancell?ed)[ \t]*(\([\d\w,\.:\-\/ @]*\)).*$'
-
         date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
         default_now = datetime.now().strftime(date_format)
 
         regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
+        doc = get_document(self.view)  # lines are changed from bottom, so rows above stay valid
         for line in regions:
-            current_scope = self.view.scope_name(line.a)
-            if not any(s in current_scope for s in ('completed', 'cancelled')):
+            kind = doc.kind(line.a)
+            if kind not in (COMPLETED, CANCELLED):
                 continue
 
             line_contents = self.view.substr(line)
 
-            done_match = re.match(done, line_contents, re.U)
+            done_match = CLOSED_DATE_RE.match(line_contents)
             now = done_match.group(2) if done_match else default_now
 
-            started_matches = re.findall(started, line_contents, re.U)
-            toggle_matches = re.findall(toggle, line_contents, re.U)
-            calc_matches = re.findall(calculated, line_contents, re.U)
+            started_matches = STARTED_RE.findall(line_contents)
+            toggle_matches = TOGGLE_RE.findall(line_contents)
+            calc_matches = CALCULATED_RE.findall(line_contents)
 
             for match in calc_matches:
                 line_contents = line_contents.replace(match, '')
@@ -430,7 +706,7 @@ class PlainTasksReCalculateTimeForTasks(PlainTasksEnabled):
                     'toggle_matches': toggle_matches,
                     'now': now,
                     'eol': line.begin() + len(line_contents),
-                    'tag': 'lasted' if 'completed' in current_scope else 'wasted'}
+                    'tag': 'lasted' if kind == COMPLETED else 'wasted'}
             )
 
 
@@ -486,7 +762,7 @@ class PlainTasksPreviewShortDate(PlainTasksViewEventListener):
 
         rgn = self.view.extract_scope(s.a)
         text = self.view.substr(rgn)
-        match = re.match(r'@due\(([^@\n]*)\)[\s$]*', text)
+        match = SHORT_DUE_RE.match(text)
         # print(s, rgn, text)
 
         if not match:
@@ -571,9 +847,8 @@ class PlainTasksCalendar(sublime_plugin.TextCommand):
             tag under cursor (i.e. point)
         '''
         start = end = point
-        tag_pattern = r'(?<=\s)(\@[^\(\) ,\.]+)([\w\d\.\(\)\-!? :\+]*)'
         line = self.view.line(point)
-        matches = re.finditer(tag_pattern, self.view.substr(line))
+        matches = TAG_UNDER_CURSOR_RE.finditer(self.view.substr(line))
         for match in matches:
             m_start = line.a + match.start(1)
             m_end   = line.a + match.end(2)
@@ -675,7 +950,7 @@ class PlainTasksCalendar(sublime_plugin.TextCommand):
 
         def shift(stamp, month=0, year=0):
             y, m, d, H, M = (int(i) for i in stamp.split('-'))
-            date = datetime(y, m, d, H, M, 0) + relativedelta(months=month, years=year)
+            date = datetime(y, m, d, H, M, 0) + dateutil()[1](months=month, years=year)
             self.view.update_popup(self.generate_calendar(date))
 
         case = {
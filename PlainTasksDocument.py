@@ -0,0 +1,423 @@
+# coding: utf-8
+import sublime, sublime_plugin
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+if int(sublime.version()) >= 3000:
+    from .PlainTasksParser import (EMPTY, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE,
+                                   TASKS, PROJECTS, classify_line, parse_tags, measure_indent, project_name)
+else:
+    from PlainTasksParser import (EMPTY, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE,
+                                  TASKS, PROJECTS, classify_line, parse_tags, measure_indent, project_name)
+
+# Sublime Text 4 reports every edit of buffer, it is absent in ST2 and ST3
+TextChangeListener = getattr(sublime_plugin, 'TextChangeListener', None)
+
+
+def common_ends(old_lines, new_lines, limit=None):
+    '''Return numbers of equal lines at the beginning and at the end of both lists'''
+    if limit is None:
+        limit = min(len(old_lines), len(new_lines))
+    head = 0
+    while head < limit and old_lines[head] == new_lines[head]:
+        head += 1
+    tail = 0
+    limit -= head
+    while tail < limit and old_lines[~tail] == new_lines[~tail]:
+        tail += 1
+    return head, tail
+
+
+class Document(object):
+    '''Parsed picture of a todo view: kind, indentation and tags of every line
+
+    It is synced lazily by change count. In Sublime Text 4 edits reported by
+    TextChangeListener are applied to parsed lines and only rows touched by
+    them are parsed again. Otherwise (ST2, ST3, or when reported edits do not
+    add up to size of buffer) whole buffer is read and compared with parsed
+    lines, which is linear in size of file, though only differing lines are
+    parsed again.
+
+    Commands ask it what kind of line is at given point instead of calling
+    view.scope_name, which is a round trip to editor for every line.
+
+    Lists are edited in place under lock; code which walks through all of
+    them outside of the main thread reads a snapshot instead.
+
+    kinds
+        array('B') of kinds of lines
+    starts
+        array('I') of offsets of lines, computed again from the first edited line only
+    cache
+        dict for results computed from current content, it is replaced on every change
+    '''
+
+    def __init__(self, view):
+        self.view = view
+        self.change_count = -1
+        self.tab_size = 4
+        self._lock = threading.Lock()
+        self._changes = [] if TextChangeListener else None  # reported edits which are not applied yet
+        self.reset()
+
+    def reset(self):
+        self.lines = []
+        self.kinds = array('B')
+        self.indents = []
+        self.tags = []
+        self.size = 0
+        self.cache = {}
+        self._version = 0  # number of updates of lists
+        self._positions = (0, array('I'))  # version and offsets of lines computed for it
+        self._valid_starts = 0  # number of leading offsets which are still valid for current lines
+
+    @property
+    def text(self):
+        cache = self.cache
+        text = cache.get('text')
+        if text is None:
+            text = cache['text'] = '\n'.join(self.lines)
+        return text
+
+    def snapshot(self):
+        '''Return copies of (lines, kinds, indents, tags) which are consistent with each other'''
+        with self._lock:
+            return list(self.lines), array('B', self.kinds), list(self.indents), list(self.tags)
+
+    def sync(self):
+        change_count = self.view.change_count()
+        if change_count == self.change_count:
+            return self
+        with self._lock:
+            if change_count == self.change_count:
+                return self
+            changes = self._changes
+            if changes is not None:
+                self._changes = []
+            tab_size = self.view.settings().get('tab_size', 4)
+            if tab_size != self.tab_size:
+                self.tab_size = tab_size
+                self.reset()
+            size = self.view.size()
+            if not (self.change_count >= 0 and changes and self.apply(changes, size)):
+                self.update(self.view.substr(sublime.Region(0, size)))
+            self.change_count = change_count
+        return self
+
+    def record(self, changes):
+        '''Keep TextChange list reported by listener until the next sync'''
+        with self._lock:
+            # edits reported after sync read the buffer are in parsed lines already
+            if self._changes is not None and self.view.change_count() != self.change_count:
+                self._changes.extend(changes)
+
+    def apply(self, changes, size):
+        '''Apply TextChange list to parsed lines, return False if they do not lead to given size'''
+        if self.size + sum(len(c.str) - (c.b.pt - c.a.pt) for c in changes) != size:
+            return False
+        lines = self.lines
+        head = end = None  # rows touched by changes within new lines
+        moved = 0  # difference between amounts of new and old lines
+        for change in changes:
+            a, b = change.a, change.b
+            if b.row >= len(lines) or a.col > len(lines[a.row]) or b.col > len(lines[b.row]):
+                self.reset()  # lines are edited partially already
+                return False
+            new = (lines[a.row][:a.col] + change.str + lines[b.row][b.col:]).split('\n')
+            lines[a.row:b.row + 1] = new
+            delta = len(new) - (b.row - a.row + 1)
+            if head is None:
+                head, end = a.row, a.row + len(new)
+            else:
+                if end > b.row:
+                    end += delta
+                elif end > a.row:
+                    end = a.row + len(new)
+                head, end = min(head, a.row), max(end, a.row + len(new))
+            moved += delta
+        end = min(end, len(lines))
+        self.publish(lines, head, end - moved, end, size)
+        return True
+
+    def update(self, text):
+        '''Parse lines of text which differ from already parsed ones'''
+        new_lines = text.split('\n')
+        old_lines = self.lines
+        head, tail = common_ends(old_lines, new_lines)
+        self.publish(new_lines, head, len(old_lines) - tail, len(new_lines) - tail, len(text))
+
+    def publish(self, lines, head, old_end, new_end, size):
+        '''Parse rows head:new_end of lines in place of old rows head:old_end'''
+        changed = lines[head:new_end]
+        self.kinds[head:old_end] = array('B', [classify_line(l) for l in changed])
+        self.indents[head:old_end] = [measure_indent(l, self.tab_size) for l in changed]
+        self.tags[head:old_end] = [parse_tags(l) for l in changed]
+        self.lines = lines
+        self.size = size
+        self.cache = {}
+        self._version += 1
+        self._valid_starts = min(self._valid_starts, head + 1)  # lines above edit did not move
+
+    # POSITIONS
+
+    @property
+    def starts(self):
+        version, starts = self._positions
+        if version == self._version:
+            return starts
+        with self._lock:
+            lines = self.lines
+            valid = min(self._valid_starts, len(lines), len(self._positions[1]))
+            starts = self._positions[1][:valid]  # new array, so readers in other threads are not affected
+            pt = starts[-1] + len(lines[valid - 1]) + 1 if valid else 0
+            tail = []
+            for line in lines[valid:]:
+                tail.append(pt)
+                pt += len(line) + 1
+            starts.fromlist(tail)
+            self._positions, self._valid_starts = (self._version, starts), len(lines)
+        return starts
+
+    def row(self, pt):
+        return bisect_right(self.starts, pt) - 1
+
+    def kind(self, pt):
+        '''Kind of line at given point'''
+        return self.kinds[self.row(pt)]
+
+    def line_region(self, row):
+        a = self.starts[row]
+        return sublime.Region(a, a + len(self.lines[row]))
+
+    def tag_region(self, row, tag):
+        a = self.starts[row]
+        return sublime.Region(a + tag.begin, a + tag.end)
+
+    def archive_row(self, archive_name):
+        '''Row of the first occurrence of archive name, or None'''
+        pt = self.text.find(archive_name)
+        if pt < 0:
+            return None
+        return self.row(pt)
+
+    def replace_lines(self, edit, new_lines):
+        '''Turn content of the view into new_lines by one replacement of changed lines only'''
+        old_lines = self.lines
+        if old_lines == new_lines:
+            return
+        # keep at least one line on both sides, so replaced region is never empty
+        head, tail = common_ends(old_lines, new_lines, min(len(old_lines), len(new_lines)) - 1)
+        last = len(old_lines) - tail - 1
+        region = sublime.Region(self.starts[head], self.starts[last] + len(old_lines[last]))
+        self.view.replace(edit, region, '\n'.join(new_lines[head:len(new_lines) - tail]))
+
+    def replace_rows(self, edit, changed):
+        '''Replace given rows from bottom to top, changed is list of (row, new text)
+
+        Selections keep their rows and columns, regions of other lines are not touched.
+        '''
+        if not changed:
+            return
+        changed = sorted(changed)
+        new_texts = dict(changed)
+        changed_rows, shifts, shift = [], [], 0  # shift of start of the next row after each changed one
+        for row, text in changed:
+            shift += len(text) - len(self.lines[row])
+            changed_rows.append(row)
+            shifts.append(shift)
+
+        def moved(pt):
+            row = self.row(pt)
+            i = bisect_left(changed_rows, row)
+            start = self.starts[row] + (shifts[i - 1] if i else 0)
+            return start + min(pt - self.starts[row], len(new_texts.get(row, self.lines[row])))
+
+        view = self.view
+        selections = [sublime.Region(moved(r.a), moved(r.b)) for r in view.sel()]
+        regions = [(self.line_region(row), text) for row, text in changed]
+        for region, text in reversed(regions):
+            view.replace(edit, region, text)
+        view.sel().clear()
+        for region in selections:
+            view.sel().add(region)
+
+    # QUERIES
+
+    def rows(self, kinds, start=0, stop=None):
+        kinds_list = self.kinds
+        return [r for r in range(start, len(kinds_list) if stop is None else stop) if kinds_list[r] in kinds]
+
+    def notes(self, row):
+        '''Rows of notes which belong to item at given row'''
+        kinds_list = self.kinds
+        notes = []
+        row += 1
+        while row < len(kinds_list) and kinds_list[row] == NOTE:
+            notes.append(row)
+            row += 1
+        return notes
+
+    @property
+    def hierarchy(self):
+        '''ProjectIndex of current content'''
+        cache = self.cache
+        index = cache.get('hierarchy')
+        if index is None:
+            index = cache['hierarchy'] = ProjectIndex(self)
+        return index
+
+    def projects(self, row):
+        '''Rows of projects and separators containing given row, nearest first'''
+        index = self.hierarchy
+        i = index.enclosing(row)
+        projects = []
+        while i >= 0:
+            projects.append(index.rows[i])
+            i = index.parents[i]
+        return projects
+
+    def project_path(self, row, sep=' / '):
+        index = self.hierarchy
+        i = index.enclosing(row)
+        return sep.join(n for n in index.paths[i] if n) if i >= 0 else ''
+
+    def project_paths(self, rows, sep=' / '):
+        '''Return {row: project path} for given rows'''
+        return dict((row, self.project_path(row, sep)) for row in rows)
+
+    def project_name(self, row):
+        return project_name(self.lines[row])
+
+    def due_tags(self):
+        '''Yield (row, tag) for each @due tag outside of completed and cancelled tasks'''
+        _, kinds_list, _, all_tags = self.snapshot()
+        for row, tags in enumerate(all_tags):
+            if not tags or kinds_list[row] in (COMPLETED, CANCELLED):
+                continue
+            for tag in tags:
+                if tag.name == 'due' and tag.arg is not None:
+                    yield row, tag
+
+
+class ProjectIndex(object):
+    '''Sorted rows of projects and separators with links to their parents
+
+    It is built in one forward pass, afterwards enclosing project of any row
+    is found by bisection and a few steps up through parents (one per level
+    of nesting), rather than by walking back through lines.
+
+    rows
+        list of rows of projects and separators, ascending
+    parents
+        list, index of parent within rows for each item of rows, or -1
+    paths
+        list, tuple of names of headers from outermost to the item itself
+    '''
+
+    def __init__(self, doc):
+        lines, kinds, self.indents, _ = doc.snapshot()
+        self.rows, self.parents, self.paths = [], [], []
+        stack = []  # indices of open projects
+        for row, kind in enumerate(kinds):
+            if kind not in PROJECTS:
+                continue
+            indent = self.indents[row]
+            while stack and self.indents[self.rows[stack[-1]]] >= indent:
+                stack.pop()
+            parent = stack[-1] if stack else -1
+            path = self.paths[parent] if stack else ()
+            if kind == HEADER:
+                path += (project_name(lines[row]),)
+            stack.append(len(self.rows))
+            self.rows.append(row)
+            self.parents.append(parent)
+            self.paths.append(path)
+
+    def enclosing(self, row):
+        '''Index within rows of the nearest project containing given row, or -1'''
+        indent = self.indents[row]
+        if not indent:
+            return -1
+        i = bisect_left(self.rows, row) - 1
+        while i >= 0 and self.indents[self.rows[i]] >= indent:
+            i = self.parents[i]
+        return i
+
+
+_documents = {}
+
+
+def get_document(view):
+    '''Return parsed model of the view, synced with its current content'''
+    document = _documents.get(view.id())
+    if document is None:
+        document = _documents[view.id()] = Document(view)
+    return document.sync()
+
+
+set_timeout_async = getattr(sublime, 'set_timeout_async', sublime.set_timeout)
+DEBOUNCE_DELAY = 50  # ms, events which come within it are served by one computation
+_jobs = {}  # (view id, key): generation of the latest request
+
+
+def update_async(view, key, compute, apply, delay=DEBOUNCE_DELAY):
+    '''Run compute(view) off the UI thread, then apply(view, result) on it
+
+    Requests are coalesced per view and key: only the latest one of a burst is
+    computed, and result is dropped if buffer was modified meanwhile, then the
+    job is scheduled once more unless a newer request is already pending.
+    '''
+    job = (view.id(), key)
+    generation = _jobs[job] = _jobs.get(job, 0) + 1
+
+    def is_latest():
+        return _jobs.get(job) == generation
+
+    def run():
+        if not is_latest() or not is_alive(view):
+            return
+        change_count = view.change_count()
+        result = compute(view)
+        sublime.set_timeout(lambda: finish(change_count, result), 0)
+
+    def finish(change_count, result):
+        if not is_latest() or not is_alive(view):
+            return
+        if view.change_count() != change_count:
+            update_async(view, key, compute, apply, delay)
+            return
+        del _jobs[job]
+        apply(view, result)
+
+    set_timeout_async(run, delay)
+
+
+def is_alive(view):
+    is_valid = getattr(view, 'is_valid', None)  # there is no such method in ST2
+    return view.id() and (is_valid is None or is_valid())
+
+
+if TextChangeListener:
+    class PlainTasksTextChangeListener(TextChangeListener):
+        @classmethod
+        def is_applicable(cls, buffer):
+            return True
+
+        def on_text_changed(self, changes):
+            for view in self.buffer.views():
+                document = _documents.get(view.id())
+                if document is not None:
+                    document.record(changes)
+
+
+class PlainTasksDocumentListener(sublime_plugin.EventListener):
+    def on_modified_async(self, view):
+        # keep already built models up to date, so commands find them ready
+        if view.id() in _documents:
+            get_document(view)
+
+    def on_close(self, view):
+        _documents.pop(view.id(), None)
+        for job in [j for j in _jobs if j[0] == view.id()]:
+            del _jobs[job]
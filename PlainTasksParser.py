@@ -0,0 +1,174 @@
+# coding: utf-8
+'''Plain text parser of todo files, it does not depend on Sublime Text API
+
+Every line is classified the same way as PlainTasks.sublime-syntax does it,
+thus it is possible to process todo files outside of editor, e.g.
+
+    with io.open('work.todo', encoding='utf8') as f:
+        for line in iter_parse(f):
+            if line.kind == PENDING and line.tag('critical'):
+                print(line.row, ' / '.join(line.projects), line.text)
+'''
+import io
+import re
+import sys
+from collections import namedtuple
+
+
+# kinds of lines
+EMPTY, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE = range(8)
+KIND_NAMES = ('empty', 'note', 'pending', 'completed', 'cancelled', 'header', 'separator', 'archive')
+TASKS = (PENDING, COMPLETED, CANCELLED)
+PROJECTS = (HEADER, SEPARATOR)
+
+# syntax rules are applied to every line independently (each context pops at eol),
+# so kind of line depends on its own text only; order is the same as in syntax
+LINE_RULES = (
+    (HEADER, re.compile(r'^\s*(\#?\s?\w+.*?:\s*?(\@[^\s]+(\(.*?\))?\s*?)*$)', re.U)),
+    (COMPLETED, re.compile(r'^\s*(?:(\+|✓|✔|☑|√|\[x\])(\s+(?:[^\@\n]|(?<!\s)\@|\@(?=\s))*)([^\n]*))|^\s*(?:(-)(\s+(?:[^\@]|(?<!\s)\@|\@(?=\s))*)(.*\@done(?=\s|\(|$)[^\n]*))', re.U)),
+    (CANCELLED, re.compile(r'^\s*(?:(✘|❌|x|\[-\])(\s+(?:[^\@\n]|(?<!\s)\@|\@(?=\s))*)(.*))|^\s*(?:(-)(\s+(?:[^\@]|(?<!\s)\@|\@(?=\s))*)(.*\@cancelled(?=\s|\(|$)[^\n]*))', re.U)),
+    (NOTE, re.compile(r'^\s*(?!-|\+|✓|✔|√|❍|❑|■|□|☐|▪|▫|–|—|≡|→|›|\[[\sx-]\]|＿|✘|❌|(x\s+))(?=\S)', re.U)),
+    (PENDING, re.compile(r'^\s*(-|❍|❑|■|□|☐|▪|▫|–|—|≡|→|›|\[\s\])(?=(\s+(?:[^\@\n]|(?<![ \t])\@)*)(?!([^\n]*)?(\@done|\@cancelled)[\s\(]))', re.U)),
+    (ARCHIVE, re.compile(r'^＿+$', re.U)),
+    (SEPARATOR, re.compile(r'^\s*---.{3,5}---+$', re.U)),
+)
+
+BULLET_RE = re.compile(r'^\s*(\[[\sx-]\]|\S)', re.U)
+TAG_RE = re.compile(r'(?<=\s)@([\w\-\.]+)(?:[ \t]*\(([^()\n]*)\))?', re.U)
+INDENT_RE = re.compile(r'[ \t]*')
+PROJECT_NAME_RE = re.compile(r'^\s*(.+):(?=\s|$)', re.U)
+
+# name w/o @, argument within parentheses or None, begin and end are relative to line
+Tag = namedtuple('Tag', 'name arg begin end')
+
+
+def classify_line(text):
+    '''Return kind of line, text must not contain line break'''
+    # syntax matches line along with its line break
+    text += '\n'
+    for kind, rule in LINE_RULES:
+        if rule.match(text):
+            return kind
+    return EMPTY
+
+
+def parse_tags(text):
+    '''Return list of Tag found in text'''
+    if '@' not in text:
+        return ()
+    return [Tag(m.group(1), m.group(2), m.start(), m.end()) for m in TAG_RE.finditer(text)]
+
+
+def measure_indent(text, tab_size=4):
+    return len(INDENT_RE.match(text).group().expandtabs(tab_size))
+
+
+def project_name(text):
+    '''Title of project w/o colon and trailing tags'''
+    match = PROJECT_NAME_RE.match(text)
+    return match.group(1) if match else ''
+
+
+class Line(object):
+    '''Parsed line of todo file
+
+    row
+        int, zero based
+    kind
+        int, one of EMPTY, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE
+    indent
+        int, width of leading whitespaces, tabs are expanded
+    tags
+        list of Tag
+    projects
+        tuple of names of enclosing projects, outermost first
+    archived
+        bool, True if line is placed after archive separator
+    '''
+    __slots__ = ('row', 'text', 'kind', 'indent', 'tags', 'projects', 'archived')
+
+    def __init__(self, row, text, tab_size=4):
+        self.row = row
+        self.text = text
+        self.kind = classify_line(text)
+        self.indent = measure_indent(text, tab_size)
+        self.tags = parse_tags(text)
+        self.projects = ()
+        self.archived = False
+
+    @property
+    def kind_name(self):
+        return KIND_NAMES[self.kind]
+
+    @property
+    def bullet(self):
+        if self.kind not in TASKS:
+            return ''
+        return BULLET_RE.match(self.text).group(1)
+
+    def tag(self, name):
+        '''Return first Tag with given name or None'''
+        for tag in self.tags:
+            if tag.name == name:
+                return tag
+        return None
+
+    def __repr__(self):
+        return 'Line(%d, %s, %r)' % (self.row, self.kind_name, self.text)
+
+
+def iter_parse(lines, tab_size=4):
+    '''Yield Line for each string of iterable, e.g. opened file; line breaks are stripped
+
+    Only one line and stack of enclosing projects are kept in memory,
+    so files of any size can be processed.
+    '''
+    stack = []  # (indent, name) of enclosing projects, separator has no name
+    archived = False
+    for row, text in enumerate(lines):
+        text = text.rstrip('\r\n')
+        line = Line(row, text, tab_size)
+        kind = line.kind
+        if kind == ARCHIVE:
+            archived = True
+        while stack and stack[-1][0] >= line.indent and kind in PROJECTS:
+            stack.pop()
+        line.projects = tuple(name for indent, name in stack if name and indent < line.indent)
+        line.archived = archived
+        if kind in PROJECTS:
+            stack.append((line.indent, project_name(text) if kind == HEADER else None))
+        yield line
+
+
+def parse(text, tab_size=4):
+    '''Return list of Line for whole text'''
+    return list(iter_parse(text.split('\n'), tab_size))
+
+
+def parse_file(file_name, tab_size=4, encoding='utf8'):
+    '''Yield Line for each line of file'''
+    with io.open(file_name, 'r', encoding=encoding, errors='replace') as f:
+        for line in iter_parse(f, tab_size):
+            yield line
+
+
+def main(file_names):
+    '''Print tasks of given files as json lines'''
+    import json
+    for file_name in file_names:
+        for line in parse_file(file_name):
+            if line.kind not in TASKS:
+                continue
+            print(json.dumps({
+                'file': file_name,
+                'row': line.row,
+                'kind': line.kind_name,
+                'text': line.text.strip(),
+                'tags': [(t.name, t.arg) for t in line.tags],
+                'projects': line.projects,
+                'archived': line.archived,
+            }, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+# coding: utf-8
+'''Precompiled regular expressions used by commands, it does not depend on Sublime Text API
+
+Patterns which do not depend on settings are compiled once at import,
+those which do are kept in Registry, see get_registry.
+'''
+import re
+
+
+# TASKS, groups: indent, bullet, very task
+OPEN_TASK_RE = re.compile(r'^(\s*)(\[\s\]|.)(\s*.*)$', re.U)
+# groups: indent, bullet, very task, ending either w/ done or w/o it & no date, date, possible project tag after date
+DONE_TASK_RE = re.compile(r'''
+    ^(\s*)(\[x\]|.)                               # 0,1 indent & bullet
+    (\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*) #   2 very task
+    (?=
+      ((?:\s@done|@project|@[wl]asted|$).*)   # 3 ending either w/ done or w/o it & no date
+      |                                       #   or
+      (?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$ # 4 date & possible project tag after
+    )
+    ''', re.U | re.X)
+# the same as DONE_TASK_RE, except bullet & ending
+CANCELLED_TASK_RE = re.compile(r'^(\s*)(\[\-\]|.)(\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*)(?=((?:\s@cancelled|@project|@[wl]asted|$).*)|(?:[ \t](\([^()]*\))\s*([^@]*|(?:@project|@[wl]asted).*))?$)', re.U)
+# groups: bullet, rest of task
+ARCHIVE_TASK_RE = re.compile(r'^\s*(\[[x-]\]|.)(\s+.*$)', re.U)
+
+# LINES
+NOT_EMPTY_LINE_RE = re.compile(r'^(\s*)(\S.*)$', re.U)
+EMPTY_LINE_RE = re.compile(r'^(\s+)$', re.U)
+INDENT_RE = re.compile(r'^(\s*)\S', re.U)
+
+# TAGS
+STARTED_RE = re.compile(r'^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$', re.U)
+TOGGLE_RE = re.compile(r'@toggle(\([\d\w,\.:\-\/ @]*\))', re.U)
+CALCULATED_RE = re.compile(r'([ \t]@[lw]asted\([\d\w,\.:\-\/ @]*\))', re.U)
+# groups: tag, days, time, hours, minutes, seconds, decimal hours, decimal fraction
+DURATION_RE = re.compile(r'(?<=\s)@(lasted|wasted|total)\([ \t]*(?:(\d+)[ \t]*days?,?)?[ \t]*((?:(\d+)\:(\d+)\:?(\d+)?)|(?:(\d+)\.(\d+)))?[ \t]*\)', re.U)
+TOTAL_RE = re.compile(r'[ \t]@total\([^()\n]*\)', re.U)
+CLOSED_DATE_RE = re.compile(r'^\s*[^\b]*?\s*@(done|cancell?ed)[ \t]*(\([\d\w,\.:\-\/ @]*\)).*$', re.U)
+ARCHIVED_DATE_RE = re.compile(r'^\s*[^\n]*?\s\@(?:done|cancelled)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$', re.U)
+CREATED_RE = re.compile(r'(?mxu)@created\(([\d\w,\.:\-\/ @]*)\)')
+DUE_RE = re.compile(r'^\s*[^\b]*?\s*@due\(([\d\w,\.:\-\/ @]*)\).*$', re.U)
+SHORT_DUE_RE = re.compile(r'@due\(([^@\n]*)\)[\s$]*', re.U)
+CRITICAL_RE = re.compile(r'^\s*[^\b]*?\s*@critical\b.*$', re.U)
+HIGH_RE = re.compile(r'^\s*[^\b]*?\s*@high\b.*$', re.U)
+LOW_RE = re.compile(r'^\s*[^\b]*?\s*@low\b.*$', re.U)
+TAG_UNDER_CURSOR_RE = re.compile(r'(?<=\s)(\@[^\(\) ,\.]+)([\w\d\.\(\)\-!? :\+]*)', re.U)
+
+# DATES
+SHORT_DATE_RE = re.compile(r'''(?mxu)
+    (?:\s*
+     (?P<yearORmonthORday>\d*(?!:))
+     (?P<sep>[-\.])?
+     (?P<monthORday>\d*)
+     (?P=sep)?
+     (?P<day>\d*)
+     (?! \d*:)(?# e.g. '23:' == hour, but '1 23:' == day=1, hour=23)
+    )?
+    \s*
+    (?:
+     (?P<hour>\d*)
+     :
+     (?P<minute>\d*)
+    )?''')
+RELATIVE_DATE_RE = re.compile(r'''(?mxu)
+    \s*\+\+?\s*
+    (?:
+     (?P<number>\d*(?![:.]))\s*
+     (?P<days>[Dd]?)
+     (?P<weeks>[Ww]?)
+     (?! \d*[:.])
+    )?
+    \s*
+    (?:
+     (?P<hour>\d*)
+     [:.]
+     (?P<minute>\d*)
+    )?''')
+STATS_PLACEHOLDER_RE = re.compile(r'{{.*?}}')
+
+
+class Registry(object):
+    '''Patterns which depend on settings
+
+    stats_expressions
+        list of (placeholder, compiled expression) from stats_format, e.g. {{@high}}
+    '''
+
+    def __init__(self, stats_format):
+        self.stats_expressions = []
+        for placeholder in STATS_PLACEHOLDER_RE.findall(stats_format):
+            expression = placeholder.strip('{}')
+            try:
+                rx = re.compile(expression, re.U)
+            except re.error:
+                rx = re.compile(re.escape(expression), re.U)
+            self.stats_expressions.append((placeholder, rx))
+
+
+DEFAULTS = (
+    ('stats_format', '$n/$a done ($percent%) $progress Last task @done $last'),
+)
+_registries = {}
+
+
+def get_registry(settings):
+    '''Return Registry for given settings (any object with get method),
+    it is built once for each combination of relevant settings'''
+    key = tuple(settings.get(name, default) for name, default in DEFAULTS)
+    registry = _registries.get(key)
+    if registry is None:
+        if len(_registries) > 32:
+            _registries.clear()
+        registry = _registries[key] = Registry(*key)
+    return registry
@@ -0,0 +1,351 @@
+# coding: utf-8
+'''Query tasks of many todo files, it does not depend on Sublime Text API
+
+Query is a space separated list of terms, task must match all of them:
+
+    is:pending is:done is:cancelled
+        state of task, several states are joined with "or"
+    in:archive
+        include archived tasks, they are skipped by default
+    @tag -@tag
+        task has (has not) tag
+    due:overdue due:today due:tomorrow due:week
+    due:2017-05-20 due:2017-05-01..2017-05-31 due:..2017-05-31
+        task has @due within given period, week means next seven days
+    project:name
+        one of enclosing projects contains name
+    word -word "several words"
+        text of task contains (does not contain) it, case insensitive
+
+It can be used from command line as well, files are parsed by process pool:
+
+    python PlainTasksQuery.py "is:pending @critical due:week" ~/projects
+
+Set PLAINTASKS_INDEX environment variable to path of SQLite database to keep
+parsed tasks between runs, see TaskIndex.
+'''
+import json
+import os
+import shlex
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+if __package__:
+    from .PlainTasksParser import COMPLETED, CANCELLED, PENDING, TASKS, parse_file
+else:
+    from PlainTasksParser import COMPLETED, CANCELLED, PENDING, TASKS, parse_file
+
+
+EXTENSIONS = ('.todo', '.taskpaper')
+STATES = {'pending': PENDING, 'done': COMPLETED, 'completed': COMPLETED, 'cancelled': CANCELLED}
+
+# tags is tuple of (name, argument or None), projects is tuple of names, outermost first
+Task = namedtuple('Task', 'file row kind text tags projects archived')
+
+
+def read_tasks(file_name):
+    '''Return (file_name, (mtime, size), list of Task), stat is taken before reading'''
+    try:
+        st = os.stat(file_name)
+        tasks = [Task(file_name, line.row, line.kind, line.text.strip(),
+                      tuple((t.name, t.arg) for t in line.tags), line.projects, line.archived)
+                 for line in parse_file(file_name) if line.kind in TASKS]
+    except (IOError, OSError):
+        return file_name, None, []
+    return file_name, (st.st_mtime, st.st_size), tasks
+
+
+def find_files(folders, extensions=EXTENSIONS):
+    '''Yield todo files under folders, hidden folders are skipped'''
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.endswith(extensions):
+                    yield os.path.join(root, name)
+
+
+_sqlite3 = []
+
+
+def load_sqlite3():
+    '''Return sqlite3 module imported on first use, None if it is unavailable'''
+    if not _sqlite3:
+        try:
+            import sqlite3
+        except ImportError:  # it is not shipped with some builds of Sublime Text
+            sqlite3 = None
+        _sqlite3.append(sqlite3)
+    return _sqlite3[0]
+
+
+class TaskCache(object):
+    '''Tasks of files, file is parsed again only when its mtime or size changes'''
+
+    def __init__(self):
+        self.files = {}  # file name: ((mtime, size), list of Task)
+
+    def update(self, file_names, map_func=map):
+        '''Parse new and changed files, map_func allows to do it in pool
+
+        file_names is a list of all todo files of scanned folders, entries of
+        other files are dropped, so deleted and moved files do not linger.
+        '''
+        stale = []
+        for file_name in file_names:
+            cached = self.files.get(file_name)
+            try:
+                st = os.stat(file_name)
+            except OSError:
+                self.drop(file_name)
+                continue
+            stat = (st.st_mtime, st.st_size)
+            if cached and cached[0] == stat:
+                continue
+            tasks = self.load(file_name, stat)
+            if tasks is None:
+                stale.append(file_name)
+            else:
+                self.files[file_name] = (stat, tasks)
+        for file_name, stat, tasks in map_func(read_tasks, stale):
+            if stat is None:
+                self.drop(file_name)
+            else:
+                self.store(file_name, stat, tasks)
+        self.prune(set(file_names))
+        return len(stale)
+
+    def load(self, file_name, stat):
+        '''Return tasks of file saved earlier with the same stat, or None'''
+        return None
+
+    def store(self, file_name, stat, tasks):
+        self.files[file_name] = (stat, tasks)
+
+    def drop(self, file_name):
+        self.files.pop(file_name, None)
+
+    def prune(self, file_names):
+        '''Drop entries of files which are not in file_names (set)'''
+        for file_name in [f for f in self.files if f not in file_names]:
+            self.drop(file_name)
+
+    def tasks(self, file_names):
+        for file_name in file_names:
+            cached = self.files.get(file_name)
+            if cached:
+                for task in cached[1]:
+                    yield task
+
+
+class TaskIndex(TaskCache):
+    '''TaskCache saved in SQLite database, so files which have not changed
+    since previous session are not parsed at all
+
+    Dates are stored in ISO format along with tags, e.g. for queries in SQL:
+    done_at of @done or @cancelled, due_at of @due if it is a full date in
+    date_format. Relative and short @due depend on current time, so their
+    due_at is NULL and Query resolves arguments of tags itself.
+    If sqlite3 is unavailable, it works as TaskCache.
+    '''
+    VERSION = 3
+    SCHEMA = '''
+        DROP TABLE IF EXISTS files;
+        DROP TABLE IF EXISTS tasks;
+        CREATE TABLE files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, date_format TEXT);
+        CREATE TABLE tasks (path TEXT, row INTEGER, kind INTEGER, text TEXT, tags TEXT, projects TEXT,
+                            archived INTEGER, due_at TEXT, done_at TEXT);
+        CREATE INDEX tasks_path ON tasks (path);
+        PRAGMA user_version = %d;
+    '''
+
+    def __init__(self, db_path, date_format='(%y-%m-%d %H:%M)'):
+        TaskCache.__init__(self)
+        self.db_path = db_path
+        self.date_format = date_format
+        self.db = None
+
+    def connect(self):
+        folder = os.path.dirname(self.db_path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        db = load_sqlite3().connect(self.db_path)
+        if db.execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+            db.executescript(self.SCHEMA % self.VERSION)
+        return db
+
+    def update(self, file_names, map_func=map):
+        if load_sqlite3() is None:
+            return TaskCache.update(self, file_names, map_func)
+        self.db = self.connect()
+        try:
+            with self.db:
+                return TaskCache.update(self, file_names, map_func)
+        finally:
+            self.db.close()
+            self.db = None
+
+    def load(self, file_name, stat):
+        if self.db is None:
+            return None
+        saved = self.db.execute('SELECT mtime, size, date_format FROM files WHERE path = ?', (file_name, )).fetchone()
+        if not saved or tuple(saved) != stat + (self.date_format, ):
+            return None
+        rows = self.db.execute('SELECT row, kind, text, tags, projects, archived FROM tasks WHERE path = ? ORDER BY row',
+                               (file_name, ))
+        return [Task(file_name, row, kind, text, tuple(tuple(t) for t in json.loads(tags)),
+                     tuple(json.loads(projects)), bool(archived))
+                for row, kind, text, tags, projects, archived in rows]
+
+    def store(self, file_name, stat, tasks):
+        TaskCache.store(self, file_name, stat, tasks)
+        if self.db is None:
+            return
+        self.db.execute('DELETE FROM tasks WHERE path = ?', (file_name, ))
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (file_name, ) + stat + (self.date_format, ))
+        self.db.executemany('INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [self.record(task) for task in tasks])
+
+    def drop(self, file_name):
+        TaskCache.drop(self, file_name)
+        if self.db is not None:
+            self.db.execute('DELETE FROM tasks WHERE path = ?', (file_name, ))
+            self.db.execute('DELETE FROM files WHERE path = ?', (file_name, ))
+
+    def prune(self, file_names):
+        TaskCache.prune(self, file_names)
+        if self.db is not None:
+            for file_name in [path for path, in self.db.execute('SELECT path FROM files') if path not in file_names]:
+                self.drop(file_name)
+
+    def record(self, task):
+        tags = dict((name, arg) for name, arg in reversed(task.tags))  # first one wins
+        done = tags.get('done') or tags.get('cancelled')
+        return (task.file, task.row, task.kind, task.text, json.dumps(task.tags), json.dumps(task.projects),
+                int(task.archived), self.iso_date(tags.get('due')), self.iso_date(done))
+
+    def iso_date(self, arg):
+        '''Return ISO format of full date in date_format, None for relative, short or invalid date'''
+        if not arg:
+            return None
+        try:
+            return datetime.strptime('(%s)' % arg.strip(), self.date_format).isoformat()
+        except ValueError:
+            return None
+
+
+def default_resolve(task, arg, date_format='(%y-%m-%d %H:%M)'):
+    '''Return datetime of @due argument or None'''
+    try:
+        return datetime.strptime('(%s)' % arg, date_format)
+    except ValueError:
+        return None
+
+
+class Query(object):
+    '''Compiled query, see module docstring for syntax
+
+    resolve
+        function(task, argument of @due) which returns datetime or None
+    '''
+
+    def __init__(self, text, now=None, resolve=default_resolve):
+        self.text = text
+        self.now = now or datetime.now()
+        self.resolve = resolve
+        self.states = set()
+        self.archived = False
+        self.predicates = []
+        try:
+            terms = shlex.split(text)
+        except ValueError as e:
+            raise ValueError('Invalid query: %s' % e)
+        for term in terms:
+            self.add_term(term)
+        if not self.states:
+            self.states = set(TASKS)
+
+    def add_term(self, term):
+        negate = term.startswith('-') and len(term) > 1
+        if negate:
+            term = term[1:]
+        key, _, value = term.partition(':')
+        if key == 'is' and value in STATES and not negate:
+            self.states.add(STATES[value])
+            return
+        if key == 'in' and value == 'archive' and not negate:
+            self.archived = True
+            return
+        if key == 'due' and value:
+            predicate = self.due_predicate(value)
+        elif key == 'project' and value:
+            name = value.lower()
+            predicate = lambda task: any(name in p.lower() for p in task.projects)
+        elif term.startswith('@') and len(term) > 1:
+            tag = term[1:]
+            predicate = lambda task: any(name == tag for name, _ in task.tags)
+        else:
+            word = term.lower()
+            predicate = lambda task: word in task.text.lower()
+        self.predicates.append((lambda task: not predicate(task)) if negate else predicate)
+
+    def due_predicate(self, value):
+        start, end = self.period(value)
+
+        def predicate(task):
+            for name, arg in task.tags:
+                if name == 'due' and arg is not None:
+                    date = self.resolve(task, arg)
+                    if date is not None and (start is None or date >= start) and (end is None or date < end):
+                        return True
+            return False
+        return predicate
+
+    def period(self, value):
+        '''Return (start, end) of period, either may be None'''
+        today = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        day = timedelta(days=1)
+        if value == 'overdue':
+            return None, self.now
+        if value == 'today':
+            return today, today + day
+        if value == 'tomorrow':
+            return today + day, today + 2 * day
+        if value == 'week':
+            return today, today + 7 * day
+        first, sep, last = value.partition('..')
+        try:
+            start = datetime.strptime(first, '%Y-%m-%d') if first else None
+            end = datetime.strptime(last or first, '%Y-%m-%d') + day if (last or not sep) else None
+        except ValueError:
+            raise ValueError('Invalid due period: %s' % value)
+        return start, end
+
+    def match(self, task):
+        if task.kind not in self.states or (task.archived and not self.archived):
+            return False
+        return all(predicate(task) for predicate in self.predicates)
+
+    def filter(self, tasks):
+        return [task for task in tasks if self.match(task)]
+
+
+def main(args):
+    '''Print tasks matching query as "file:line: projects: task"'''
+    import multiprocessing
+    query, folders = Query(args[0]), args[1:] or ['.']
+    db_path = os.environ.get('PLAINTASKS_INDEX')
+    cache = TaskIndex(db_path) if db_path else TaskCache()
+    pool = multiprocessing.Pool()
+    try:
+        files = sorted(find_files(folders))
+        cache.update(files, lambda func, items: pool.imap_unordered(func, items, 16))
+    finally:
+        pool.close()
+    for task in query.filter(cache.tasks(files)):
+        print(u'%s:%d: %s%s' % (task.file, task.row + 1, ''.join(p + ': ' for p in task.projects), task.text))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -3,9 +3,6 @@
 import sublime
 import os
 import re
-import webbrowser
-import cgi
-import tempfile
 
 platform = sublime.platform()
 ST2 = int(sublime.version()) < 3000
@@ -18,11 +15,18 @@ else:
     import io
 
 if not ST2:
+    from html import escape
     from .plist_parser import parse_file
     from .PlainTasks import PlainTasksBase
+    from .PlainTasksDocument import get_document, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE
+    from .PlainTasksParser import LINE_RULES
 else:
+    from cgi import escape
+    from StringIO import StringIO
     from plist_parser import parse_file
     from PlainTasks import PlainTasksBase
+    from PlainTasksDocument import get_document, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE
+    from PlainTasksParser import LINE_RULES
 
 
 def hex_to_rgba(value):
@@ -144,187 +148,156 @@ def convert_tmtheme_to_css(theme_file):
     return cssl
 
 
+BULLET_RULES = dict((kind, rule) for kind, rule in LINE_RULES if kind in (COMPLETED, CANCELLED))
+PENDING_BULLET_RE = re.compile(r'^(\s*)(-|❍|❑|■|□|☐|▪|▫|–|—|≡|→|›|\[\s\])', re.U)
+
+MARKUP_RULES = (
+    r'(?P<bold>(?<!\S)(?P<b>\*\*|__)(?=\S).+?(?<=\S)(?P=b)(?![\w\d]))',
+    r'(?P<italic>(?<!\S)(?P<i>\*|_)(?=\S).+?(?<=\S)(?P=i)(?![\*_\w\d]))',
+    r'(?P<url>(?<!\S)<\w+?(?!\s)[\.:](?!\s)[^\n]+?>)',
+)
+TAG_RULES = (
+    r'(?P<tag>(?<=\s)\@(?!(?:high|today|critical|low|completed|done)(?:[\s\(]|$))[\w\d\.\(\)\-!? :\+]+[ \t]*)',
+    r'(?P<today>(?<=\s)\@today|✭ᴛᴏᴅᴀʏ)',
+    r'(?P<low>(?<=\s)\@low|✭low)',
+    r'(?P<high>(?<=\s)\@high|✭high)',
+    r'(?P<critical>(?<=\s)\@critical|✭critical)',
+)
+# notes have markup only, pending tasks have markup and tags; order is the same as in syntax
+NOTE_INLINE_RE = re.compile('|'.join(MARKUP_RULES), re.U)
+PENDING_INLINE_RE = re.compile('|'.join(MARKUP_RULES + TAG_RULES), re.U)
+
+
+def inline_html(text, regex, pos=0):
+    '''Return escaped text[pos:] where markup, urls and tags are wrapped into html tags'''
+    html = []
+    for m in regex.finditer(text, pos):
+        if m.start() > pos:
+            html.append(escape(text[pos:m.start()]))
+        kind, part = m.lastgroup, m.group()
+        if kind in ('b', 'i'):  # lastgroup is inner one for markup
+            kind = 'bold' if kind == 'b' else 'italic'
+        if kind == 'bold':
+            html.append('<b>%s</b>' % escape(part.strip('_*')))
+        elif kind == 'italic':
+            html.append('<i>%s</i>' % escape(part.strip('_*')))
+        elif kind == 'url':
+            html.append('<a href="{0}">{0}</a>'.format(escape(part.strip('<>'))))
+        elif kind == 'tag':
+            html.append('<span class="tag">%s</span>' % escape(part))
+        else:
+            html.append('<span class="tag-%s">%s</span>' % (kind, escape(part)))
+        pos = m.end()
+    html.append(escape(text[pos:]))
+    return ''.join(html)
+
+
+def closed_task_html(text, kind):
+    name = 'done' if kind == COMPLETED else 'cancelled'
+    m = BULLET_RULES[kind].match(text + '\n')
+    first = 1 if m.group(1) is not None else 4
+    bullet, task, tags = m.group(first, first + 1, first + 2)
+    return '<span class="{0}">{1}<span class="bullet-{0}">{2}</span>{3}{4}</span>'.format(
+        name, text[:m.start(first)], escape(bullet), escape(task.rstrip('\n')),
+        '<span class="tag-%s">%s</span>' % (name, escape(tags)) if tags else '')
+
+
+def line_html(text, kind):
+    '''Return html for single line of given kind'''
+    if kind == HEADER:
+        return '<span class="header">%s</span>' % escape(text)
+    if kind == NOTE:
+        return '<span class="note">%s</span>' % inline_html(text, NOTE_INLINE_RE)
+    if kind == PENDING:
+        m = PENDING_BULLET_RE.match(text)
+        return '<span class="open">{0}<span class="bullet-pending">{1}</span>{2}</span>'.format(
+            m.group(1), escape(m.group(2)), inline_html(text, PENDING_INLINE_RE, m.end()))
+    if kind in (COMPLETED, CANCELLED):
+        return closed_task_html(text, kind)
+    if kind == SEPARATOR:
+        return '<span class="sep">%s</span>' % escape(text)
+    if kind == ARCHIVE:
+        return '<span class="sep-archive">%s</span>' % escape(text)
+    # these are empty lines (i.e. linebreaks, but span can be {display:none})
+    return '<span class="empty-line">%s</span>' % text
+
+
+def iter_html(lines, kinds):
+    '''Yield html for every line, each line is tokenized once'''
+    for text, kind in zip(lines, kinds):
+        yield line_html(text, kind)
+
+
+def split_template(template):
+    '''Return parts of template before and after $content'''
+    template = '\n'.join(line.strip('\n') for line in template.splitlines())
+    before, _, after = template.partition('$content')
+    return before, after
+
+
+def write_html(sink, template, title, css, lines, kinds):
+    '''Write filled template (pair of parts) to file-like sink, content is streamed line by line'''
+    before, after = template
+    sink.write(before.replace('$title', title).replace('$css', css))
+    for i, html in enumerate(iter_html(lines, kinds)):
+        sink.write('\n' + html if i else html)
+    sink.write(after.replace('$title', title).replace('$css', css))
+
+
+def read_template(path):
+    with io.open(path, 'r', encoding='utf8') as f:
+        return split_template(f.read())
+
+
+def read_css(theme_file):
+    return '\n'.join(convert_tmtheme_to_css(theme_file))
+
+
+_files = {}  # (load function, path): ((mtime, size), value)
+
+
+def cached_file(path, load):
+    '''Return load(path), it is called again only when mtime or size of file changes'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return load(path)
+    key, stamp = (load, path), (st.st_mtime, st.st_size)
+    cached = _files.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    value = load(path)
+    _files[key] = (stamp, value)
+    return value
+
+
 class PlainTasksConvertToHtml(PlainTasksBase):
     def is_enabled(self):
         return self.view.score_selector(0, "text.todo") > 0
 
     def runCommand(self, edit, ask=False):
-        all_lines_regions = self.view.split_by_newlines(sublime.Region(0, self.view.size()))
-        html_doc = []
-        patterns = {'HEADER':    'text.todo keyword.control.header.todo ',
-                    'EMPTY':     'text.todo ',
-                    'NOTE':      'text.todo notes.todo ',
-                    'OPEN':      'text.todo meta.item.todo.pending ',
-                    'DONE':      'text.todo meta.item.todo.completed ',
-                    'CANCELLED': 'text.todo meta.item.todo.cancelled ',
-                    'SEPARATOR': 'text.todo meta.punctuation.separator.todo ',
-                    'ARCHIVE':   'text.todo meta.punctuation.archive.todo '
-                    }
-        for r in all_lines_regions:
-            i = self.view.scope_name(r.a)
-
-            if patterns['HEADER'] in i:
-                ht = '<span class="header">%s</span>' % cgi.escape(self.view.substr(r))
-
-            elif i == patterns['EMPTY']:
-                # these are empty lines (i.e. linebreaks, but span can be {display:none})
-                ht = '<span class="empty-line">%s</span>' % self.view.substr(r)
-
-            elif patterns['NOTE'] in i:
-                scopes = self.extracting_scopes(self, r, i)
-                note = '<span class="note">'
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'italic' in sn:
-                        note += '<i>%s</i>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'bold' in sn:
-                        note += '<b>%s</b>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'url' in sn:
-                        note += '<a href="{0}">{0}</a>'.format(cgi.escape(self.view.substr(s).strip('<>')))
-                    else:
-                        note += cgi.escape(self.view.substr(s))
-                ht = note + '</span>'
-
-            elif patterns['OPEN'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                pending = '<span class="open">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        pending += '<span class="bullet-pending">%s</span>' % self.view.substr(s)
-                    elif 'meta.tag' in sn:
-                        pending += '<span class="tag">%s</span>' % cgi.escape(self.view.substr(s))
-                    elif 'tag.todo.today' in sn:
-                        pending += '<span class="tag-today">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.critical' in sn:
-                        pending += '<span class="tag-critical">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.high' in sn:
-                        pending += '<span class="tag-high">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.low' in sn:
-                        pending += '<span class="tag-low">%s</span>' % self.view.substr(s)
-                    elif 'italic' in sn:
-                        pending += '<i>%s</i>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'bold' in sn:
-                        pending += '<b>%s</b>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'url' in sn:
-                        pending += '<a href="{0}">{0}</a>'.format(cgi.escape(self.view.substr(s).strip('<>')))
-                    else:
-                        pending += cgi.escape(self.view.substr(s))
-                ht = pending + '</span>'
-
-            elif patterns['DONE'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                done = '<span class="done">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        done += '<span class="bullet-done">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.completed' in sn:
-                        done += '<span class="tag-done">%s</span>' % cgi.escape(self.view.substr(s))
-                    else:
-                        done += cgi.escape(self.view.substr(s))
-                ht = done + '</span>'
-
-            elif patterns['CANCELLED'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                cancelled = '<span class="cancelled">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        cancelled += '<span class="bullet-cancelled">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.cancelled' in sn:
-                        cancelled += '<span class="tag-cancelled">%s</span>' % cgi.escape(self.view.substr(s))
-                    else:
-                        cancelled += cgi.escape(self.view.substr(s))
-                ht = cancelled + '</span>'
-
-            elif patterns['SEPARATOR'] in i:
-                ht = '<span class="sep">%s</span>' % cgi.escape(self.view.substr(r))
-
-            elif patterns['ARCHIVE'] in i:
-                ht = '<span class="sep-archive">%s</span>' % cgi.escape(self.view.substr(r))
-
-            else:
-                sublime.error_message('Hey! you are not supposed to see this message.\n'
-                                      'Please, report an issue in PlainTasks repository on GitHub.')
-            html_doc.append(ht)
-
+        lines, kinds = get_document(self.view).snapshot()[:2]
         title = os.path.basename(self.view.file_name()) if self.view.file_name() else 'Export'
-        html  = self.produce_html_from_template(title, html_doc)
+        ppath = sublime.packages_path()
+        tmtheme = os.path.join(ppath, self.view.settings().get('color_scheme').replace('Packages/', '', 1))
+        css = cached_file(tmtheme, read_css)
+        template = cached_file(os.path.join(ppath, 'PlainTasks/templates/template.html'), read_template)
 
         if ask:
+            html = io.StringIO() if not ST2 else StringIO()
+            write_html(html, template, title, css, lines, kinds)
             window = sublime.active_window()
             nv = window.new_file()
             nv.set_syntax_file('Packages/HTML/HTML.tmLanguage')
             nv.set_name(title + '.html')
-            nv.insert(edit, 0, html)
+            nv.insert(edit, 0, html.getvalue())
             window.run_command('close_file')
             return
 
+        import tempfile
+        import webbrowser
         tmp_html = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
-        tmp_html.write(html.encode('utf-8'))
         tmp_html.close()
+        with io.open(tmp_html.name, 'w', encoding='utf-8') as f:
+            write_html(f, template, title, css, lines, kinds)
         webbrowser.open_new_tab("file://%s" % tmp_html.name)
-
-    def produce_html_from_template(self, title, html_doc):
-        html_lines = []
-        ppath = sublime.packages_path()
-        tmtheme = os.path.join(ppath, self.view.settings().get('color_scheme').replace('Packages/', '', 1))
-        css = '\n'.join(convert_tmtheme_to_css(tmtheme))
-        with io.open(os.path.join(ppath, 'PlainTasks/templates/template.html'), 'r', encoding='utf8') as template:
-            for line in template:
-                line = (line.replace('$title', title)
-                            .replace('$content', '\n'.join(html_doc))
-                            .replace('$css', css)
-                            .strip('\n'))
-                html_lines.append(line)
-        return u'\n'.join(html_lines)
-
-    def extracting_scopes(self, edit, region, scope_name=''):
-        '''extract scope for each char in line wo dups, ineffective but it works?'''
-        scopes = []
-
-        for p in range(region.b-region.a):
-            p += region.a
-            sr = self.view.extract_scope(p)
-            # fix multi-line, because variable region is always a single line
-            if sr.a < region.a or sr.b - 1 > region.b:
-                if scopes and p == scopes[~0].b:  # *text* inbetween *markups*
-                    sr = sublime.Region(p, region.b)
-                else:  # multi-line
-                    sr = sublime.Region(region.a, region.b)
-            # main block, add unique entity to the list
-            if sr not in scopes:
-                scopes.append(sr)
-            elif scopes and self.view.scope_name(p) != self.view.scope_name(scopes[~0].a):
-                scopes.append(sublime.Region(p, region.b))
-            # fix intersecting regions, e.g. markup in notes
-            if scopes and sr.a < scopes[~0].b and p - 1 == scopes[~0].b:
-                scopes.append(sublime.Region(scopes[~0].b, sr.b))
-
-        if scopes and scopes[~0].b > region.b:
-            # avoid line break at eol
-            scopes[~0] = sublime.Region(scopes[~0].a, region.b)
-
-        if len(scopes) > 1:
-            # fix bullet
-            if scopes[0].intersects(scopes[1]):
-                scopes[0] = sublime.Region(scopes[0].a, scopes[1].a)
-            # fix text after tag(s)
-            if scopes[~0].b < region.b or scopes[~0].a < region.a:
-                scopes.append(sublime.Region(scopes[~0].b, region.b))
-            new_scopes = scopes[:0:~0]
-            for i, s in enumerate(new_scopes):
-                # fix overall intersections
-                if s.intersects(scopes[~(i + 1)]):
-                    if scopes[~(i + 1)].b < s.b:
-                        scopes[~i] = sublime.Region(scopes[~(i + 1)].b, s.b)
-                        new_scopes[i] = scopes[~i]
-                    else:
-                        scopes[~(i + 1)] = sublime.Region(scopes[~(i + 1)].a, s.a)
-                        if len(new_scopes) > i + 1:
-                            new_scopes[i + 1] = scopes[~(i + 1)]
-        return scopes
@@ -0,0 +1,205 @@
+# coding: utf-8
+'''Headless benchmarks of PlainTasks commands
+
+    python benchmarks/bench.py [--sizes 1000,10000] [--scenarios stats,archive] [--repeat 3] [--output FILE]
+
+Commands run against fake sublime/sublime_plugin modules from benchmarks/stubs
+on generated corpora (see corpus.py). Each result is printed to stdout as one
+json object per line:
+
+    {"scenario": "stats", "lines": 10000, "bytes": 512345, "repeat": 3,
+     "first": 0.081, "min": 0.079, "median": 0.080}
+
+Every run gets a fresh view, so the document model is built within timing;
+module level caches (e.g. resolved dates) stay warm after the first run,
+hence "first" and "min" are reported separately.
+
+Before timing, kinds of lines given by PlainTasksParser are compared with
+the ones the stubs derive from PlainTasks.sublime-syntax, differences are
+printed to stderr: parser based commands are only as right as this check.
+'''
+from __future__ import print_function
+import argparse
+import importlib
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(0, HERE)
+
+import sublime  # noqa: E402
+from corpus import generate  # noqa: E402
+
+SIZES = (1000, 10000, 50000, 200000)
+SETTINGS = {
+    'color_scheme': 'Packages/PlainTasks/tasks.hidden-tmTheme',
+    'highlight_past_due': True,
+    'new_on_top': True,
+}
+
+
+def load_plugin(names=('PlainTasks', 'PlainTasksDates', 'PlainTasksToHTML')):
+    '''Import plugin modules as package PlainTasks, the same way Sublime Text does'''
+    package = types.ModuleType('PlainTasks')
+    package.__path__ = [ROOT]
+    sys.modules['PlainTasks'] = package
+    packages = tempfile.mkdtemp(prefix='plaintasks-bench-')
+    os.symlink(ROOT, os.path.join(packages, 'PlainTasks'))
+    sublime._packages_path = packages
+    return dict((name, importlib.import_module('PlainTasks.' + name))
+                for name in names)
+
+
+def new_view(text):
+    return sublime.View(text, **SETTINGS)
+
+
+def select(view, *regions):
+    view.sel().clear()
+    for region in regions:
+        view.sel().add(region)
+
+
+# SCENARIOS, each one gets text and returns function to be timed
+
+def stats(plugin, text):
+    view = new_view(text)
+    return lambda: plugin['PlainTasks'].PlainTasksStatsStatus.get_stats(view)
+
+
+def highlight_past_due(plugin, text):
+    view = new_view(text)
+    return lambda: view.run_command('plain_tasks_toggle_highlight_past_due')
+
+
+def archive(plugin, text):
+    view = new_view(text)
+    return lambda: view.run_command('plain_tasks_archive')
+
+
+def sort_by_date(plugin, text):
+    view = new_view(text)
+    return lambda: view.run_command('plain_tasks_sort_by_date')
+
+
+def sort_by_due_and_priority(plugin, text):
+    view = new_view(text)
+    select(view, sublime.Region(0, view.size()))
+    return lambda: view.run_command('plain_tasks_sort_by_due_date_and_priority')
+
+
+def complete_all(plugin, text):
+    view = new_view(text)
+    select(view, sublime.Region(0, view.size()))
+    return lambda: view.run_command('plain_tasks_complete')
+
+
+def refresh_total_time(plugin, text):
+    view = new_view(text)
+    return lambda: view.run_command('plain_tasks_refresh_total_time')
+
+
+def typing(plugin, text):
+    '''Twenty keystrokes near the end of file, each followed by a lookup of line kind'''
+    view = new_view(text)
+    get_document = plugin['PlainTasks'].get_document
+    get_document(view)
+    pt = text.rfind(u'\n', 0, len(text) - 1)
+
+    def run():
+        for i in range(20):
+            view.insert(sublime.Edit(), pt + i, u'x')
+            get_document(view).kind(pt)
+    return run
+
+
+def fold_to_tags(plugin, text):
+    view = new_view(text)
+    match = re.search(u'(?m)^[ \t]*☐[^\n]*? @(high)', text)
+    select(view, match.start(1))
+    return lambda: view.run_command('plain_tasks_fold_to_tags')
+
+
+def html_export(plugin, text):
+    view = new_view(text)
+    return lambda: view.run_command('plain_tasks_convert_to_html', {'ask': True})
+
+
+SCENARIOS = (stats, highlight_past_due, archive, sort_by_date, sort_by_due_and_priority, complete_all, refresh_total_time,
+             typing, fold_to_tags, html_export)
+
+
+def check_parser(text):
+    '''Return list of (row, kind by parser, kind by syntax) for lines where they differ'''
+    from PlainTasksParser import classify_line
+    return [(row, classify_line(line), sublime.scope_line(line)[0]) for row, line in enumerate(text.split('\n'))
+            if classify_line(line) != sublime.scope_line(line)[0]]
+
+
+def run(plugin, scenario, text, repeat):
+    timings = []
+    for _ in range(repeat):
+        func = scenario(plugin, text)
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+        del sublime._timeouts[:]
+        sublime.active_window().views = []
+    ordered = sorted(timings)
+    return {
+        'scenario': scenario.__name__,
+        'lines': text.count('\n'),
+        'bytes': len(text.encode('utf8')),
+        'repeat': repeat,
+        'first': round(timings[0], 6),
+        'min': round(ordered[0], 6),
+        'median': round(ordered[len(ordered) // 2], 6),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless benchmarks of PlainTasks commands')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES), help='comma separated amounts of lines')
+    parser.add_argument('--scenarios', default='', help='comma separated names, all by default: %s' %
+                        ', '.join(s.__name__ for s in SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append results to this file as well')
+    args = parser.parse_args(argv)
+
+    chosen = set(filter(None, args.scenarios.split(',')))
+    scenarios = [s for s in SCENARIOS if not chosen or s.__name__ in chosen]
+    plugin = load_plugin()
+    output = open(args.output, 'a') if args.output else None
+    try:
+        for size in (int(s) for s in args.sizes.split(',')):
+            text = generate(size, args.seed)
+            differences = check_parser(text)
+            if differences:
+                print('%d lines of %d are classified by parser unlike syntax, e.g. %r' % (
+                    len(differences), size, differences[:5]), file=sys.stderr)
+            for scenario in scenarios:
+                result = run(plugin, scenario, text, args.repeat)
+                result['python'] = platform.python_version()
+                line = json.dumps(result, sort_keys=True)
+                print(line)
+                sys.stdout.flush()
+                if output:
+                    output.write(line + '\n')
+    finally:
+        if output:
+            output.close()
+        shutil.rmtree(sublime._packages_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# coding: utf-8
+'''Search of Org-Mode style archive: memory mapped byte regex against decoding line by line
+
+    python benchmarks/bench_archive.py [--mb 256] [--pattern "deploy server"]
+
+Archive of given size is generated into temporary folder from corpus.py
+tasks, blocks are written in the same format as PlainTasksArchive does.
+'''
+from __future__ import print_function
+import argparse
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+import PlainTasksArchive  # noqa: E402
+from corpus import Generator  # noqa: E402
+
+
+def write_archive(path, size):
+    generator = Generator()
+    with io.open(path, 'w', encoding='utf8', newline='\n') as f:
+        while f.tell() < size:
+            lines = generator.project('Project', 0, generator.random.randint(5, 40))
+            f.write(u'%s\nArchived %s:\n%s\n\n' % (PlainTasksArchive.SEPARATOR, generator.date(-400), u'\n'.join(lines)))
+
+
+def naive(path, text):
+    '''Read and decode whole file, return amount of matching lines'''
+    try:
+        rx = re.compile(text, re.I | re.U)
+    except re.error:
+        rx = re.compile(re.escape(text), re.I | re.U)
+    with io.open(path, encoding='utf8') as f:
+        return sum(1 for line in f if rx.search(line))
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return result, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=256)
+    parser.add_argument('--pattern', default='deploy server')
+    args = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp(prefix='plaintasks-archive-')
+    try:
+        path = os.path.join(folder, 'work_archive.todo')
+        write_archive(path, args.mb * 1024 * 1024)
+        pattern = PlainTasksArchive.Pattern(args.pattern)
+        found, mapped = timed(lambda: PlainTasksArchive.search(path, pattern))
+        count, decoded = timed(lambda: naive(path, args.pattern))
+        if len(found) != count:
+            raise AssertionError('mmap search found %d lines, naive %d' % (len(found), count))
+        print('%d MB, %d matching lines: mmap %.2f s, decoding %.2f s' % (
+            os.path.getsize(path) // (1024 * 1024), count, mapped, decoded))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# coding: utf-8
+'''Per-line cost of task patterns: strings passed to re functions vs precompiled ones
+
+    python benchmarks/bench_patterns.py [lines]
+
+"cold" column purges re's internal cache before every line, which is what
+happens when patterns of all commands and plugins together exceed its size.
+'''
+from __future__ import print_function
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PlainTasksPatterns as P  # noqa: E402
+
+
+SAMPLE = [
+    u'  ☐ buy milk @due(17-05-20 10:00) @high',
+    u'  ✔ write report @started(17-05-18 09:00) @toggle(17-05-18 12:00) @done (17-05-19 18:00)',
+    u'  ✘ call mom @cancelled (17-05-19 18:00) @project(Home)',
+    u'    a note with @tag',
+]
+
+# name, compiled pattern, method
+CASES = [
+    ('open task', P.OPEN_TASK_RE, 'match'),
+    ('done task', P.DONE_TASK_RE, 'match'),
+    ('cancelled task', P.CANCELLED_TASK_RE, 'match'),
+    ('started', P.STARTED_RE, 'findall'),
+    ('toggle', P.TOGGLE_RE, 'findall'),
+    ('due', P.DUE_RE, 'match'),
+    ('critical', P.CRITICAL_RE, 'match'),
+]
+
+
+def per_line(func, lines, number):
+    '''Return microseconds per line'''
+    seconds = min(timeit.repeat(lambda: [func(l) for l in lines], number=number, repeat=3))
+    return seconds / (number * len(lines)) * 1e6
+
+
+def main(amount=2000):
+    lines = (SAMPLE * (amount // len(SAMPLE) + 1))[:amount]
+    print('%-16s %12s %12s %12s' % ('pattern', 'str cold, us', 'str warm, us', 'compiled, us'))
+    for name, rx, method in CASES:
+        string_func = getattr(re, method)
+        compiled_func = getattr(rx, method)
+
+        def cold(line):
+            re.purge()
+            return string_func(rx.pattern, line, rx.flags)
+
+        def warm(line):
+            return string_func(rx.pattern, line, rx.flags)
+
+        print('%-16s %12.2f %12.2f %12.2f' % (
+            name, per_line(cold, lines, 1), per_line(warm, lines, 5), per_line(compiled_func, lines, 5)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,55 @@
+# coding: utf-8
+'''Parsing of color schemes by plist_parser: etree and SAX paths, binary plists
+
+    python benchmarks/bench_plist.py [more.tmTheme ...]
+
+Bundled tasks-*.hidden-tmTheme files are always parsed, pass paths of large
+third-party schemes to compare on them too. Binary column parses the same
+scheme converted to binary property list, it requires Python 3.4+.
+'''
+from __future__ import print_function
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import plist_parser  # noqa: E402
+
+try:
+    from plistlib import dumps, FMT_BINARY
+except ImportError:
+    dumps = None
+
+
+def per_call(func, number=20):
+    '''Return milliseconds per call'''
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e3
+
+
+def main(paths):
+    files = sorted(glob.glob(os.path.join(ROOT, 'tasks*.hidden-tmTheme'))) + paths
+    print('%-36s %8s %10s %10s %10s' % ('scheme', 'KB', 'etree, ms', 'sax, ms', 'binary, ms'))
+    for path in files:
+        with open(path, 'rb') as f:
+            data = f.read()
+        etree = plist_parser.XmlPropertyListParser()._parse_using_etree
+        sax = plist_parser.XmlPropertyListParser()._parse_using_sax_parser
+        result = etree(data)
+        if sax(data) != result:
+            raise AssertionError('etree and sax results differ for %s' % path)
+        if dumps:
+            binary = dumps(result, fmt=FMT_BINARY)
+            if plist_parser.parse_string(binary) != result:
+                raise AssertionError('binary result differs for %s' % path)
+            binary_ms = '%10.2f' % per_call(lambda: plist_parser.parse_string(binary))
+        else:
+            binary_ms = '%10s' % '-'
+        print('%-36s %8.1f %10.2f %10.2f %s' % (
+            os.path.basename(path)[:36], len(data) / 1024., per_call(lambda: etree(data)), per_call(lambda: sax(data)),
+            binary_ms))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
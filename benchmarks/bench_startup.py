@@ -0,0 +1,77 @@
+# coding: utf-8
+'''Cost of loading the plugin, measured in fresh interpreters
+
+    python benchmarks/bench_startup.py [--repeat 5] [--output FILE]
+
+Every run imports all plugin modules in the order Sublime Text does and calls
+their plugin_loaded, bytecode is compiled beforehand. Result is printed as one json object, like bench.py does;
+"eager" lists modules which are expected to be imported on first use only,
+but were imported on load anyway.
+'''
+from __future__ import print_function
+import argparse
+import compileall
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# heavy or seldom needed modules, plugin must not import them on load
+LAZY = ('dateutil', 'webbrowser', 'tempfile', 'sqlite3', 'concurrent.futures', 'xml.etree.ElementTree', 'xml.sax')
+
+
+def plugin_modules():
+    return sorted(name[:-3] for name in os.listdir(ROOT) if name.endswith('.py'))
+
+
+def child():
+    '''Load plugin once, print json with seconds spent and eagerly imported modules'''
+    sys.path.insert(0, HERE)
+    import bench
+    before = set(sys.modules)
+    start = time.time()
+    modules = bench.load_plugin(plugin_modules())
+    for name in plugin_modules():
+        if hasattr(modules[name], 'plugin_loaded'):
+            modules[name].plugin_loaded()
+    seconds = time.time() - start
+    eager = sorted(name for name in LAZY if name in sys.modules and name not in before)
+    print(json.dumps({'seconds': seconds, 'eager': eager}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cost of loading the plugin')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='append result to this file as well')
+    args = parser.parse_args(argv)
+
+    compileall.compile_dir(ROOT, maxlevels=0, quiet=1)  # bytecode is cached by Sublime Text as well
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child'])
+        runs.append(json.loads(out.decode('utf8').strip().splitlines()[-1]))
+    timings = sorted(r['seconds'] for r in runs)
+    line = json.dumps({
+        'scenario': 'startup',
+        'repeat': args.repeat,
+        'min': round(timings[0], 6),
+        'median': round(timings[len(timings) // 2], 6),
+        'eager': runs[0]['eager'],
+        'python': platform.python_version(),
+    }, sort_keys=True)
+    print(line)
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        child()
+    else:
+        main()
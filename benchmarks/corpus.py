@@ -0,0 +1,115 @@
+# coding: utf-8
+'''Generator of todo files for benchmarks
+
+    python benchmarks/corpus.py 10000 > big.todo
+
+Corpus contains nested projects, separators, pending/completed/cancelled
+tasks with tags (@due, @created, @started, priorities) and notes, and an
+archive section which takes about one fifth of lines.
+'''
+from __future__ import print_function
+import random
+import sys
+from datetime import datetime, timedelta
+
+
+DATE_FORMAT = '(%y-%m-%d %H:%M)'
+WORDS = ('buy', 'milk', 'write', 'report', 'call', 'mom', 'fix', 'bug', 'review', 'pull', 'request',
+         'update', 'docs', 'deploy', 'server', 'plan', 'meeting', 'read', 'book', 'clean', 'desk')
+
+
+class Generator(object):
+    def __init__(self, seed=0, now=None):
+        self.random = random.Random(seed)
+        now = now or datetime.now()
+        self.now = now.replace(minute=0, second=0, microsecond=0)
+
+    def words(self, amount):
+        return ' '.join(self.random.choice(WORDS) for _ in range(amount))
+
+    def date(self, days):
+        return (self.now + timedelta(days=days, hours=self.random.randint(0, 23))).strftime(DATE_FORMAT)
+
+    def tags(self):
+        tags = []
+        r = self.random.random()
+        if r < .3:
+            tags.append('@due%s' % self.date(self.random.randint(-10, 20)))
+        elif r < .35:
+            tags.append('@due(+%dd)' % self.random.randint(1, 9))
+        if self.random.random() < .2:
+            tags.append(self.random.choice(('@critical', '@high', '@low', '@today')))
+        if self.random.random() < .2:
+            tags.append('@created%s' % self.date(-self.random.randint(1, 30)))
+        if self.random.random() < .1:
+            tags.append('@started%s' % self.date(-self.random.randint(1, 5)))
+        if self.random.random() < .1:
+            tags.append('@' + self.random.choice(WORDS))
+        return tags
+
+    def task(self, indent):
+        text = self.words(self.random.randint(2, 8))
+        tags = self.tags()
+        r = self.random.random()
+        if r < .7:
+            line = u'%s☐ %s' % (indent, text)
+        elif r < .9:
+            line = u'%s✔ %s' % (indent, text)
+            tags.append('@done%s' % self.date(-self.random.randint(0, 30)))
+        else:
+            line = u'%s✘ %s' % (indent, text)
+            tags.append('@cancelled%s' % self.date(-self.random.randint(0, 30)))
+        return ' '.join([line] + tags)
+
+    def notes(self, indent):
+        if self.random.random() < .15:
+            return [u'%s%s' % (indent, self.words(self.random.randint(3, 10)))
+                    for _ in range(self.random.randint(1, 3))]
+        return []
+
+    def project(self, name, depth, budget):
+        indent = '  ' * depth
+        lines = [u'%s%s:%s' % (indent, name, ' @' + self.random.choice(WORDS) if self.random.random() < .1 else '')]
+        lines += self.notes(indent + '  ')
+        while len(lines) < budget:
+            r = self.random.random()
+            if r < .08 and depth < 3:
+                lines += self.project('%s %d' % (self.words(1).title(), len(lines)), depth + 1,
+                                      min(budget - len(lines), self.random.randint(5, 40)))
+            elif r < .1:
+                lines.append(u'%s  --- ✄ -----------' % indent)
+            else:
+                lines.append(self.task(indent + '  '))
+                lines += self.notes(indent + '    ')
+        return lines
+
+    def archive(self, amount):
+        lines = [u'＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿', u'Archive:']
+        while len(lines) < amount:
+            tag = self.random.choice(('@done', '@cancelled'))
+            bullet = u'✔' if tag == '@done' else u'✘'
+            lines.append(u' %s %s %s%s @project(%s)' % (bullet, self.words(self.random.randint(2, 8)), tag,
+                                                        self.date(-self.random.randint(30, 900)),
+                                                        self.words(1).title()))
+            lines += self.notes('  ')
+        return lines
+
+    def document(self, amount):
+        '''Return list of amount lines'''
+        archived = amount // 5
+        lines = []
+        while len(lines) < amount - archived:
+            lines += self.project('Project %d' % len(lines), 0,
+                                  min(amount - archived - len(lines), self.random.randint(20, 300)))
+            lines.append(u'')
+        lines += self.archive(amount - len(lines))
+        return lines[:amount]
+
+
+def generate(amount, seed=0, now=None):
+    '''Return text of todo file with given amount of lines'''
+    return u'\n'.join(Generator(seed, now).document(amount)) + u'\n'
+
+
+if __name__ == '__main__':
+    sys.stdout.write(generate(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
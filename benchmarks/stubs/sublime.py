@@ -0,0 +1,637 @@
+# coding: utf-8
+'''Minimal headless stand-in for Sublime Text API, enough to run PlainTasks commands
+
+Buffer is a plain string, so every edit costs O(size of buffer) here, while
+Sublime Text edits are cheap; numbers of edit heavy scenarios are pessimistic.
+Edits are reported to TextChangeListener subclasses as Sublime Text 4 does.
+Scopes are read from rules of PlainTasks.sublime-syntax rather than from
+PlainTasksParser, so commands which ask for scopes see the file the way the
+syntax does; bold and italic rules are not emulated.
+'''
+import os
+import re
+import sys
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+from PlainTasksParser import EMPTY, NOTE, PENDING, COMPLETED, CANCELLED, HEADER, SEPARATOR, ARCHIVE  # noqa: E402
+
+
+LITERAL = 1
+IGNORECASE = 2
+HIDDEN = 128
+DRAW_EMPTY = DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SQUIGGLY_UNDERLINE = 2048
+PERSISTENT = 16
+COOPERATE_WITH_AUTO_COMPLETE = 2
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+HOVER_TEXT = 1
+ENCODED_POSITION = 1
+CLASS_LINE_START = 128
+CLASS_LINE_END = 256
+LAYOUT_INLINE = 0
+LAYOUT_BELOW = 1
+LAYOUT_BLOCK = 2
+
+Rule = namedtuple('Rule', 'regex scope captures')
+
+
+def load_syntax(path=os.path.join(ROOT, 'PlainTasks.sublime-syntax')):
+    '''Return {context: [Rule]}, only single line matches with scope or meta_scope are read
+
+    It is not a YAML parser, just enough for layout of PlainTasks syntax.
+    '''
+    contexts, rules, rule, section = {}, None, None, None
+    with open(path, 'rb') as f:
+        lines = f.read().decode('utf8').splitlines()
+    for line in lines[lines.index('contexts:') + 1:]:
+        indent = len(line) - len(line.lstrip())
+        key, _, value = line.strip().lstrip('- ').partition(':')
+        value = value.strip()
+        if value[:1] == "'":
+            value = value[1:-1].replace("''", "'")
+        if indent == 2:
+            rules = contexts[key] = []
+        elif indent == 4 and key == 'match':
+            rule = Rule(value, [None], {})
+            rules.append(rule)
+            section = None
+        elif indent == 6:
+            section = key
+            if key == 'scope':
+                rule.scope[0] = value
+        elif indent == 8 and key == 'meta_scope' and section == 'push':
+            rule.scope[0] = value
+        elif indent == 8 and section == 'captures' and key.isdigit():
+            rule.captures[int(key)] = value
+    return dict((name, [Rule(compile_rule(r.regex), r.scope[0], r.captures) for r in rules if r.scope[0]])
+                for name, rules in contexts.items())
+
+
+def compile_rule(regex):
+    try:
+        return re.compile(regex, re.M)
+    except re.error:  # e.g. possessive quantifiers of Oniguruma before Python 3.11
+        return None
+
+
+SYNTAX = load_syntax()
+LINE_RULES = SYNTAX['main']
+# contexts included into lines of notes and pending tasks, in order of include
+INCLUDES = {
+    'notes.todo': SYNTAX['url'],
+    'meta.item.todo.pending': SYNTAX['url'] + SYNTAX['tag'] + SYNTAX['today'] + SYNTAX['low'] + SYNTAX['high'] + SYNTAX['critical'],
+}
+KINDS = {
+    'notes.todo': NOTE,
+    'meta.item.todo.pending': PENDING,
+    'meta.item.todo.completed': COMPLETED,
+    'meta.item.todo.cancelled': CANCELLED,
+    'keyword.control.header.todo': HEADER,
+    'meta.punctuation.separator.todo': SEPARATOR,
+    'meta.punctuation.archive.todo': ARCHIVE,
+}
+
+
+def scope_line(text):
+    '''Return kind, scope of line and list of (begin, end, scope) within it, as the syntax sees them'''
+    text += '\n'
+    for rule in LINE_RULES:
+        match = rule.regex.match(text)
+        if match:
+            break
+    else:
+        return EMPTY, '', []
+    tokens = [(match.start(i), match.end(i), name) for i, name in sorted(rule.captures.items())
+              if match.start(i) < match.end(i)]
+    pos, includes = match.end(), [r for r in INCLUDES.get(rule.scope, ()) if r.regex]
+    while includes and pos < len(text):
+        found = [(m.start(), i, m) for i, m in enumerate(r.regex.search(text, pos) for r in includes) if m]
+        if not found:
+            break
+        _, i, m = min(found, key=lambda f: f[:2])
+        tokens.append((m.start(), m.end(), includes[i].scope))
+        pos = max(m.end(), pos + 1)
+    return KINDS[rule.scope], rule.scope, tokens
+
+
+_packages_path = None  # set by harness, PlainTasks must be inside
+_timeouts = []
+_settings = {}
+_status = []
+_windows = []
+
+
+def version():
+    return '4126'
+
+
+def platform():
+    return 'linux'
+
+
+def arch():
+    return 'x64'
+
+
+def packages_path():
+    return _packages_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Packages')
+
+
+def installed_packages_path():
+    return packages_path()
+
+
+def cache_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache')
+
+
+def load_settings(name):
+    return _settings.setdefault(name, Settings())
+
+
+def save_settings(name):
+    pass
+
+
+def status_message(msg):
+    _status.append(msg)
+
+
+def error_message(msg):
+    _status.append(msg)
+
+
+def message_dialog(msg):
+    _status.append(msg)
+
+
+def set_clipboard(text):
+    pass
+
+
+def set_timeout(callback, delay=0):
+    # timers never fire by themselves, see run_timeouts
+    _timeouts.append(callback)
+
+
+set_timeout_async = set_timeout
+
+
+def run_timeouts():
+    while _timeouts:
+        _timeouts.pop(0)()
+
+
+def active_window():
+    if not _windows:
+        _windows.append(Window())
+    return _windows[0]
+
+
+def windows():
+    return [active_window()]
+
+
+class Region(object):
+    __slots__ = ('a', 'b', 'xpos')
+
+    def __init__(self, a, b=None, xpos=-1):
+        self.a = a
+        self.b = a if b is None else b
+        self.xpos = xpos
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.begin() < other.begin()
+
+    def __gt__(self, other):
+        return self.begin() > other.begin()
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __repr__(self):
+        return '(%d, %d)' % (self.a, self.b)
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def cover(self, other):
+        return Region(min(self.begin(), other.begin()), max(self.end(), other.end()))
+
+    def intersects(self, other):
+        return self.begin() < other.end() and other.begin() < self.end()
+
+    def intersection(self, other):
+        if not self.intersects(other):
+            return Region(0)
+        return Region(max(self.begin(), other.begin()), min(self.end(), other.end()))
+
+
+class Selection(object):
+    def __init__(self):
+        self.regions = []
+
+    def __iter__(self):
+        return iter(list(self.regions))
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, index):
+        return self.regions[index]
+
+    def add(self, region):
+        if not isinstance(region, Region):
+            region = Region(region)
+        self.regions.append(region)
+        self.regions.sort()
+
+    def add_all(self, regions):
+        for r in regions:
+            self.add(r)
+
+    def subtract(self, region):
+        self.regions = [r for r in self.regions if r != region]
+
+    def clear(self):
+        self.regions = []
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def erase(self, key):
+        self.pop(key, None)
+
+    def has(self, key):
+        return key in self
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class Edit(object):
+    pass
+
+
+HistoricPosition = namedtuple('HistoricPosition', 'pt row col col_utf16 col_utf8')
+TextChange = namedtuple('TextChange', 'a b len_utf16 len_utf8 str')
+
+
+class Buffer(object):
+    def __init__(self, view):
+        self._view = view
+        self._listeners = None  # TextChangeListener instances, attached on the first edit
+
+    def id(self):
+        return self._view.id()
+
+    def views(self):
+        return [self._view]
+
+    def primary_view(self):
+        return self._view
+
+
+class Window(object):
+    def __init__(self):
+        self.views = []
+
+    def id(self):
+        return 1
+
+    def active_view(self):
+        return self.views[-1] if self.views else None
+
+    def new_file(self):
+        view = View('')
+        self.views.append(view)
+        return view
+
+    def folders(self):
+        return []
+
+    def run_command(self, name, args=None):
+        pass
+
+    def show_quick_panel(self, items, on_select, *args, **kwargs):
+        pass
+
+    def open_file(self, name, flags=0):
+        return View('')
+
+    def status_message(self, msg):
+        status_message(msg)
+
+
+class Phantom(object):
+    def __init__(self, region, content, layout, on_navigate=None):
+        self.region = region
+        self.content = content
+
+
+class PhantomSet(object):
+    def __init__(self, view, key=''):
+        self.phantoms = []
+
+    def update(self, phantoms):
+        self.phantoms = phantoms
+
+
+class View(object):
+    _last_id = 0
+
+    def __init__(self, text, file_name=None, **settings):
+        View._last_id += 1
+        self._id = View._last_id
+        self._text = text
+        self._file_name = file_name
+        self._change_count = 0
+        self._settings = Settings(syntax='Packages/PlainTasks/PlainTasks.sublime-syntax', tab_size=4)
+        self._settings.update(settings)
+        self._sel = Selection()
+        self._regions = {}
+        self._status = {}
+        self._folded = []
+        self._kinds = {}  # line text: result of scope_line
+        self._buffer = Buffer(self)
+
+    # STATE
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def buffer(self):
+        return self._buffer
+
+    def is_valid(self):
+        return True
+
+    def window(self):
+        return active_window()
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return ''
+
+    def set_name(self, name):
+        pass
+
+    def set_syntax_file(self, syntax):
+        self._settings['syntax'] = syntax
+
+    def settings(self):
+        return self._settings
+
+    def change_count(self):
+        return self._change_count
+
+    def size(self):
+        return len(self._text)
+
+    def sel(self):
+        return self._sel
+
+    def set_status(self, key, value):
+        self._status[key] = value
+
+    def get_status(self, key):
+        return self._status.get(key, '')
+
+    def erase_status(self, key):
+        self._status.pop(key, None)
+
+    # TEXT
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self._text[x.begin():x.end()]
+        return self._text[x:x + 1]
+
+    def insert(self, edit, pt, text):
+        self._edit(pt, pt, text)
+        return len(text)
+
+    def erase(self, edit, region):
+        self._edit(region.begin(), region.end(), '')
+
+    def replace(self, edit, region, text):
+        self._edit(region.begin(), region.end(), text)
+
+    def _edit(self, a, b, text):
+        positions = [HistoricPosition(pt, row, col, col, col) for pt in (a, b) for row, col in [self.rowcol(pt)]]
+        self._text = self._text[:a] + text + self._text[b:]
+        self._change_count += 1
+        import sublime_plugin
+        sublime_plugin.notify_text_changed(self._buffer, [TextChange(positions[0], positions[1], len(text), len(text), text)])
+
+    def run_command(self, name, args=None):
+        import sublime_plugin
+        sublime_plugin.run_text_command(self, name, args or {})
+
+    # LINES
+
+    def line(self, x):
+        if isinstance(x, Region):
+            a = self._text.rfind('\n', 0, x.begin()) + 1
+            b = self._text.find('\n', x.end())
+        else:
+            a = self._text.rfind('\n', 0, x) + 1
+            b = self._text.find('\n', x)
+        return Region(a, len(self._text) if b < 0 else b)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.a, min(line.b + 1, len(self._text)))
+
+    def lines(self, region):
+        lines = []
+        pt = self.line(region.begin()).a
+        end = region.end()
+        while True:
+            line = self.line(pt)
+            lines.append(line)
+            if line.b >= end or line.b >= len(self._text):
+                return lines
+            pt = line.b + 1
+
+    split_by_newlines = lines
+
+    def rowcol(self, pt):
+        row = self._text.count('\n', 0, pt)
+        return row, pt - (self._text.rfind('\n', 0, pt) + 1)
+
+    def text_point(self, row, col):
+        pt = 0
+        for _ in range(row):
+            pt = self._text.find('\n', pt) + 1
+            if not pt:
+                return len(self._text)
+        return pt + col
+
+    def indentation_level(self, pt):
+        text = self.substr(self.line(pt))
+        tab_size = self._settings.get('tab_size', 4)
+        indent = text[:len(text) - len(text.lstrip(' \t'))]
+        return len(indent.expandtabs(tab_size)) // tab_size
+
+    def indented_region(self, pt):
+        '''Lines around pt whose indentation is not less than indentation of line at pt'''
+        level = self.indentation_level(pt)
+        if not level:
+            return Region(pt, pt)
+        line = self.line(pt)
+        a = b = line
+        while a.a > 0:
+            prev = self.line(a.a - 1)
+            if self.substr(prev).strip() and self.indentation_level(prev.a) < level:
+                break
+            a = prev
+        while b.b < len(self._text):
+            nxt = self.line(b.b + 1)
+            if self.substr(nxt).strip() and self.indentation_level(nxt.a) < level:
+                break
+            b = nxt
+        return Region(a.a, min(b.b + 1, len(self._text)))
+
+    # SEARCH
+
+    def find(self, pattern, start, flags=0):
+        if flags & LITERAL:
+            pt = self._text.find(pattern, start)
+            return Region(pt, pt + len(pattern)) if pt >= 0 else Region(-1, -1)
+        match = re.compile(pattern, re.M).search(self._text, start)
+        return Region(match.start(), match.end()) if match else Region(-1, -1)
+
+    def find_all(self, pattern, flags=0, fmt=None, extractions=None):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        regions = []
+        for match in re.compile(pattern, re.M).finditer(self._text):
+            regions.append(Region(match.start(), match.end()))
+            if fmt is not None and extractions is not None:
+                extractions.append(match.expand(fmt))
+        return regions
+
+    def find_by_selector(self, selector):
+        regions = []
+        pt = 0
+        for text in self._text.split('\n'):
+            for begin, end, scope in self._scopes(text)[2]:
+                if scope == selector or scope.startswith(selector + '.'):
+                    regions.append(Region(pt + begin, pt + end))
+            pt += len(text) + 1
+        return regions
+
+    # SCOPES
+
+    def _scopes(self, text):
+        scopes = self._kinds.get(text)
+        if scopes is None:
+            scopes = self._kinds[text] = scope_line(text)
+        return scopes
+
+    def scope_name(self, pt):
+        line = self.line(pt)
+        _, scope, tokens = self._scopes(self.substr(line))
+        col = pt - line.a
+        names = ['text.todo', scope] + [name for begin, end, name in tokens if begin <= col < end]
+        return ' '.join(n for n in names if n) + ' '
+
+    def score_selector(self, pt, selector):
+        return 1 if selector.startswith('text.todo') else 0
+
+    def match_selector(self, pt, selector):
+        return selector in self.scope_name(pt)
+
+    def extract_scope(self, pt):
+        return self.line(pt)
+
+    def classify(self, pt):
+        return 0
+
+    # REGIONS
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        self._regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return list(self._regions.get(key, []))
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    def fold(self, x):
+        self._folded.extend(x if isinstance(x, list) else [x])
+        return True
+
+    def unfold(self, x):
+        self._folded = []
+        return []
+
+    def folded_regions(self):
+        return list(self._folded)
+
+    # VIEWPORT
+
+    def show(self, x, show_surrounds=True):
+        pass
+
+    def show_at_center(self, x):
+        pass
+
+    def show_popup(self, *args, **kwargs):
+        pass
+
+    def update_popup(self, content):
+        pass
+
+    def hide_popup(self):
+        pass
+
+    def viewport_position(self):
+        return (0, 0)
+
+    def set_viewport_position(self, xy, animate=True):
+        pass
+
+    def viewport_extent(self):
+        return (800, 600)
@@ -0,0 +1,85 @@
+# coding: utf-8
+'''Minimal headless stand-in for sublime_plugin, commands are found by snake case name'''
+import re
+
+import sublime
+
+
+class Command(object):
+    def is_enabled(self, *args, **kwargs):
+        return True
+
+    def is_visible(self, *args, **kwargs):
+        return True
+
+
+class ApplicationCommand(Command):
+    pass
+
+
+class WindowCommand(Command):
+    def __init__(self, window):
+        self.window = window
+
+
+class TextCommand(Command):
+    def __init__(self, view):
+        self.view = view
+
+
+class EventListener(object):
+    pass
+
+
+class ViewEventListener(object):
+    def __init__(self, view):
+        self.view = view
+
+    @classmethod
+    def is_applicable(cls, settings):
+        return True
+
+
+class TextChangeListener(object):
+    def __init__(self):
+        self.buffer = None
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        return False
+
+    def attach(self, buffer):
+        self.buffer = buffer
+        buffer._listeners.append(self)
+
+
+def command_name(cls):
+    '''PlainTasksArchiveCommand → plain_tasks_archive'''
+    name = cls.__name__
+    if name.endswith('Command'):
+        name = name[:-len('Command')]
+    return re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', name).lower()
+
+
+def all_subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        for s in all_subclasses(sub):
+            yield s
+
+
+def run_text_command(view, name, args):
+    for cls in all_subclasses(TextCommand):
+        if command_name(cls) == name:
+            return cls(view).run(sublime.Edit(), **args)
+    raise KeyError('text command %r is not found' % name)
+
+
+def notify_text_changed(buffer, changes):
+    if buffer._listeners is None:
+        buffer._listeners = []
+        for cls in all_subclasses(TextChangeListener):
+            if cls.is_applicable(buffer):
+                cls().attach(buffer)
+    for listener in buffer._listeners:
+        listener.on_text_changed(changes)
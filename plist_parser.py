@@ -5,6 +5,7 @@ boolean, and container object.
 
 This file contains a class ``XmlPropertyListParser`` for parse
 a property list file and get back a python native data structure.
+Binary property lists are read with ``plistlib`` (Python 3.4+).
 
     :copyright: 2008 by Takanori Ishikawa <takanori.ishikawa@gmail.com>
     :license: MIT (See LICENSE file for more details)
@@ -16,10 +17,13 @@ import re
 import sys
 
 
-if sys.version_info >= (3,):
+PY3 = sys.version_info >= (3,)
+if PY3:
     # Some forwards compatability
     basestring = str
 
+BINARY_HEADER = b'bplist00'
+
 
 class PropertyListParseError(Exception):
     """Raised when parsing a property list is failed."""
@@ -95,11 +99,12 @@ class XmlPropertyListParser(object):
             # Creates character string from buffered characters.
             content = ''.join(self.__characters)
             # For compatibility with ``xml.etree`` and ``plistlib``,
-            # convert text string to ascii, if possible
-            try:
-                content = content.encode('ascii')
-            except (UnicodeError, AttributeError):
-                pass
+            # convert text string to ascii, if possible (there is no str vs unicode in Python 3)
+            if not PY3:
+                try:
+                    content = content.encode('ascii')
+                except (UnicodeError, AttributeError):
+                    pass
             XmlPropertyListParser.PARSE_CALLBACKS[name](self, name, content)
             self.__characters = None
 
@@ -235,31 +240,42 @@ class XmlPropertyListParser(object):
     # XmlPropertyListParser
     # ------------------------------------------------
     def _to_stream(self, io_or_string):
-        if isinstance(io_or_string, basestring):
-            # Creates a string stream for in-memory contents.
-            from cStringIO import StringIO
-            return StringIO(io_or_string)
+        if isinstance(io_or_string, bytes):
+            # Creates a byte stream for in-memory contents, parser reads encoding from xml declaration.
+            from io import BytesIO
+            return BytesIO(io_or_string)
+        elif isinstance(io_or_string, basestring):
+            from io import BytesIO
+            return BytesIO(io_or_string.encode('utf-8'))
         elif hasattr(io_or_string, 'read') and callable(getattr(io_or_string, 'read')):
             return io_or_string
         else:
             raise TypeError('Can\'t convert %s to file-like-object' % type(io_or_string))
 
     def _parse_using_etree(self, xml_input):
-        from xml.etree.cElementTree import iterparse
+        try:
+            from xml.etree.cElementTree import iterparse
+        except ImportError:
+            # Python 3.3+ uses C accelerator by itself, cElementTree is removed in 3.9
+            from xml.etree.ElementTree import iterparse
 
+        start_callbacks = XmlPropertyListParser.START_CALLBACKS
+        end_callbacks = XmlPropertyListParser.END_CALLBACKS
+        parse_callbacks = XmlPropertyListParser.PARSE_CALLBACKS
         parser = iterparse(self._to_stream(xml_input), events=('start', 'end'))
         self.startDocument()
         try:
             for action, element in parser:
                 name = element.tag
                 if action == 'start':
-                    if name in XmlPropertyListParser.START_CALLBACKS:
-                        XmlPropertyListParser.START_CALLBACKS[name](self, element.tag, element.attrib)
-                elif action == 'end':
-                    if name in XmlPropertyListParser.END_CALLBACKS:
-                        XmlPropertyListParser.END_CALLBACKS[name](self, name)
-                    if name in XmlPropertyListParser.PARSE_CALLBACKS:
-                        XmlPropertyListParser.PARSE_CALLBACKS[name](self, name, element.text or "")
+                    if name in start_callbacks:
+                        start_callbacks[name](self, name, element.attrib)
+                else:
+                    if name in end_callbacks:
+                        end_callbacks[name](self, name)
+                    elif name in parse_callbacks:
+                        parse_callbacks[name](self, name, element.text or "")
+                    # values are already taken, so the tree does not grow with file
                     element.clear()
         except SyntaxError as e:
             raise PropertyListParseError(e)
@@ -297,14 +313,33 @@ class XmlPropertyListParser(object):
             return self._parse_using_sax_parser(xml_input)
 
 
+def parse_binary(data):
+    """Parse bytes of binary property list and return the resulting object.
+    """
+    try:
+        from plistlib import loads, FMT_BINARY
+    except ImportError:
+        raise PropertyListParseError("binary property lists require Python 3.4 or newer")
+    try:
+        return loads(data, fmt=FMT_BINARY)
+    except Exception as e:
+        raise PropertyListParseError(e)
+
+
 def parse_string(io_or_string):
     """Parse a string (or a stream) and return the resulting object.
     """
+    if isinstance(io_or_string, bytes) and io_or_string.startswith(BINARY_HEADER):
+        return parse_binary(io_or_string)
     return XmlPropertyListParser().parse(io_or_string)
 
 
 def parse_file(file_path):
     """Parse the specified file and return the resulting object.
     """
-    with open(file_path) as f:
+    # bytes, so xml parser takes encoding from declaration rather than from locale
+    with open(file_path, 'rb') as f:
+        if f.read(len(BINARY_HEADER)) == BINARY_HEADER:
+            return parse_binary(BINARY_HEADER + f.read())
+        f.seek(0)
         return XmlPropertyListParser().parse(f)
@@ -8,9 +8,19 @@ from datetime import datetime, timedelta
 ST3 = int(sublime.version()) >= 3000
 
 if ST3:
+    PlainTasks = sys.modules['PlainTasks.PlainTasks']
+    PlainTasksArchive = sys.modules['PlainTasks.PlainTasksArchive']
     PlainTasksDates = sys.modules['PlainTasks.PlainTasksDates']
+    PlainTasksDocument = sys.modules['PlainTasks.PlainTasksDocument']
+    PlainTasksParser = sys.modules['PlainTasks.PlainTasksParser']
+    PlainTasksQuery = sys.modules['PlainTasks.PlainTasksQuery']
 else:
+    PlainTasks = sys.modules['PlainTasks']
+    PlainTasksArchive = sys.modules['PlainTasksArchive']
     PlainTasksDates = sys.modules['PlainTasksDates']
+    PlainTasksDocument = sys.modules['PlainTasksDocument']
+    PlainTasksParser = sys.modules['PlainTasksParser']
+    PlainTasksQuery = sys.modules['PlainTasksQuery']
 
 
 class TestDatesFunctions(TestCase):
@@ -105,6 +115,14 @@ class TestDatesFunctions(TestCase):
                                                         c.get('date_format', default_format))
             self.assertEqual(date, c['result'])
 
+    def test_created_error(self):
+        fmt, default = '(%y-%m-%d %H:%M)', datetime(2016, 12, 1, 10, 0)
+        date, error = PlainTasksDates.resolve_date('(++1d)', fmt, default, '(16-02-30)')
+        self.assertEqual((date, error), (datetime(2016, 12, 2, 10, 0), None))
+        self.assertTrue(PlainTasksDates.created_error('(++1d)', fmt, default, '(16-02-30)'))
+        self.assertIsNone(PlainTasksDates.created_error('(+1d)', fmt, default, '(16-02-30)'))
+        self.assertIsNone(PlainTasksDates.created_error('(++1d)', fmt, default, '(16-11-30 09:00)'))
+
     def test_format_delta(self):
         class View(object):
             def __init__(self, decimal=False):
@@ -149,3 +167,199 @@ class TestDatesFunctions(TestCase):
         for (date_format, result) in cases:
             df = PlainTasksDates.is_dayfirst(date_format)
             self.assertEqual(df, result)
+
+    def test_spent_time(self):
+        cases = [
+            [u'☐ a @lasted(1:30)', timedelta(hours=1, minutes=30)],
+            [u'☐ a @wasted(2 days, 0:10:05)', timedelta(days=2, minutes=10, seconds=5)],
+            [u'☐ a @lasted(1.50) @wasted(1 day, 0.25)', timedelta(days=1, hours=1.75)],
+            [u'Project: @total(5:00)', timedelta()],
+        ]
+        for text, result in cases:
+            self.assertEqual(PlainTasksDates.spent_time(text), result, text)
+
+
+class TestParser(TestCase):
+
+    def test_classify_line(self):
+        P = PlainTasksParser
+        cases = [
+            ['Project:', P.HEADER],
+            ['  Nested: @tag(1)', P.HEADER],
+            [u' ☐ task', P.PENDING],
+            [' [ ] task', P.PENDING],
+            [' - task @done', P.COMPLETED],
+            [u' ✔ task @done (16-12-31 23:00)', P.COMPLETED],
+            [' [x] task', P.COMPLETED],
+            [u' ✘ task @cancelled', P.CANCELLED],
+            [' - task @cancelled(16-12-31 23:00)', P.CANCELLED],
+            [u' ☐ task @done', P.EMPTY],
+            ['   note: with colon inside', P.NOTE],
+            [u'--- ✄ -----------------------', P.SEPARATOR],
+            [u'＿＿＿＿＿＿', P.ARCHIVE],
+            ['', P.EMPTY],
+        ]
+        for (text, kind) in cases:
+            self.assertEqual(P.classify_line(text), kind, text)
+
+    def test_parse_tags(self):
+        tags = PlainTasksParser.parse_tags(u' ☐ task @due(+2d) @high @done (16-12-31 23:00) e@mail')
+        self.assertEqual([(t.name, t.arg) for t in tags],
+                         [('due', '+2d'), ('high', None), ('done', '16-12-31 23:00')])
+
+    def test_iter_parse(self):
+        text = [u'A:', u' ☐ a', u' B:', u'  ✔ b @done', u' ☐ c', u'--- ✄ ---', u'  ✘ d', u'＿＿＿', u'Archive:', u' ✔ e']
+        lines = list(PlainTasksParser.iter_parse(text, tab_size=2))
+        self.assertEqual([l.projects for l in lines if l.kind in PlainTasksParser.TASKS],
+                         [('A', ), ('A', 'B'), ('A', ), (), ('Archive', )])
+        self.assertEqual([l.archived for l in lines if l.kind in PlainTasksParser.TASKS],
+                         [False, False, False, False, True])
+
+
+class TestDocument(TestCase):
+
+    def test_apply_changes(self):
+        from collections import namedtuple
+        Position = namedtuple('Position', 'pt row col')
+        Change = namedtuple('Change', 'a b str')
+
+        class View(object):
+            text, count = u'A:\n ☐ a\n ☐ b\nB:\n ✔ c @done', 0
+
+            def change_count(self): return self.count
+
+            def size(self): return len(self.text)
+
+            def substr(self, region): return self.text[region.a:region.b]
+
+            def settings(self): return {}
+
+            def replace(self, a, b, text):
+                """Edit text, return TextChange of the edit"""
+                a, b = [Position(pt, self.text.count('\n', 0, pt), pt - self.text.rfind('\n', 0, pt) - 1) for pt in (a, b)]
+                self.text, self.count = self.text[:a.pt] + text + self.text[b.pt:], self.count + 1
+                return Change(a, b, text)
+
+        view = View()
+        doc = PlainTasksDocument.Document(view).sync()
+        doc._changes = []
+        doc.record([view.replace(6, 7, u'aa @high\n ☐ new'), view.replace(0, 3, u''), view.replace(view.size(), view.size(), u'\n')])
+        self.assertEqual(doc.sync().snapshot(), PlainTasksDocument.Document(view).sync().snapshot())
+        self.assertEqual(doc.text, view.text)
+
+        view.count += 1
+        doc.record([Change(Position(0, 0, 0), Position(0, 0, 0), u'lost')])  # does not add up to size of buffer
+        self.assertEqual(doc.sync().lines, view.text.split('\n'))
+
+
+class TestArchive(TestCase):
+
+    def test_sort_archive(self):
+        lines = [u'Archive:',
+                 u' ✔ a @done(02.01.2017 10:00)',
+                 u' ✘ b @cancelled(11.12.2016 09:00)',
+                 u'    note of b',
+                 u' ✔ c @done',
+                 u'    note of c',
+                 u' ✔ d @done(03.01.2017 08:00)',
+                 u'',
+                 u'Next:',
+                 u' ✔ e @done(01.01.2010 08:00)']
+        self.assertEqual(PlainTasks.sort_archive(lines, 0, '(%d.%m.%Y %H:%M)'),
+                         [lines[0], lines[6], lines[1], lines[2], lines[3], lines[4], lines[5]] + lines[7:])
+        self.assertEqual(PlainTasks.sort_archive(lines, 0, '(%d.%m.%Y %H:%M)', new_on_top=False),
+                         [lines[0], lines[2], lines[3], lines[1], lines[6], lines[4], lines[5]] + lines[7:])
+
+    def test_store(self):
+        import os, shutil, tempfile
+        folder = tempfile.mkdtemp()
+        try:
+            store = PlainTasksArchive.ArchiveStore(os.path.join(folder, 'a_archive.todo'), max_size=1, compress=True)
+            first = store.append(u'Work:\n  ✔ a', datetime(2017, 1, 2, 10, 0), u'Work')
+            self.assertEqual(store.rotate(datetime(2017, 1, 3)), 1)
+            store.compress_segment(1)
+            second = store.append(u'Home:\n  ✔ b', datetime(2017, 1, 3, 10, 0), u'Home')
+            self.assertEqual(store.entries(), [first, second])
+            self.assertEqual((first.segment, first.offset, second.segment, second.offset), (1, 0, 2, 0))
+            self.assertTrue(os.path.exists(store.segment_path(1, compressed=True)))
+            self.assertEqual(store.find(u'Work'), [first])
+            self.assertTrue(store.read(first).endswith(u'Archived 2017-01-02T10:00:00:\nWork:\n  ✔ a\n'))
+
+            pattern = PlainTasksArchive.Pattern(u'✔ [AB]')
+            found = [f for path in store.segments() for f in PlainTasksArchive.search(path, pattern)]
+            self.assertEqual([(f.row, f.text, f.archived) for f in found],
+                             [(3, u'  ✔ a', u'2017-01-02T10:00:00'), (3, u'  ✔ b', u'2017-01-03T10:00:00')])
+            self.assertEqual(PlainTasksArchive.read_block(store.segments()[0], found[0].block), store.read(first))
+            data = u'Café\nCAFÉ\ncafe\n'.encode('utf8')
+            for text in (u'café', u'caf[é]'):
+                found = PlainTasksArchive.search_buffer('', data, PlainTasksArchive.Pattern(text))
+                self.assertEqual([f.text for f in found], [u'Café', u'CAFÉ'], text)
+
+            store = PlainTasksArchive.ArchiveStore(store.path, period='month')
+            self.assertEqual(store.rotate(datetime(2017, 1, 31)), None)
+            self.assertEqual(store.rotate(datetime(2017, 2, 1)), 2)
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestQuery(TestCase):
+
+    def test_filter(self):
+        Q, P = PlainTasksQuery, PlainTasksParser
+        tasks = [
+            Q.Task('a.todo', 1, P.PENDING, u'☐ a @critical @due(16-12-31 10:00)', (('critical', None), ('due', '16-12-31 10:00')), ('Work', ), False),
+            Q.Task('a.todo', 2, P.PENDING, u'☐ b @due(17-01-10 10:00)', (('due', '17-01-10 10:00'), ), ('Home', ), False),
+            Q.Task('a.todo', 3, P.COMPLETED, u'✔ c @critical @done', (('critical', None), ('done', None)), ('Work', ), False),
+            Q.Task('a.todo', 9, P.PENDING, u'☐ d @critical', (('critical', None), ), (), True),
+        ]
+        now = datetime(2016, 12, 30, 12, 0)
+        cases = [
+            ['', [1, 2, 3]],
+            ['is:pending', [1, 2]],
+            ['is:pending in:archive', [1, 2, 9]],
+            ['@critical', [1, 3]],
+            ['-@critical', [2]],
+            ['due:week', [1]],
+            ['due:overdue', []],
+            ['due:2017-01-01..2017-01-31', [2]],
+            ['project:wor -done', [1]],
+        ]
+        for text, rows in cases:
+            self.assertEqual([t.row for t in Q.Query(text, now).filter(tasks)], rows, text)
+        self.assertRaises(ValueError, Q.Query, 'due:soon')
+
+    def test_index(self):
+        import os, shutil, tempfile
+        Q = PlainTasksQuery
+        if Q.load_sqlite3() is None:
+            return
+        folder = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(folder, 'a.todo')
+            with open(file_name, 'w') as f:
+                f.write('Work:\n  ☐ a @due(16-12-31 10:00)\n  ✔ b @due(+1d) @done(16-12-30 09:00)\n')
+            db_path = os.path.join(folder, 'index', 'tasks.sqlite')
+            self.assertEqual(Q.TaskIndex(db_path).update([file_name]), 1)
+            db = Q.load_sqlite3().connect(db_path)
+            self.assertEqual(db.execute('SELECT due_at, done_at FROM tasks ORDER BY row').fetchall(),
+                             [('2016-12-31T10:00:00', None), (None, '2016-12-30T09:00:00')])
+            db.close()
+            index = Q.TaskIndex(db_path)
+            self.assertEqual(index.update([file_name]), 0)
+            self.assertEqual(list(index.tasks([file_name])), Q.read_tasks(file_name)[2])
+            os.utime(file_name, (0, 0))
+            self.assertEqual(Q.TaskIndex(db_path).update([file_name]), 1)
+            os.remove(file_name)
+            index.update([file_name])
+            self.assertEqual(list(index.tasks([file_name])), [])
+
+            moved = os.path.join(folder, 'b.todo')
+            with open(moved, 'w') as f:
+                f.write('☐ b\n')
+            index.update([moved])
+            self.assertEqual(list(index.files), [moved])
+            index.update([])
+            self.assertEqual(index.files, {})
+            self.assertEqual(index.update([moved]), 1)  # database entry is dropped too
+        finally:
+            shutil.rmtree(folder)